@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Inspect and prune the steps cache of a project.
+Usage: scipion cache PROJECT [options]
+"""
+
+import os
+import sys
+import argparse
+
+from pyworkflow.manager import Manager
+from pyworkflow.project import Project
+import pyworkflow.utils as pwutils
+
+
+def getProjectPath(projName):
+    """ Return the path of the project, given its name or its path. """
+    if os.path.isdir(projName):
+        return os.path.abspath(projName)
+    manager = Manager()
+    if projName == 'last':
+        projects = manager.listProjects()
+        if not projects:
+            sys.exit("No projects yet, cannot use the last one.")
+        projName = projects[0].projName
+    projPath = manager.getProjectPath(projName)
+    if not os.path.isdir(projPath):
+        sys.exit("Project '%s' does not exist." % projName)
+    return projPath
+
+
+def printEntries(entries):
+    print "%-12s %-30s %-25s %10s  %s" % ('KEY', 'PROTOCOL', 'FUNCTION',
+                                          'SIZE', 'LAST USED')
+    for e in entries:
+        print "%-12s %-30s %-25s %10s  %s" % (e['key'][:12],
+                                              e.get('protocol', ''),
+                                              e.get('funcName', ''),
+                                              pwutils.prettySize(e['size']),
+                                              pwutils.prettyDate(e['lastUsed']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project',
+                        help="Project name (or path). 'last' for the last used project.")
+    parser.add_argument('--enable', nargs='?', const='', metavar='PATH',
+                        help="Enable the steps cache of the project. If PATH "
+                             "is given, it will be used as cache folder "
+                             "(it can be shared between projects).")
+    parser.add_argument('--disable', action='store_true',
+                        help="Disable the steps cache of the project. "
+                             "Cached results are only deleted if the cache "
+                             "folder is inside the project.")
+    parser.add_argument('--list', action='store_true',
+                        help="List the cache entries.")
+    parser.add_argument('--prune', action='store_true',
+                        help="Remove entries according to --max-size "
+                             "and --max-age.")
+    parser.add_argument('--max-size', type=float, metavar='GB',
+                        help="Maximum size of the cache, the least recently "
+                             "used entries are removed first.")
+    parser.add_argument('--max-age', type=float, metavar='DAYS',
+                        help="Remove entries not used in more than DAYS.")
+    parser.add_argument('--clear', action='store_true',
+                        help="Remove all the cache entries.")
+    args = parser.parse_args()
+
+    project = Project(getProjectPath(args.project))
+    cachePath = project.getStepsCachePath()
+
+    if args.enable is not None:
+        if os.path.lexists(cachePath):
+            sys.exit("Steps cache is already enabled: %s" % os.path.realpath(cachePath))
+        if args.enable:
+            pwutils.makePath(args.enable)
+            os.symlink(os.path.abspath(args.enable), cachePath)
+        else:
+            pwutils.makePath(cachePath)
+
+    if args.disable:
+        if os.path.islink(cachePath):
+            os.remove(cachePath)
+        else:
+            pwutils.cleanPath(cachePath)
+        print "Steps cache disabled."
+        sys.exit(0)
+
+    cache = project.getStepsCache()
+
+    if cache is None:
+        sys.exit("Steps cache is not enabled for this project, "
+                 "use --enable to enable it.")
+
+    if args.clear:
+        cache.clear()
+
+    if args.prune:
+        if args.max_size is None and args.max_age is None:
+            sys.exit("Use --max-size and/or --max-age with --prune.")
+        maxSize = None if args.max_size is None else int(args.max_size * 1024**3)
+        removed = cache.prune(maxSize=maxSize, maxAge=args.max_age)
+        print "Removed %d entries (%s)" % (len(removed),
+                                           pwutils.prettySize(sum(e['size'] for e in removed)))
+
+    entries = list(cache.iterEntries())
+
+    if args.list:
+        printEntries(entries)
+
+    print "Steps cache: %s" % os.path.realpath(cachePath)
+    print "  %d entries, %s" % (len(entries),
+                                pwutils.prettySize(sum(e['size'] for e in entries)))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Print the resources used by the steps of a protocol run.
+Usage: scipion profile RUN [options]
+"""
+
+import os
+import sys
+import argparse
+
+from pyworkflow.protocol.protocol import StepSet
+from pyworkflow.protocol.profiling import formatStepsProfile
+
+
+def getStepsFile(runPath):
+    """ Return the steps file given the run folder or the file itself. """
+    if os.path.isdir(runPath):
+        runPath = os.path.join(runPath, 'logs', 'steps.sqlite')
+    if not os.path.exists(runPath):
+        sys.exit("Steps file '%s' does not exist." % runPath)
+    return runPath
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run',
+                        help="Run folder (e.g. PROJECT/Runs/000123_ProtCTFFind) "
+                             "or its logs/steps.sqlite file.")
+    parser.add_argument('--top', type=int, default=10,
+                        help="Number of steps shown, the ones that "
+                             "took more time.")
+    args = parser.parse_args()
+
+    stepsSet = StepSet(filename=getStepsFile(args.run))
+    steps = [step.clone() for step in stepsSet]
+    stepsSet.close()
+
+    for line in formatStepsProfile(steps, args.top):
+        print line
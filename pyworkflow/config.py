@@ -100,6 +100,8 @@ def loadHostsConf(hostsConf):
             # Read the address of the remote hosts, 
             # using 'localhost' as default for backward compatibility
             host.setAddress(get('ADDRESS', 'localhost'))
+            host.maxCores.set(get('MAX_CORES'))
+            host.maxMemory.set(get('MAX_MEMORY'))
             host.mpiCommand.set(get('PARALLEL_COMMAND'))
             host.queueSystem = pwhosts.QueueSystemConfig()
             host.queueSystem.name.set(get('NAME'))
@@ -113,6 +115,9 @@ def loadHostsConf(hostsConf):
                 host.queueSystem.submitTemplate.set(get('SUBMIT_TEMPLATE'))
                 host.queueSystem.cancelCommand.set(get('CANCEL_COMMAND'))
                 host.queueSystem.checkCommand.set(get('CHECK_COMMAND'))
+                host.queueSystem.submitArrayCommand.set(get('SUBMIT_ARRAY_COMMAND'))
+                host.queueSystem.submitDependentCommand.set(get('SUBMIT_DEPENDENT_COMMAND'))
+                host.queueSystem.arrayTaskId.set(get('ARRAY_TASK_ID'))
     
                 host.queueSystem.queues = getDict('QUEUES')
                 host.queueSystem.queuesDefault = getDict('QUEUES_DEFAULT')
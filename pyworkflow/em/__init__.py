@@ -41,9 +41,14 @@ from pyworkflow.wizard import Wizard
 from viewer import *
 #from pprint import pprint
 import transformations
+from registry import ClassesRegistry, LazyClassesDict
 #from packages import *
 
 PACKAGES_PATH = os.path.join(pw.HOME, 'em', 'packages')
+# File where the classes of the packages are registered (see getRegistry)
+REGISTRY_FILE = os.environ.get('SCIPION_EM_REGISTRY',
+                               os.path.join(pw.SCIPION_USER_DATA, 'tmp',
+                                            'em_registry.json'))
 
 _emPackagesDict = None
 
@@ -95,13 +100,64 @@ def getWizards():
     return _emWizardsDict
         
         
+_emRegistry = None
+_emRegistryRebuilt = False
+
+def getRegistry():
+    """ Return the registry of the classes in EM packages, it is
+    read from REGISTRY_FILE or built (loading all packages) if
+    the packages have changed.
+    """
+    global _emRegistry
+    if _emRegistry is None:
+        # Classes are also defined in pyworkflow.em (not only in packages)
+        registry = ClassesRegistry(REGISTRY_FILE, PACKAGES_PATH,
+                                   [os.path.dirname(__file__)])
+        if not registry.load():
+            _buildRegistry(registry)
+        _emRegistry = registry
+    return _emRegistry
+
+def _buildRegistry(registry):
+    """ Build the registry loading all the packages. """
+    classes = dict(getProtocols())
+    classes.update(getObjects())
+    registry.build(classes, getViewers(), getWizards(),
+                   [sys.modules[__name__]], getPackages())
+
+_emClassesDict = None
+
+def getClassesDict():
+    """ Return a dictionary with all classes that can be stored in a
+    project (pyworkflow.object classes, EM objects and protocols).
+    The classes of the EM packages are imported when they are first
+    accessed, so it is much cheaper than getProtocols and getObjects.
+    """
+    global _emClassesDict
+    if _emClassesDict is None:
+        import pyworkflow.object as pwobj
+        _emClassesDict = LazyClassesDict(getRegistry(), pwobj.__dict__)
+    return _emClassesDict
+        
+        
 def findClass(className):
+    global _emRegistryRebuilt
     
-    if className in getProtocols():
-        return getProtocols()[className]
+    if getRegistry().hasClass(className):
+        cls = getClassesDict().get(className)
+        if cls is not None:
+            return cls
     
-    if className in getObjects():
-        return getObjects()[className]
+    # The registry could be out of date (e.g. modified files not
+    # taken into account), so build it again (only once)
+    if not _emRegistryRebuilt:
+        _emRegistryRebuilt = True
+        _buildRegistry(getRegistry())
+        return findClass(className)
+    
+    cls = getProtocols().get(className) or getObjects().get(className)
+    if cls is not None:
+        return cls
     
     raise Exception("findClass: class '%s' not found." % className)
 
@@ -119,16 +175,12 @@ def findSubClasses(classDict, className):
 
 def findViewers(className, environment):
     """ Find the available viewers for this class. """
-    viewers = []
+    registry = getRegistry()
     cls = findClass(className)
-    baseClasses = cls.mro()
-    for viewer in getViewers().values():
-        if environment in viewer._environments:
-            for t in viewer._targets:
-                if t in baseClasses:
-                    viewers.append(viewer)
-                    break
-    return viewers
+    baseClasses = [c.__name__ for c in cls.mro()]
+    viewers = [registry.getViewer(name)
+               for name in registry.findViewers(baseClasses, environment)]
+    return [v for v in viewers if v is not None]
 
 
 #TODO: If we divide the way to find wizards for web
@@ -150,7 +202,12 @@ def findWizards(protocol, environment):
     """ Find availables wizards for this class. 
     Returns:
         a dict with the paramName and wizards for this class."""
-    return findWizardsFromDict(protocol, environment, getWizards())
+    registry = getRegistry()
+    baseClasses = [cls.__name__ for cls in protocol.getClass().mro()]
+    wizDict = dict((name, registry.getWizard(name))
+                   for name in registry.findWizards(baseClasses, environment))
+    return findWizardsFromDict(protocol, environment,
+                               dict((k, v) for k, v in wizDict.iteritems() if v is not None))
 
 # Update global dictionary with variables found
 #globals().update(emProtocolsDict)
@@ -161,6 +218,6 @@ def loadSetFromDb(dbName, dbPrefix=''):
     from pyworkflow.mapper.sqlite import SqliteFlatDb
     db = SqliteFlatDb(dbName=dbName, tablePrefix=dbPrefix)
     setClassName = db.getProperty('self') # get the set class name
-    setObj = getObjects()[setClassName](filename=dbName, prefix=dbPrefix)
+    setObj = getClassesDict()[setClassName](filename=dbName, prefix=dbPrefix)
     return setObj
     
\ No newline at end of file
@@ -29,15 +29,19 @@ This module contains several conversion utilities
 
 import os
 import sys
-import PIL
+
+import numpy
 
 from constants import NO_INDEX
-import xmipp
 from constants import *
 from pyworkflow.utils import runJob, getExt
+from pyworkflow.utils.reflection import LazyModule
+import mrc
 
 # TODO: remove dependency from Xmipp
-DT_FLOAT = xmipp.DT_FLOAT
+# The binding is only loaded when images are accessed
+xmipp = LazyModule('xmipp')
+DT_FLOAT = 9 # DT_Float of the xmipp DataType enum
 
 
 class ImageHandler(object):
@@ -46,12 +50,35 @@ class ImageHandler(object):
         # Now it will use Xmipp image library
         # to read and write most of formats, in the future
         # if we want to be indepent of Xmipp, we should have
-        # our own image library
-        from packages.xmipp3 import fixVolumeFileName
-        
-        self._img = xmipp.Image()
-        self._imgClass = xmipp.Image
-        self._fixVolumeFileName = fixVolumeFileName
+        # our own image library.
+        # MRC files are read and written with numpy (see mrc module)
+        self._imgXmipp = None
+
+    @property
+    def _img(self):
+        """ Xmipp image used to read and write, created when needed. """
+        if self._imgXmipp is None:
+            self._imgXmipp = xmipp.Image()
+        return self._imgXmipp
+
+    def _fixVolumeFileName(self, image):
+        """ Add :mrc to the filename of MRC volumes (as
+        xmipp3.fixVolumeFileName) to distinguish them from stacks.
+        """
+        from data import Volume
+        fn = image.getFileName()
+        if isinstance(image, Volume):
+            fn = self.getVolFileName(fn)
+        return fn
+
+    def _getMrcHeader(self, location):
+        """ Return the header of the file of location if it
+        is an MRC file that can be read with numpy, or None.
+        """
+        fn = location[1]
+        if mrc.isMrcFile(fn):
+            return mrc.readHeader(fn)
+        return None
 
     def _convertToLocation(self, location):
         """ Get a location in a tuple format (index, filename).
@@ -100,19 +127,34 @@ class ImageHandler(object):
         inputObj and outputObj can be: tuple, string, or Image subclass 
         (see self._convertToLocation)
         """
+        inputLoc = self._convertToLocation(inputObj)
+        outputLoc = self._convertToLocation(outputObj)
+
+        if (dataType in [None, DT_FLOAT] and mrc.isMrcFile(outputLoc[1])
+            and self._getMrcHeader(inputLoc) is not None):
+            dtype = numpy.float32 if dataType == DT_FLOAT else None
+            mrc.copyData(inputLoc[1], inputLoc[0],
+                         outputLoc[1], outputLoc[0], dtype)
+            return
+
         # Read from input
-        self._img.read(self._convertToLocation(inputObj))
+        self._img.read(inputLoc)
         
         if dataType is not None:
             self._img.convert2DataType(dataType)
         # Write to output
-        self._img.write(self._convertToLocation(outputObj))
+        self._img.write(outputLoc)
         
     def convertStack(self, inputFn, outputFn, inFormat=None, outFormat=None):
         """ convert format of stack file. Output/input format is
         specified by outFormat/inFormat. If outFormat/inFomat=None then
         there will be inferred from extension
         """
+        if (mrc.isMrcFile(outputFn) and
+            self._getMrcHeader((NO_INDEX, inputFn)) is not None):
+            _, _, _, n = self.getDimensions(inputFn)
+            self.writeStack([(i, inputFn) for i in range(1, n+1)], outputFn)
+            return
         #get input dim
         (x,y,z,n) = xmipp.getImageSize(inputFn)
         #Create empty output stack for efficiency
@@ -120,6 +162,23 @@ class ImageHandler(object):
         # handle image formats
         for i in range(1, n+1):
             self.convert((i, inputFn), (i, outputFn))
+
+    def writeStack(self, inputObjs, outputFn):
+        """ Write the images of inputObjs (tuple, string or Image subclass,
+        see self._convertToLocation) to a new stack in outputFn.
+        """
+        locations = [self._convertToLocation(obj) for obj in inputObjs]
+        if not locations:
+            return
+        header = self._getMrcHeader(locations[0])
+
+        if mrc.isMrcFile(outputFn) and header is not None:
+            # Allocate the whole output stack at once
+            x, y, z, _ = header.getDimensions()
+            mrc.createFile(outputFn, x, y, z, len(locations), header.dtype)
+
+        for i, location in enumerate(locations):
+            self.convert(location, (i+1, outputFn))
         
     def getDimensions(self, locationObj):
         """ It will return a tuple with the images dimensions.
@@ -135,10 +194,19 @@ class ImageHandler(object):
             ext = getExt(fn).lower()
             
             if ext == '.png' or ext == '.jpg':
-                im = PIL.Image.open(fn)
+                from PIL import Image
+                im = Image.open(fn)
                 x, y = im.size # (width,height) tuple
                 return x, y, 1, 1
             
+            header = self._getMrcHeader(location)
+            if header is not None:
+                x, y, z, n = header.getDimensions()
+                # Only one image is read when the index is given
+                if location[0] != NO_INDEX:
+                    n = 1
+                return x, y, z, n
+
             else:
                 self._img.read(location, xmipp.HEADER)
                 x, y, z, n = self._img.getDimensions()
@@ -152,10 +220,22 @@ class ImageHandler(object):
         (inputObj can be tuple, str or Image subclass). """
         location = self._convertToLocation(inputObj)
         
-        return self._imgClass(location)
+        return xmipp.Image(location)
+
+    def readData(self, inputObj):
+        """ Return a numpy array with the data of inputObj
+        (inputObj can be tuple, str or Image subclass).
+        The data of MRC files is mapped from the file without copies.
+        """
+        location = self._convertToLocation(inputObj)
+
+        if self._getMrcHeader(location) is not None:
+            return mrc.readData(location[1], location[0])
+
+        return xmipp.Image(location).getData()
     
     def createImage(self):
-        return self._imgClass()
+        return xmipp.Image()
     
     def write(self, image, outputObj):
         """ Write to disk an image from outputObj 
@@ -624,10 +624,7 @@ class EMSet(Set, EMObject):
     
     def _loadClassesDict(self):
         import pyworkflow.em as em
-        classDict = em.getObjects()
-        classDict.update(globals())
-        
-        return classDict
+        return em.getClassesDict()
     
     def copyInfo(self, other):
         """ Define a dummy copyInfo function to be used
@@ -651,20 +648,31 @@ class EMSet(Set, EMObject):
         This is a place where items can be updated while copying.
         This is useful to set new attributes or update values
         for each item.
+        If there is no callback and both sets store the items in
+        the same way, the rows are copied directly between the
+        databases, without building any item (see Set.appendFromSet).
         """
-        for item in otherSet:
-            # copy items if enabled or copyDisabled=True
-            if copyDisabled or item.isEnabled():
-                newItem = item.clone()
-                if updateItemCallback:
-                    row = None if itemDataIterator is None else next(itemDataIterator)
-                    updateItemCallback(newItem, row)
-                # If updateCallBack function returns attribute _appendItem to False do not append the item
-                if getattr(newItem, "_appendItem", True):
-                    self.append(newItem)
-            else:
-                if itemDataIterator is not None:
-                    next(itemDataIterator) # just skip disabled data row
+        if updateItemCallback is None and self._canCopyRows(otherSet):
+            self.appendFromSet(otherSet,
+                               where='1' if copyDisabled else 'enabled=1')
+            return
+
+        def _iterNewItems():
+            for item in otherSet:
+                # copy items if enabled or copyDisabled=True
+                if copyDisabled or item.isEnabled():
+                    newItem = item.clone()
+                    if updateItemCallback:
+                        row = None if itemDataIterator is None else next(itemDataIterator)
+                        updateItemCallback(newItem, row)
+                    # If updateCallBack function returns attribute _appendItem to False do not append the item
+                    if getattr(newItem, "_appendItem", True):
+                        yield newItem
+                else:
+                    if itemDataIterator is not None:
+                        next(itemDataIterator) # just skip disabled data row
+        
+        self.appendMany(_iterNewItems())
                     
     def getFiles(self):
         return Set.getFiles(self)
@@ -683,6 +691,9 @@ class SetOfImages(EMSet):
         self._isAmplitudeCorrected = Boolean(False)
         self._acquisition = Acquisition()
         self._firstDim = ImageDim() # Dimensions of the first image
+        # Format to store the transformation matrix of the images
+        # (see Matrix.setStoreFormat), empty means the default (JSON)
+        self._matrixStoreFormat = String(args.get('matrixStoreFormat', None))
            
     def getAcquisition(self):
         return self._acquisition
@@ -757,14 +768,63 @@ class SetOfImages(EMSet):
         if self.getSize() == 0: # only check this for first time append is called
             if self._firstDim.isEmpty():
                 self._firstDim.set(image.getDim())
+        if self._matrixStoreFormat.hasValue() and image.hasTransform():
+            image.getTransform().setStoreFormat(self._matrixStoreFormat.get())
         EMSet.append(self, image)
-    
+
+    def _canCopyRows(self, inputSet):
+        # Rows can only be copied if the sampling rate of the images
+        # would not be modified by append (see above)
+        # (and the same for the transformation matrices store format)
+        samplingRate = self.getSamplingRate()
+        storeFormat = self.getMatrixStoreFormat()
+        return (EMSet._canCopyRows(self, inputSet) and
+                (not samplingRate or
+                 samplingRate == inputSet.getSamplingRate()) and
+                (storeFormat is None or
+                 storeFormat == inputSet.getMatrixStoreFormat()) and
+                not (self.hasAcquisition() and
+                     self._lackAcquisition(inputSet)))
+
+    def _lackAcquisition(self, inputSet):
+        """ Return True if some image of inputSet has no acquisition,
+        append would set the acquisition of this set to those images.
+        """
+        labels = ['_acquisition._voltage', '_acquisition._magnification']
+        inputClasses = inputSet._getMapper().getColumnClasses() or {}
+        if any(label not in inputClasses for label in labels):
+            return True
+        where = ' OR '.join('%s IS NULL' % label for label in labels)
+        return len(inputSet.getColumns(['id'], where=where, limit=1)) > 0
+
+    def _appendRows(self, inputSet, **kwargs):
+        if self.getSize() == 0 and self._firstDim.isEmpty():
+            dim = inputSet.getDim()
+            if dim is not None:
+                self._firstDim.set(dim)
+        return EMSet._appendRows(self, inputSet, **kwargs)
+
     def copyInfo(self, other):
         """ Copy basic information (sampling rate and ctf)
         from other set of images to current one"""
-        self.copyAttributes(other, '_samplingRate', '_isPhaseFlipped', '_isAmplitudeCorrected', '_alignment')
+        self.copyAttributes(other, '_samplingRate', '_isPhaseFlipped', '_isAmplitudeCorrected', '_alignment',
+                            '_matrixStoreFormat')
         self._acquisition.copyInfo(other._acquisition)
         
+    def getMatrixStoreFormat(self):
+        """ Return the format used to store the transformation
+        matrices or None if the default is used.
+        """
+        return self._matrixStoreFormat.get()
+    
+    def setMatrixStoreFormat(self, storeFormat):
+        """ Store the transformation matrices of the images with
+        the given format, for example Matrix.STORE_FLOAT32 to use
+        a compact binary representation instead of JSON.
+        It only affects the images appended after this call.
+        """
+        self._matrixStoreFormat.set(storeFormat)
+        
     def getFiles(self):
         filePaths = set()
         uniqueFiles = self.aggregate(['count'],'_filename',['_filename'])
@@ -787,11 +847,8 @@ class SetOfImages(EMSet):
         return self._samplingRate.get()
     
     def writeStack(self, fnStack, orderBy='id', direction='ASC'):
-        # TODO create empty file to improve efficiency
-        ih = ImageHandler()
-        for i, img in enumerate(self.iterItems(orderBy=orderBy,
-                                               direction=direction)):
-            ih.convert(img, (i+1, fnStack))
+        ImageHandler().writeStack(self.iterItems(orderBy=orderBy,
+                                                 direction=direction), fnStack)
     
     # TODO: Check whether this function can be used.
     # for example: protocol_apply_mask
@@ -845,9 +902,11 @@ class SetOfImages(EMSet):
         s = "%s (%d items, %s, %0.2f A/px)" % (self.getClassName(), self.getSize(), dimStr, sampling)
         return s
 
-    def iterItems(self, orderBy='id', direction='ASC'):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  limit=None, offset=None):
         """ Redefine iteration to set the acquisition to images. """
-        for img in Set.iterItems(self, orderBy=orderBy, direction=direction):
+        for img in Set.iterItems(self, orderBy=orderBy, direction=direction,
+                                 where=where, limit=limit, offset=offset):
             # Sometimes the images items in the set could
             # have the acquisition info per data row and we
             # don't want to override with the set acquisition for this case
@@ -856,12 +915,10 @@ class SetOfImages(EMSet):
             yield img
 
     def appendFromImages(self, imagesSet):
-        """ Iterate over the images and append 
-        every image that is enabled. 
+        """ Append every image that is enabled
+        (see Set.appendFromSet).
         """
-        for img in imagesSet:
-            if img.isEnabled():
-                self.append(img)
+        self.appendFromSet(imagesSet, where='enabled=1')
                                     
     def appendFromClasses(self, classesSet):
         """ Iterate over the classes and the element inside each
@@ -1133,19 +1190,25 @@ class SetOfCoordinates(EMSet):
     def iterCoordinates(self, micrograph=None):
         """ Iterate over the coordinates associated with a micrograph.
         If micrograph=None, the iteration is performed over the whole set of coordinates.
+        A list of micrographs (or micrograph ids) can also be passed.
         """
+        def _getMicId(mic):
+            if isinstance(mic, (int, long)):
+                return mic
+            elif isinstance(mic, Micrograph):
+                return mic.getObjId()
+            else:
+                raise Exception('Invalid input micrograph of type %s' % type(mic))
+
+        #Iterate over all coordinates if micrograph is None,
+        #otherwise filter the where selection by the micrograph id(s)
         if micrograph is None:
-            micId = None
-        elif isinstance(micrograph, int):
-            micId = micrograph
-        elif isinstance(micrograph, Micrograph):
-            micId = micrograph.getObjId()
+            coordWhere = '1'
+        elif isinstance(micrograph, (list, tuple, set)):
+            micIds = [_getMicId(mic) for mic in micrograph]
+            coordWhere = '_micId IN (%s)' % ','.join(str(i) for i in micIds)
         else:
-            raise Exception('Invalid input micrograph of type %s' % type(micrograph))
-        
-        #Iterate over all coordinates if micId is None,
-        #otherwise use micId to filter the where selection
-        coordWhere = '1' if  micId is None else '_micId=%d' % micId
+            coordWhere = '_micId=%d' % _getMicId(micrograph)
 
         for coord in self.iterItems(where=coordWhere):
             yield coord
@@ -1179,20 +1242,65 @@ class SetOfCoordinates(EMSet):
     
 
 class Matrix(Scalar):
+    """ Square matrix (e.g. 4x4 transformations) stored as a numpy array.
+    The values can be stored as a JSON string (the default) or as a
+    compact binary blob of float32 or float64 values (see setStoreFormat).
+    Both representations can be read back, so sets written with any
+    of the formats (or mixing them) are always readable.
+    """
+    # Formats used to store the matrix values
+    STORE_JSON = 'json'
+    STORE_FLOAT32 = 'float32'
+    STORE_FLOAT64 = 'float64'
+    
+    # Binary values are prefixed with the type char of the (little endian)
+    # dtype used, so they can be decoded without knowing the store format
+    _BINARY_DTYPES = {STORE_FLOAT32: np.dtype('<f4'),
+                      STORE_FLOAT64: np.dtype('<f8')}
+    _BINARY_CHARS = dict((dt.char, dt) for dt in _BINARY_DTYPES.values())
+    
     def __init__(self, **args):
         Scalar.__init__(self, **args)
         self._matrix = np.eye(4)
+        self._storeFormat = self.STORE_JSON
         
     def _convertValue(self, value):
-        """Value should be a str with comman separated values
-        or a list.
+        """Value should be a str with the JSON list of rows
+        or a buffer with the binary values.
         """
-        self._matrix = np.array(json.loads(value))
+        if isinstance(value, buffer):
+            self._matrix = self._fromBinary(value)
+        else:
+            self._matrix = np.array(json.loads(value))
+            
+    def _fromBinary(self, value):
+        data = str(value)
+        values = np.frombuffer(data, dtype=self._BINARY_CHARS[data[0]], offset=1)
+        n = int(round(np.sqrt(values.size)))
+        # astype returns a (writable) copy of the values
+        return values.reshape(n, n).astype(np.float64)
             
     def getObjValue(self):
-        self._objValue = json.dumps(self._matrix.tolist())
+        if self._storeFormat == self.STORE_JSON:
+            self._objValue = json.dumps(self._matrix.tolist())
+        else:
+            dtype = self._BINARY_DTYPES[self._storeFormat]
+            self._objValue = buffer(dtype.char + 
+                                    np.ascontiguousarray(self._matrix, dtype).tostring())
         return self._objValue
     
+    def getStoreFormat(self):
+        return self._storeFormat
+    
+    def setStoreFormat(self, storeFormat):
+        """ Set how the values will be stored: STORE_JSON, 
+        STORE_FLOAT32 or STORE_FLOAT64.
+        """
+        if (storeFormat != self.STORE_JSON and 
+            storeFormat not in self._BINARY_DTYPES):
+            raise Exception("Invalid matrix store format: %s" % storeFormat)
+        self._storeFormat = storeFormat
+    
     def setValue(self, i, j, value):
         self._matrix[i, j] = value
         
@@ -1213,6 +1321,7 @@ class Matrix(Scalar):
         """
         self.setMatrix(np.copy(other.getMatrix()))
         self._objValue = other._objValue
+        self._storeFormat = other._storeFormat
     
         
 class Transform(EMObject):
@@ -1234,6 +1343,10 @@ class Transform(EMObject):
     def setMatrix(self, matrix):
         self._matrix.setMatrix(matrix)
 
+    def setStoreFormat(self, storeFormat):
+        """ Set how the matrix will be stored (see Matrix.setStoreFormat). """
+        self._matrix.setStoreFormat(storeFormat)
+
     def __str__(self):
         return str(self._matrix)
 
@@ -1364,8 +1477,10 @@ class SetOfClasses(EMSet):
         self._setItemMapperPath(classItem)
         return classItem
 
-    def iterItems(self, orderBy='id', direction='ASC'):
-        for classItem in EMSet.iterItems(self, orderBy=orderBy, direction=direction):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  limit=None, offset=None):
+        for classItem in EMSet.iterItems(self, orderBy=orderBy, direction=direction,
+                                         where=where, limit=limit, offset=offset):
             self._setItemMapperPath(classItem)
             yield classItem
             
@@ -1406,7 +1521,8 @@ class SetOfClasses(EMSet):
                     row = None if itemDataIterator is None else next(itemDataIterator)
                     updateItemCallback(newItem, row)
                 self.append(newItem)
-                # copy items inside the class
+                # copy items inside the class (rows are copied
+                # directly between the databases, see EMSet.copyItems)
                 newItem.copyItems(item, copyDisabled=copyDisabled)
                 self.update(newItem)
             else:
@@ -1471,10 +1587,8 @@ class SetOfClasses2D(SetOfClasses):
         """ Write an stack with the classes averages. """
         if not self.hasRepresentatives():
             raise Exception('Could not write Averages stack if not hasRepresentatives!!!')
-        ih = ImageHandler()
-        for i, class2D in enumerate(self):
-            img = class2D.getRepresentative()
-            ih.convert(img, (i+1, fnStack))
+        ImageHandler().writeStack((class2D.getRepresentative()
+                                   for class2D in self), fnStack)
 
 
 class SetOfClasses3D(SetOfClasses):
@@ -0,0 +1,325 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module reads and writes MRC images, stacks and volumes with
+numpy.memmap, without the need of the xmipp binding.
+The data of the images is not read into memory, but mapped from the
+file, so the slices of a stack can be accessed without copies.
+Stacks and volumes are distinguished as xmipp does:
+.mrcs and .st files (or filenames ending in :mrcs) are always stacks,
+other files are stacks if the space group in the header is 0.
+"""
+
+import os
+
+import numpy
+
+from constants import NO_INDEX
+
+
+MRC_FORMATS = ['mrc', 'mrcs', 'map', 'st']
+STACK_FORMATS = ['mrcs', 'st']
+
+HEADER_SIZE = 1024
+HEADER_DTYPE = numpy.dtype([('nx', 'i4'), ('ny', 'i4'), ('nz', 'i4'),
+                            ('mode', 'i4'),
+                            ('nxstart', 'i4'), ('nystart', 'i4'),
+                            ('nzstart', 'i4'),
+                            ('mx', 'i4'), ('my', 'i4'), ('mz', 'i4'),
+                            ('cella', 'f4', 3), ('cellb', 'f4', 3),
+                            ('mapc', 'i4'), ('mapr', 'i4'), ('maps', 'i4'),
+                            ('dmin', 'f4'), ('dmax', 'f4'), ('dmean', 'f4'),
+                            ('ispg', 'i4'), ('nsymbt', 'i4'),
+                            ('extra', 'V100'),
+                            ('origin', 'f4', 3),
+                            ('map', 'S4'), ('machst', 'u1', 4),
+                            ('rms', 'f4'), ('nlabl', 'i4'),
+                            ('label', 'S80', 10)])
+
+# Data types of the supported modes (complex modes are not supported)
+# mode 0 is read as unsigned, as xmipp does
+MODE_DTYPES = {0: numpy.uint8,
+               1: numpy.int16,
+               2: numpy.float32,
+               6: numpy.uint16}
+
+# Headers are read with the native byte order and swapped
+# if the mode or the z dimension is bigger than this value
+SWAPTRIG = 16776960
+
+# Cache of the headers: filename -> (mtime, size, header)
+_headerCache = {}
+MAX_CACHED_HEADERS = 1000
+
+
+class MrcHeader(object):
+    """ The values of the header of an MRC file needed to map its data.
+    x, y, z and n are the dimensions as in ImageHandler.getDimensions.
+    """
+    def __init__(self, filename, x, y, z, n, dtype, offset, isStack):
+        self.filename = filename
+        self.x, self.y, self.z, self.n = x, y, z, n
+        self.dtype = dtype
+        self.offset = offset
+        self.isStack = isStack
+
+    def getDimensions(self):
+        return self.x, self.y, self.z, self.n
+
+    def getShape(self):
+        """ Shape of the mapped data: (n, z, y, x) """
+        return self.n, self.z, self.y, self.x
+
+
+def _splitFormat(filename):
+    """ Return the path of a filename and its format, taken from
+    the extension or from a suffix such as :mrc or :mrcs.
+    """
+    if ':' in filename:
+        path, fmt = filename.rsplit(':', 1)
+    else:
+        path = filename
+        fmt = os.path.splitext(filename)[1][1:]
+    return path, fmt.lower()
+
+
+def isMrcFile(filename):
+    """ Return True if the filename is in one of the MRC formats. """
+    return _splitFormat(filename)[1] in MRC_FORMATS
+
+
+def _readRawHeader(path):
+    """ Read the header with its byte order. """
+    header = numpy.fromfile(path, HEADER_DTYPE, 1)
+    if len(header) == 0:
+        raise Exception("MRC file '%s' is too small" % path)
+    if abs(header['mode'][0]) > SWAPTRIG or abs(header['nz'][0]) > SWAPTRIG:
+        header = header.view(HEADER_DTYPE.newbyteorder())
+    return header
+
+
+def readHeader(filename):
+    """ Read the header of an MRC file (the filename could contain the
+    :mrc or :mrcs format suffix). Headers are cached until the file
+    changes. Return None if the data mode is not supported.
+    """
+    path, fmt = _splitFormat(filename)
+    stat = os.stat(path)
+    cached = _headerCache.get(filename)
+    if cached is not None and cached[:2] == (stat.st_mtime, stat.st_size):
+        return cached[2]
+
+    raw = _readRawHeader(path)
+    mode = int(raw['mode'][0])
+    header = None
+
+    if mode in MODE_DTYPES:
+        x, y, z = [int(raw[d][0]) for d in ['nx', 'ny', 'nz']]
+        ispg, nsymbt, mz = [int(raw[k][0]) for k in ['ispg', 'nsymbt', 'mz']]
+        isVolStack = ispg > 400
+        isStack = fmt in STACK_FORMATS
+        # Format forced through the suffix ignore the stack behavior
+        if not isStack and (isVolStack or ':' not in filename):
+            isStack = (ispg == 0 or isVolStack) and nsymbt == 0
+        n = 1
+        if isStack:
+            if isVolStack:
+                n, z = z / mz, mz
+            else:
+                n, z = z, 1
+        dtype = numpy.dtype(MODE_DTYPES[mode]).newbyteorder(raw.dtype['nx'].byteorder)
+        header = MrcHeader(filename, x, y, z, n, dtype,
+                           HEADER_SIZE + nsymbt, isStack)
+
+    if len(_headerCache) >= MAX_CACHED_HEADERS:
+        _headerCache.clear()
+    _headerCache[filename] = (stat.st_mtime, stat.st_size, header)
+    return header
+
+
+def _getHeader(filename):
+    header = readHeader(filename)
+    if header is None:
+        raise Exception("Unsupported data mode in MRC file '%s'" % filename)
+    return header
+
+
+def _writeHeader(header, raw):
+    """ Write the raw header, allocate the size of the data and
+    update the header cache.
+    """
+    path = _splitFormat(header.filename)[0]
+    dataSize = header.n * header.z * header.y * header.x * header.dtype.itemsize
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        raw.tofile(f)
+        f.truncate(header.offset + dataSize)
+    stat = os.stat(path)
+    _headerCache[header.filename] = (stat.st_mtime, stat.st_size, header)
+
+
+def _setStackDimensions(raw, z, n, isStack):
+    """ Set the values of the header related to the number of images. """
+    raw['mz'] = z
+    if isStack:
+        if z > 1: # stack of volumes
+            raw['ispg'] = 401
+            raw['nz'] = z * n
+        else:
+            raw['ispg'] = 0
+            raw['nz'] = n
+    else:
+        raw['ispg'] = 1
+        raw['nz'] = z
+
+
+def createFile(filename, x, y, z, n, dtype=numpy.float32, isStack=True):
+    """ Create an MRC file (with zeros) for n images of x, y, z dimensions.
+    Return the header of the new file.
+    """
+    dtype = _writeDtype(dtype)
+    raw = numpy.zeros(1, HEADER_DTYPE.newbyteorder('<'))
+    raw['nx'] = raw['mx'] = x
+    raw['ny'] = raw['my'] = y
+    raw['mode'] = [m for m, t in MODE_DTYPES.iteritems()
+                   if numpy.dtype(t) == dtype][0]
+    raw['cella'] = [x, y, z]
+    raw['cellb'] = 90.
+    raw['mapc'], raw['mapr'], raw['maps'] = 1, 2, 3
+    raw['map'] = 'MAP '
+    raw['machst'] = [68, 65, 0, 0] # little endian
+    _setStackDimensions(raw, z, n, isStack)
+
+    header = MrcHeader(filename, x, y, z, n, dtype.newbyteorder('<'),
+                       HEADER_SIZE, isStack)
+    _writeHeader(header, raw)
+    return header
+
+
+def _resizeStack(header, n):
+    """ Change the number of images of an existing stack. """
+    raw = _readRawHeader(_splitFormat(header.filename)[0])
+    _setStackDimensions(raw, header.z, n, True)
+    newHeader = MrcHeader(header.filename, header.x, header.y, header.z, n,
+                          header.dtype, header.offset, True)
+    _writeHeader(newHeader, raw)
+    return newHeader
+
+
+def _mapData(header, mode='r'):
+    """ Map the data of the file as an array with shape (n, z, y, x). """
+    path = _splitFormat(header.filename)[0]
+    return numpy.memmap(path, header.dtype, mode, header.offset,
+                        header.getShape())
+
+
+def _readArray(header, index):
+    """ Return the data of the image at index (or all the images
+    if index is NO_INDEX) as an array with shape (n, z, y, x).
+    """
+    data = _mapData(header)
+    if index == NO_INDEX or not header.isStack:
+        return data
+    if index > header.n:
+        raise Exception("Image number %d exceeds stack size %d of '%s'"
+                        % (index, header.n, header.filename))
+    return data[index-1:index]
+
+
+def readData(filename, index=NO_INDEX):
+    """ Return the data of an image (or all the images if index is
+    NO_INDEX) of an MRC file. The data is mapped from the file, not read,
+    and its shape is (y, x) for 2D images, (z, y, x) for volumes and with
+    an extra first dimension for the whole stack.
+    """
+    header = _getHeader(filename)
+    data = _readArray(header, index)
+    if header.z == 1:
+        data = data[:, 0]
+    if len(data) == 1:
+        data = data[0]
+    return data
+
+
+def _writeDtype(dtype):
+    """ Data type used to write new files, as xmipp does,
+    unsigned chars and (unsigned) shorts are kept, others are floats.
+    """
+    dtype = numpy.dtype(dtype).newbyteorder('=')
+    if dtype in [numpy.dtype(t) for t in MODE_DTYPES.values()]:
+        return dtype
+    return numpy.dtype(numpy.float32)
+
+
+def _writeArray(array, filename, index=NO_INDEX, dtype=None):
+    """ Write an array with shape (n, z, y, x) to an MRC file.
+    If index is NO_INDEX the file is overwritten, otherwise the images
+    are written from that index on in the existing stack (that is
+    enlarged when needed) or in a new one.
+    """
+    path, fmt = _splitFormat(filename)
+    n, z, y, x = array.shape
+    isStack = index != NO_INDEX or n > 1 or fmt in STACK_FORMATS
+    first = max(index, 1)
+    last = first + n - 1
+    header = None
+
+    if index != NO_INDEX and os.path.exists(path):
+        header = _getHeader(filename)
+        if (header.x, header.y, header.z) != (x, y, z):
+            raise Exception("Images to write (x,y,z,n) = %d %d %d %d have "
+                            "different size than stack %s (x,y,z,n) = "
+                            "%d %d %d %d" % ((x, y, z, n, filename)
+                                             + header.getDimensions()))
+        if last > header.n:
+            header = _resizeStack(header, last)
+
+    if header is None:
+        header = createFile(filename, x, y, z, last,
+                            dtype or _writeDtype(array.dtype), isStack)
+
+    data = _mapData(header, 'r+')
+    data[first-1:last] = array
+    data.flush()
+    del data
+
+
+def writeData(data, filename, index=NO_INDEX):
+    """ Write a 2D image or a volume to an MRC file.
+    See _writeArray for the meaning of index.
+    """
+    data = numpy.asarray(data)
+    if data.ndim == 2:
+        data = data[None]
+    _writeArray(data[None], filename, index)
+
+
+def copyData(inputFn, inputIndex, outputFn, outputIndex, dtype=None):
+    """ Copy the data of an image (or all images if inputIndex is
+    NO_INDEX) from an MRC file to another. If dtype is given, new
+    output files are created with it.
+    """
+    array = _readArray(_getHeader(inputFn), inputIndex)
+    _writeArray(array, outputFn, outputIndex, dtype)
@@ -47,6 +47,7 @@ class ProtCTFFind(em.ProtCTFMicrographs):
     http://grigoriefflab.janelia.org/ctffind4
     """
     _label = 'ctffind'
+    _streamingOutput = True
     
     
     def _defineProcessParams(self, form):
@@ -153,29 +154,17 @@ class ProtCTFFind(em.ProtCTFMicrographs):
         ctfModel2.setMicrograph(mic)
         return ctfModel2
     
-    def _createOutputStep(self):
-        ctfSet = self._createSetOfCTF()
-        ctfSet.setMicrographs(self.inputMics)
-        defocusList = []
-        
-        for _, micDir, mic in self._iterMicrographs():
-            samplingRate = mic.getSamplingRate() * self.ctfDownFactor.get()
-            mic.setSamplingRate(samplingRate)
-            psdFile = self._getPsdPath(micDir)
-            out = self._getCtfOutPath(micDir)
-            
-            ctfModel = em.CTFModel()
-            readCtfModel(ctfModel, out, ctf4=self.useCtffind4.get())
-            ctfModel.setPsdFile(psdFile)
-            ctfModel.setMicrograph(mic)
-            
-            defocusList.append(ctfModel.getDefocusU())
-            defocusList.append(ctfModel.getDefocusV())
-            ctfSet.append(ctfModel)
+    def _createCtfModel(self, mic):
+        micDir = self._getMicrographDir(mic)
+        samplingRate = mic.getSamplingRate() * self.ctfDownFactor.get()
+        mic.setSamplingRate(samplingRate)
         
-        self._defocusMaxMin(defocusList)
-        self._defineOutputs(outputCTF=ctfSet)
-        self._defineCtfRelation(self.inputMics, ctfSet)
+        ctfModel = em.CTFModel()
+        readCtfModel(ctfModel, self._getCtfOutPath(micDir),
+                     ctf4=self.useCtffind4.get())
+        ctfModel.setPsdFile(self._getPsdPath(micDir))
+        ctfModel.setMicrograph(mic)
+        return ctfModel
         
     #--------------------------- INFO functions ----------------------------------------------------
     def _validate(self):
@@ -41,6 +41,7 @@ class ProtUnblur(ProtProcessMovies):
     to beam-induced motion.
     """
     _label = 'unblur'
+    _streamingOutput = True
 
     def _defineParams(self, form):
         ProtProcessMovies._defineParams(self, form)
@@ -264,24 +265,11 @@ YES
 eof
 """%args
 
-    def createOutputStep(self):
-        inputMovies = self.inputMovies.get()
-        micSet = self._createSetOfMicrographs()
-        micSet.copyInfo(inputMovies)
-        for movie in self.inputMovies.get():
-            mic = Micrograph()
-            # All micrograph are copied to the 'extra' folder after each step
-            #mic.setFileName(self._getMicFnNameFromRun(movie.getObjId()))
-            mic.setFileName(self._getExtraPath(self._getNameExt(movie.getFileName(),'', 'mrc')))
-
-            micSet.append(mic)
-        self._defineOutputs(outputMicrographs=micSet)
-
-        # Also create a Set of Movies with the alignment parameters
-        #movieSet = self._createSetOfMovies()
-        #movieSet.copyInfo(inputMovies)
-        #movieSet.cropOffsetX = Integer(self.cropOffsetX)
-        #movieSet.cropOffsetY = Integer(self.cropOffsetY)
+    def _createOutputMicrograph(self, movie):
+        mic = Micrograph()
+        # All micrograph are copied to the 'extra' folder after each step
+        mic.setFileName(self._getExtraPath(self._getNameExt(movie.getFileName(),'', 'mrc')))
+        return mic
 
     def _citations(self):
         return []
@@ -42,6 +42,7 @@ from pyworkflow.utils.path import (createLink, cleanPath, copyFile,
                                    replaceBaseExt, getExt, removeExt)
 import pyworkflow.em as em
 import pyworkflow.em.metadata as md
+from pyworkflow.em.star import StarReader, StarWriter, CHUNK_SIZE
 
 
 # This dictionary will be used to map
@@ -341,6 +342,110 @@ def rowToAlignment(alignmentRow, alignType):
     return alignment
 
 
+def geometryFromMatrices(matrices, inverseTransform):
+    """ Batch version of geometryFromMatrix for an array of
+    matrices with shape (N, 4, 4).
+    """
+    from pyworkflow.em.transformations import euler_from_matrices
+
+    if inverseTransform:
+        matrices = numpy.linalg.inv(matrices)
+        shifts = -matrices[:, :3, 3]
+    else:
+        shifts = matrices[:, :3, 3].copy()
+    angles = -numpy.rad2deg(euler_from_matrices(matrices, axes='szyz'))
+    return shifts, angles
+
+
+def matricesFromGeometry(shifts, angles, inverseTransform):
+    """ Batch version of matrixFromGeometry for arrays of shifts
+    and angles with shape (N, 3).
+    """
+    from pyworkflow.em.transformations import euler_matrices
+
+    M = euler_matrices(-numpy.deg2rad(angles), 'szyz')
+    if inverseTransform:
+        M[:, :3, 3] = -shifts[:, :3]
+        M = numpy.linalg.inv(M)
+    else:
+        M[:, :3, 3] = shifts[:, :3]
+
+    return M
+
+
+def alignmentColumnsToMatrices(columns, alignType):
+    """ Batch version of rowToAlignment. Create the transformation
+    matrices of N particles from a dict with the values of the
+    alignment labels for all of them (missing labels are taken as zero).
+    """
+    is2D = alignType == em.ALIGN_2D
+    inverseTransform = True#alignType == em.ALIGN_PROJ
+    n = len(columns.values()[0])
+
+    def _column(label):
+        if label in columns:
+            return numpy.array(columns[label], dtype=numpy.float64)
+        return numpy.zeros(n)
+
+    angles = numpy.zeros((n, 3))
+    shifts = numpy.zeros((n, 3))
+    angles[:, 2] = _column(md.RLN_ORIENT_PSI)
+    shifts[:, 0] = _column(md.RLN_ORIENT_ORIGIN_X)
+    shifts[:, 1] = _column(md.RLN_ORIENT_ORIGIN_Y)
+    if not is2D:
+        angles[:, 0] = _column(md.RLN_ORIENT_ROT)
+        angles[:, 1] = _column(md.RLN_ORIENT_TILT)
+        shifts[:, 2] = _column(md.RLN_ORIENT_ORIGIN_Z)
+
+    return matricesFromGeometry(shifts, angles, inverseTransform)
+
+
+def matricesToAlignmentColumns(matrices, alignType):
+    """ Batch version of alignmentToRow. Return an OrderedDict with the
+    list of values of each alignment label for an array of matrices.
+    """
+    is2D = alignType == em.ALIGN_2D
+    inverseTransform = alignType == em.ALIGN_PROJ
+    matrices = numpy.asarray(matrices, dtype=numpy.float64)
+    shifts, angles = geometryFromMatrices(matrices, inverseTransform)
+
+    columns = OrderedDict()
+    columns[md.RLN_ORIENT_ORIGIN_X] = shifts[:, 0]
+    columns[md.RLN_ORIENT_ORIGIN_Y] = shifts[:, 1]
+
+    if is2D:
+        columns[md.RLN_ORIENT_PSI] = angles[:, 0] + angles[:, 2]
+        if numpy.any(numpy.linalg.det(matrices[:, 0:2, 0:2]) < 0):
+            print "FLIP in 2D not implemented"
+    else:
+        columns[md.RLN_ORIENT_ORIGIN_Z] = shifts[:, 2]
+        columns[md.RLN_ORIENT_ROT] = angles[:, 0]
+        columns[md.RLN_ORIENT_TILT] = angles[:, 1]
+        columns[md.RLN_ORIENT_PSI] = angles[:, 2]
+
+    return OrderedDict((label, values.tolist())
+                       for label, values in columns.iteritems())
+
+
+def readAlignmentMatrices(imgMd, alignType):
+    """ Read the alignment columns of all rows of a metadata at once.
+    Return the array of transformation matrices or None if
+    the metadata does not contain any alignment label.
+    """
+    columns = dict((label, imgMd.getColumnValues(label))
+                   for label in ALIGNMENT_DICT.values()
+                   if imgMd.containsLabel(label))
+    if not columns:
+        return None
+    return alignmentColumnsToMatrices(columns, alignType)
+
+
+def writeAlignmentMatrices(imgMd, matrices, alignType):
+    """ Write the alignment columns of all rows of a metadata at once. """
+    for label, values in matricesToAlignmentColumns(matrices, alignType).iteritems():
+        imgMd.setColumnValues(label, values)
+
+
 def coordinateToRow(coord, coordRow, copyId=True):
     """ Set labels values from Coordinate coord to md row. """
     if copyId:
@@ -533,8 +638,175 @@ def writeSetOfParticles(imgSet, starFile,
     setOfImagesToMd(imgSet, partMd, particleToRow, **kwargs)
     blockName = kwargs.get('blockName', 'Particles')
     partMd.write('%s@%s' % (blockName, starFile))
-    
-    
+
+
+def _starColumns(labels):
+    """ Return the STAR column names of the given labels. """
+    return [md.label2Str(label) for label in labels]
+
+
+def readSetOfParticlesStar(filename, partSet, blockName=None, **kwargs):
+    """ Read particles from a Relion star file, as readSetOfParticles,
+    but parsing the file with StarReader instead of xmipp.MetaData.
+    The rows are read in chunks of arrays (one per column), so the
+    alignment of each chunk is computed at once, and the values are
+    set to a single particle that is appended to the set in bulk.
+    Only the image name and id, class, micrograph id, coordinate,
+    CTF, acquisition and alignment labels are read.
+    """
+    alignType = kwargs.get('alignType', em.ALIGN_NONE)
+    magnification = kwargs.get('magnification', None)
+    reader = StarReader(filename)
+    columns = set(reader.getColumns(blockName))
+
+    imageName, imageId, classId, micId = _starColumns([md.RLN_IMAGE_NAME,
+                                                       md.RLN_IMAGE_ID,
+                                                       md.RLN_PARTICLE_CLASS,
+                                                       md.RLN_MICROGRAPH_ID])
+    ctfColumns = _starColumns(CTF_DICT.values())
+    acqColumns = _starColumns(ACQUISITION_DICT.values())
+    coordColumns = _starColumns(COOR_DICT.values())
+    alignColumns = [(label, md.label2Str(label)) for label in ALIGNMENT_DICT.values()]
+
+    hasCtf = kwargs.get('readCtf', True) and columns.issuperset(ctfColumns)
+    hasAcquisition = (kwargs.get('readAcquisition', True) and
+                      columns.issuperset(acqColumns))
+    hasCoord = columns.issuperset(coordColumns)
+    hasAlignment = (alignType != em.ALIGN_NONE and
+                    any(c in columns for _, c in alignColumns))
+
+    types = {imageName: str, imageId: int, classId: int, micId: int}
+    types.update((c, float) for c in ctfColumns + acqColumns + coordColumns)
+    types.update((c, float) for _, c in alignColumns)
+
+    def _iterParticles():
+        img = em.Particle()
+        if hasCtf:
+            img.setCTF(em.CTFModel())
+        if hasAcquisition:
+            img.setAcquisition(em.Acquisition())
+        if hasCoord:
+            img.setCoordinate(em.Coordinate())
+        if hasAlignment:
+            img.setTransform(em.Transform())
+
+        for chunk in reader.iterChunks(blockName, types=types):
+            if hasAlignment:
+                matrices = alignmentColumnsToMatrices(
+                    dict((label, chunk[c]) for label, c in alignColumns
+                         if c in chunk), alignType)
+
+            for i in xrange(len(chunk[imageName])):
+                if imageId in chunk:
+                    img.setObjId(int(chunk[imageId][i]))
+                else:
+                    img.cleanObjId()
+                img.setLocation(relionToLocation(chunk[imageName][i]))
+                if classId in chunk:
+                    img.setClassId(int(chunk[classId][i]))
+                if micId in chunk:
+                    img.setMicId(int(chunk[micId][i]))
+                if hasCtf:
+                    img.getCTF().setStandardDefocus(*[chunk[c][i] for c in ctfColumns])
+                if hasAcquisition:
+                    acq = img.getAcquisition()
+                    for attr, c in izip(ACQUISITION_DICT.keys(), acqColumns):
+                        getattr(acq, attr).set(chunk[c][i])
+                    if magnification:
+                        acq.setMagnification(magnification)
+                if hasCoord:
+                    img.getCoordinate().setPosition(*[chunk[c][i] for c in coordColumns])
+                if hasAlignment:
+                    img.getTransform().setMatrix(matrices[i])
+                yield img
+
+    partSet.appendMany(_iterParticles())
+    partSet.setHasCTF(hasCtf)
+    partSet.setAlignment(alignType)
+
+
+def writeSetOfParticlesStar(imgSet, starFile, outputDir,
+                            blockName='Particles', **kwargs):
+    """ Write a SetOfParticles as a Relion star file, as writeSetOfParticles,
+    but with StarWriter instead of xmipp.MetaData. The rows are written in
+    chunks, so the whole metadata is never in memory, and the alignment
+    of each chunk is converted at once.
+    Only the image name and id, enabled, micrograph id, coordinate,
+    CTF, acquisition and alignment labels are written.
+    """
+    filesDict = convertBinaryFiles(imgSet, outputDir)
+    alignType = kwargs.get('alignType', imgSet.getAlignment())
+    first = imgSet.getFirstItem()
+
+    hasCtf = kwargs.get('writeCtf', True) and first.hasCTF()
+    hasAcquisition = kwargs.get('writeAcquisition', True) and first.hasAcquisition()
+    hasCoord = first.getCoordinate() is not None
+    hasMicId = first.hasMicId()
+    hasAlignment = alignType != em.ALIGN_NONE and first.hasTransform()
+
+    labels = [md.RLN_IMAGE_ID, md.RLN_IMAGE_ENABLED, md.RLN_IMAGE_NAME]
+    if hasMicId:
+        labels += [md.RLN_MICROGRAPH_ID, md.RLN_MICROGRAPH_NAME]
+    if hasCoord:
+        labels += COOR_DICT.values()
+    if hasCtf:
+        labels += CTF_DICT.values()
+    if hasAcquisition:
+        labels += ACQUISITION_DICT.values()
+    columns = _starColumns(labels)
+
+    alignLabels = []
+    if hasAlignment: # same labels written by matricesToAlignmentColumns
+        alignLabels = [md.RLN_ORIENT_ORIGIN_X, md.RLN_ORIENT_ORIGIN_Y]
+        if alignType == em.ALIGN_2D:
+            alignLabels += [md.RLN_ORIENT_PSI]
+        else:
+            alignLabels += [md.RLN_ORIENT_ORIGIN_Z, md.RLN_ORIENT_ROT,
+                            md.RLN_ORIENT_TILT, md.RLN_ORIENT_PSI]
+
+    def _rowValues(img):
+        index, fn = img.getLocation()
+        values = [img.getObjId(), int(img.isEnabled()),
+                  locationToRelion(index, filesDict.get(fn, fn))]
+        coord = img.getCoordinate()
+        if hasMicId:
+            if hasCoord and coord.getMicId():
+                micName = str(coord.getMicId())
+            else:
+                micName = 'fake_micrograph_%06d.mrc' % img.getMicId()
+            values += [img.getMicId(), micName]
+        if hasCoord:
+            values += [coord.getX(), coord.getY()]
+        if hasCtf:
+            ctf = img.getCTF()
+            values += [getattr(ctf, attr).get() for attr in CTF_DICT]
+        if hasAcquisition:
+            acq = img.getAcquisition()
+            values += [getattr(acq, attr).get() for attr in ACQUISITION_DICT]
+        return values
+
+    def _writeChunk(writer, rows, matrices):
+        arrays = OrderedDict(izip(columns, izip(*rows)))
+        if hasAlignment:
+            alignValues = matricesToAlignmentColumns(matrices, alignType)
+            arrays.update(izip(_starColumns(alignValues.keys()),
+                               alignValues.values()))
+        writer.writeArrays(arrays)
+
+    rows, matrices = [], []
+    with StarWriter(starFile) as writer:
+        writer.beginBlock(blockName, columns + _starColumns(alignLabels))
+        for img in imgSet:
+            rows.append(_rowValues(img))
+            if hasAlignment:
+                matrices.append(img.getTransform().getMatrix().copy())
+            if len(rows) == CHUNK_SIZE:
+                _writeChunk(writer, rows, matrices)
+                rows, matrices = [], []
+        if rows:
+            _writeChunk(writer, rows, matrices)
+
+
 def writeReferences(inputSet, outputRoot):
     """ Write an references star and stack files from
     a given SetOfAverages or SetOfClasses2D.
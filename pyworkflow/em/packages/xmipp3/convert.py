@@ -780,12 +780,13 @@ def readSetOfImages(filename, imgSet, rowToFunc, **kwargs):
             kwargs['alignType'] = ALIGN_NONE
     
     if imgMd.size()>0:
-        for objId in imgMd:
-            imgRow = rowFromMd(imgMd, objId)
-            img = rowToFunc(imgRow, **kwargs)
-            imgSet.append(img)
-            
-        imgSet.setHasCTF(img.hasCTF())
+        def _iterImages():
+            for objId in imgMd:
+                imgRow = rowFromMd(imgMd, objId)
+                yield rowToFunc(imgRow, **kwargs)
+        
+        imgSet.appendMany(_iterImages())
+        imgSet.setHasCTF(imgSet.getFirstItem().hasCTF())
         imgSet.setAlignment(kwargs['alignType'])
         
 
@@ -1306,6 +1307,141 @@ def alignmentToRow(alignment, alignmentRow, alignType):
     alignmentRow.setValue(xmipp.MDL_FLIP, flip)
 
 
+def geometryFromMatrices(matrices, inverseTransform):
+    """ Batch version of geometryFromMatrix for an array of
+    matrices with shape (N, 4, 4). Return the shifts and angles
+    as two arrays of shape (N, 3).
+    """
+    from pyworkflow.em.transformations import euler_from_matrices
+    if inverseTransform:
+        matrices = numpy.linalg.inv(matrices)
+        shifts = -matrices[:, :3, 3]
+    else:
+        shifts = matrices[:, :3, 3].copy()
+    angles = -numpy.rad2deg(euler_from_matrices(matrices, axes='szyz'))
+    return shifts, angles
+
+
+def matricesFromGeometry(shifts, angles, inverseTransform):
+    """ Batch version of matrixFromGeometry for arrays of shifts
+    and angles of shape (N, 3). Return an array of shape (N, 4, 4).
+    """
+    from pyworkflow.em.transformations import euler_matrices
+    M = euler_matrices(-numpy.deg2rad(angles), 'szyz')
+    if inverseTransform:
+        M[:, :3, 3] = -shifts[:, :3]
+        M = numpy.linalg.inv(M)
+    else:
+        M[:, :3, 3] = shifts[:, :3]
+
+    return M
+
+
+def alignmentColumnsToMatrices(columns, alignType):
+    """ Batch version of rowToAlignment. Create the transformation
+    matrices of N images at once from a dict with the values of
+    the alignment labels (MDL_SHIFT_X, MDL_ANGLE_ROT...) for all of them.
+    Labels missing from the dict are taken as zero (as for a row).
+    Return an array of matrices with shape (N, 4, 4).
+    """
+    is2D = alignType == ALIGN_2D
+    inverseTransform = alignType == ALIGN_PROJ
+    n = len(columns.values()[0])
+
+    def _column(label):
+        if label in columns:
+            return numpy.array(columns[label], dtype=numpy.float64)
+        return numpy.zeros(n)
+
+    flip = _column(xmipp.MDL_FLIP) != 0
+    angles = numpy.zeros((n, 3))
+    shifts = numpy.zeros((n, 3))
+    shifts[:, 0] = _column(xmipp.MDL_SHIFT_X)
+    shifts[:, 1] = _column(xmipp.MDL_SHIFT_Y)
+
+    if not is2D:
+        angles[:, 0] = _column(xmipp.MDL_ANGLE_ROT)
+        angles[:, 1] = _column(xmipp.MDL_ANGLE_TILT)
+        shifts[:, 2] = _column(xmipp.MDL_SHIFT_Z)
+        angles[:, 2] = _column(xmipp.MDL_ANGLE_PSI)
+        angles[flip, 1] += 180 # tilt = tilt + 180
+        angles[flip, 2] = 180 - angles[flip, 2] # psi = -psi + 180
+        shifts[flip, 0] *= -1 # shx = -shx
+    else:
+        angles[:, 0] = _column(xmipp.MDL_ANGLE_PSI) + _column(xmipp.MDL_ANGLE_ROT)
+
+    matrices = matricesFromGeometry(shifts, angles, inverseTransform)
+
+    if alignType == ALIGN_2D:
+        matrices[flip, 0, :2] *= -1.
+        matrices[flip, 2, 2] = -1.
+    elif alignType == ALIGN_3D:
+        matrices[flip, 0, :3] *= -1.
+        matrices[flip, 3, 3] *= -1.
+
+    return matrices
+
+
+def matricesToAlignmentColumns(matrices, alignType):
+    """ Batch version of alignmentToRow. Return an OrderedDict with
+    the values of each alignment label for an array of transformation
+    matrices with shape (N, 4, 4). The values are lists that can be
+    set in a metadata with setColumnValues.
+    """
+    is2D = alignType == ALIGN_2D
+    inverseTransform = alignType == ALIGN_PROJ
+    # Copy the matrices, since they are modified for flipped images
+    matrices = numpy.array(matrices, dtype=numpy.float64)
+    flip = numpy.zeros(len(matrices), dtype=bool)
+
+    if alignType == ALIGN_2D:
+        flip = numpy.linalg.det(matrices[:, 0:2, 0:2]) < 0
+        matrices[flip, 0, :2] *= -1.
+        matrices[flip, 2, 2] = 1.
+    elif alignType == ALIGN_3D:
+        flip = numpy.linalg.det(matrices[:, 0:3, 0:3]) < 0
+        matrices[flip, 0, :4] *= -1.
+        matrices[flip, 3, 3] = 1.
+
+    shifts, angles = geometryFromMatrices(matrices, inverseTransform)
+    columns = OrderedDict()
+    columns[xmipp.MDL_SHIFT_X] = shifts[:, 0]
+    columns[xmipp.MDL_SHIFT_Y] = shifts[:, 1]
+
+    if is2D:
+        columns[xmipp.MDL_ANGLE_PSI] = angles[:, 0] + angles[:, 2]
+    else:
+        columns[xmipp.MDL_SHIFT_Z] = shifts[:, 2]
+        columns[xmipp.MDL_ANGLE_ROT] = angles[:, 0]
+        columns[xmipp.MDL_ANGLE_TILT] = angles[:, 1]
+        columns[xmipp.MDL_ANGLE_PSI] = angles[:, 2]
+    columns[xmipp.MDL_FLIP] = flip
+
+    return OrderedDict((label, values.tolist())
+                       for label, values in columns.iteritems())
+
+
+def readAlignmentMatrices(imgMd, alignType):
+    """ Read the alignment columns of all rows of a metadata at once.
+    Return an array with the transformation matrix of each row or None
+    if the metadata does not contain any alignment label.
+    """
+    columns = dict((label, imgMd.getColumnValues(label))
+                   for label in ALIGNMENT_DICT.values()
+                   if imgMd.containsLabel(label))
+    if not columns:
+        return None
+    return alignmentColumnsToMatrices(columns, alignType)
+
+
+def writeAlignmentMatrices(imgMd, matrices, alignType):
+    """ Write the alignment columns of all rows of a metadata at once,
+    from an array with the transformation matrix of each row.
+    """
+    for label, values in matricesToAlignmentColumns(matrices, alignType).iteritems():
+        imgMd.setColumnValues(label, values)
+
+
 def fillClasses(clsSet, updateClassCallback=None):
     """ Give an empty SetOfClasses (either 2D or 3D).
     Iterate over the input images and append to the corresponding class.
@@ -126,7 +126,7 @@ class XmippProtExtractMovieParticles(ProtExtractMovieParticles):
         ProtExtractMovieParticles._insertAllSteps(self)
 
 
-    def _insertMovieStep(self, movie):
+    def _getMovieStepArgs(self, movie):
         # Redefine this function to add the shifts and factor
         # to the processMovieStep function and run properly in parallel with threads
 
@@ -142,11 +142,7 @@ class XmippProtExtractMovieParticles(ProtExtractMovieParticles):
             _, _, _, n = imgh.getDimensions(movieName)
             shifts = [0] * (2*n)
                  
-        movieStepId = self._insertFunctionStep('processMovieStep',
-                                               movie.getObjId(), movie.getFileName(),
-                                               shifts, prerequisites=[])  
-        
-        return movieStepId 
+        return (movie.getObjId(), movie.getFileName(), shifts)
     
     #--------------------------- STEPS functions --------------------------------------------------
     def _processMovie(self, movieId, movieName, movieFolder, shifts):###pasar shifts
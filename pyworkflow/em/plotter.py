@@ -171,9 +171,9 @@ class PlotData():
         return setObj
     
     def _getValuesFromSet(self, columnName):
-        return [self._getValue(obj, columnName) 
-                  for obj in self._table.iterItems(orderBy=self._orderColumn, 
-                                                   direction=self._orderDirection)]
+        # Read only the needed column, without building the items
+        return self._table.getColumns([columnName], orderBy=self._orderColumn,
+                                      direction=self._orderDirection)[columnName]
         
     def _loadMd(self, fileName, tableName):
         label = md.str2Label(self._orderColumn)
@@ -185,9 +185,3 @@ class PlotData():
     def _getValuesFromMd(self, columnName):
         label = md.str2Label(columnName)
         return [self._table.getValue(label, objId) for objId in self._table]
-    
-    def _getValue(self, obj, column):
-        if column == 'id':
-            return obj.getObjId()
-        
-        return obj.getNestedValue(column)
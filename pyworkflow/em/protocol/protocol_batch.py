@@ -129,9 +129,7 @@ class ProtUserSubSet(BatchProtocol):
         modifiedSet = inputObj.getClass()(filename=self._dbName, prefix=self._dbPrefix)
 
         output = createFunc()
-        for item in modifiedSet:
-            if item.isEnabled():
-                output.append(item)
+        output.appendFromSet(modifiedSet, where='enabled=1')
 
         if hasattr(modifiedSet, 'copyInfo'):
             output.copyInfo(inputObj)
@@ -217,9 +215,7 @@ class ProtUserSubSet(BatchProtocol):
         
         modifiedSet = SetOfCTF(filename=self._dbName, prefix=self._dbPrefix)
         
-        for ctf in modifiedSet:
-            if ctf.isEnabled():
-                setOfCtf.append(ctf)
+        setOfCtf.appendFromSet(modifiedSet, where='enabled=1')
                 
         # Register outputs
         self._defineOutput(self.outputClassName.get(), setOfCtf)
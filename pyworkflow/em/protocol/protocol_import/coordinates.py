@@ -32,7 +32,6 @@ from os.path import join, exists
 from pyworkflow.protocol.params import IntParam, PointerParam, FloatParam, BooleanParam
 from pyworkflow.utils.path import removeBaseExt
 from pyworkflow.em.protocol.protocol_particles import ProtParticlePicking
-import xmipp
         
 from base import ProtImportFiles
 
@@ -226,6 +225,7 @@ class ProtImportCoordinates(ProtImportFiles, ProtParticlePicking):
             configfile = join(self.filesPath.get(), 'config.xmd')
             existsConfig = exists(configfile)
             if existsConfig:
+                import xmipp
                 md = xmipp.MetaData('properties@' + configfile)
                 configobj = md.firstObject()
                 boxSize = md.getValue(xmipp.MDL_PICKING_PARTICLE_SIZE, configobj)
@@ -30,6 +30,7 @@ In this module are protocol base classes related to EM imports of Micrographs, P
 import sys
 from os.path import basename, exists, isdir
 
+from pyworkflow.object import Set
 from pyworkflow.utils.path import commonPath
 from pyworkflow.utils.properties import Message
 from pyworkflow.protocol.params import FloatParam, IntParam, LabelParam, BooleanParam
@@ -50,6 +51,9 @@ class ProtImportImages(ProtImportFiles):
     # If set to True, each binary file will be inspected to
     # see if it is a binary stack containing more items
     _checkStacks = True
+    # If set to True, the output set is updated after importing each
+    # file, so other protocols can process it while it is produced
+    _streamingOutput = False
         
     #--------------------------- DEFINE param functions --------------------------------------------
     def _defineParams(self, form):
@@ -111,41 +115,50 @@ class ProtImportImages(ProtImportFiles):
         imgh = ImageHandler()
         img = imgSet.ITEM_TYPE()
         img.setAcquisition(acquisition)
-        n = 1
         copyOrLink = self.getCopyOrLink()
-        for i, (fileName, fileId) in enumerate(self.iterFiles()):
-            dst = self._getExtraPath(basename(fileName))
-            copyOrLink(fileName, dst)
-            # Handle special case of Imagic images, copying also .img or .hed
-            self.handleImgHed(copyOrLink, fileName, dst)
-            
-            if self._checkStacks:
-                _, _, _, n = imgh.getDimensions(dst)
+        
+        def _iterImages():
+            n = 1
+            for i, (fileName, fileId) in enumerate(self.iterFiles()):
+                dst = self._getExtraPath(basename(fileName))
+                copyOrLink(fileName, dst)
+                # Handle special case of Imagic images, copying also .img or .hed
+                self.handleImgHed(copyOrLink, fileName, dst)
                 
-            if n > 1:
-                for index in range(1, n+1):
-                    img.cleanObjId()
-                    img.setMicId(fileId)
+                if self._checkStacks:
+                    _, _, _, n = imgh.getDimensions(dst)
+                    
+                if n > 1:
+                    for index in range(1, n+1):
+                        img.cleanObjId()
+                        img.setMicId(fileId)
+                        img.setFileName(dst)
+                        img.setIndex(index)
+                        yield img
+                else:
+                    img.setObjId(fileId)
                     img.setFileName(dst)
-                    img.setIndex(index)
-                    imgSet.append(img)
-            else:
-                img.setObjId(fileId)
-                img.setFileName(dst)
-                self._fillMicName(img, fileName) # fill the micName if img is a Micrograph.
+                    self._fillMicName(img, fileName) # fill the micName if img is a Micrograph.
+                    yield img
+                outFiles.append(dst)
+                
+                sys.stdout.write("\rImported %d/%d" % (i+1, self.numberOfFiles))
+                sys.stdout.flush()
+        
+        outputName = self._getOutputName()
+        
+        if self._streamingOutput:
+            for img in _iterImages():
                 imgSet.append(img)
-            outFiles.append(dst)
-            
-            sys.stdout.write("\rImported %d/%d" % (i+1, self.numberOfFiles))
-            sys.stdout.flush()
+                self._updateOutputSet(outputName, imgSet)
+            self._updateOutputSet(outputName, imgSet, Set.STREAM_CLOSED)
+        else:
+            # Images are written in bulk, which is much faster for big imports
+            imgSet.appendMany(_iterImages())
+            self._defineOutputs(**{outputName: imgSet})
             
         print "\n"
         
-        args = {}
-        outputSet = self._getOutputName()
-        args[outputSet] = imgSet
-        self._defineOutputs(**args)
-        
         return outFiles
     
     #--------------------------- INFO functions ----------------------------------------------------
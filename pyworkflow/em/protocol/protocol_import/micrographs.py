@@ -42,6 +42,7 @@ class ProtImportMicBase(ProtImportImages):
     ProtImportMicrographs and ProtImportMovies
     """
     _checkStacks = False
+    _streamingOutput = True
     
     def _defineParams(self, form):
         ProtImportImages._defineParams(self, form)
@@ -32,10 +32,10 @@ import os
 from os.path import join, basename, exists, dirname, relpath
 from itertools import izip
 
-from pyworkflow.object import String, Boolean
+from pyworkflow.object import String, Boolean, Set
 from pyworkflow.protocol.constants import STEPS_PARALLEL, LEVEL_ADVANCED
 from pyworkflow.protocol.params import PointerParam, FloatParam, IntParam, TextParam, BooleanParam, FileParam
-from pyworkflow.utils.path import copyTree, copyFile, removeBaseExt, makePath, moveFile
+from pyworkflow.utils.path import copyTree, copyFile, removeBaseExt, makePath, moveFile, getFiles
 from pyworkflow.utils.properties import Message
 from pyworkflow.em.protocol import EMProtocol
 from pyworkflow.em.data import Micrograph, SetOfImages, SetOfCTF
@@ -43,11 +43,30 @@ from pyworkflow.em.data import Micrograph, SetOfImages, SetOfCTF
 
 
 class ProtMicrographs(EMProtocol):
-    pass
+    
+    def _appendToOutputSet(self, outputName, createSetFunc, items, closed=False):
+        """ Append items to an output set produced in streaming (see
+        _updateOutputSet), that is created with createSetFunc the first
+        time. The set is kept open until closed is True.
+        """
+        outputSet = getattr(self, outputName, None)
+        if outputSet is None:
+            outputSet = createSetFunc()
+        else:
+            outputSet.enableAppend()
+        for item in items:
+            outputSet.append(item)
+        state = Set.STREAM_CLOSED if closed else Set.STREAM_OPEN
+        self._updateOutputSet(outputName, outputSet, state)
+        outputSet.close()
 
 
 class ProtCTFMicrographs(ProtMicrographs):
     """ Base class for all protocols that estimates the CTF"""
+    # If True, outputCTF is filled with the CTF of each micrograph
+    # when it is estimated (see _createCtfModel), instead of being
+    # created at the end by _createOutputStep
+    _streamingOutput = False
     
     def __init__(self, **args):
         EMProtocol.__init__(self, **args)
@@ -124,33 +143,59 @@ class ProtCTFMicrographs(ProtMicrographs):
         fDeps = []
         
         if not self.recalculate:
-            deps = self._insertEstimationSteps()
-            # Insert step to create output objects
-            fDeps = self._insertFinalSteps(deps)
+            self._defineValues()
+            self._prepareCommand()
+            self._estimationSteps = []
+            # The output is created when all micrographs are
+            # estimated, so also when a streaming input is closed
+            self._insertNewEstimationSteps()
         else:
             if self.isFirstTime:
                 self._insertPreviousSteps() # Insert previous estimation or re-estimation an so on...
                 self.isFirstTime.set(False)
             fDeps = self._insertRecalculateSteps()
-        
-        self._insertFunctionStep('createOutputStep', prerequisites=fDeps)
+            self._insertFunctionStep('createOutputStep', prerequisites=fDeps)
     
     def _insertFinalSteps(self, deps):
         """ This should be implemented in subclasses"""
         return deps
     
+    def _insertNewEstimationSteps(self):
+        """ Insert the estimation steps of the micrographs not inserted
+        yet and, if the input set is closed, the final steps.
+        Return True if more micrographs can be added to the input set.
+        """
+        self._estimationSteps += self._insertEstimationSteps()
+        
+        if self.inputMics.isStreamOpen():
+            return True
+        # Insert step to create output objects
+        fDeps = self._insertFinalSteps(self._estimationSteps)
+        self._insertFunctionStep('createOutputStep', prerequisites=fDeps)
+        return False
+    
+    def _stepsCheck(self):
+        if self.recalculate:
+            return False
+        # Estimate the CTF of the new micrographs of a streaming input
+        self.inputMics.loadStreamState()
+        return self._insertNewEstimationSteps()
+    
+    def _itemsDone(self, funcName, itemsIds):
+        if self._streamingOutput and funcName == '_estimateMicCTF':
+            self._updateOutputCTF(itemsIds)
+    
     def _insertEstimationSteps(self):
-        estimDeps = []
-        self._defineValues()
-        self._prepareCommand()
-        # For each micrograph insert the steps to process it
-        for micFn, micDir, mic in self._iterMicrographs():
-            # CTF estimation
-            # Make estimation steps independent between them
-            stepId = self._insertFunctionStep('_estimateCTF', micFn, micDir, mic.getMicName(),
-                                                  prerequisites=[]) # Make estimation steps independent between them
-            estimDeps.append(stepId)
-        return estimDeps
+        # Estimate the CTF of each micrograph, grouping
+        # several micrographs in each step
+        def _getMicArgs(mic):
+            return (mic.getFileName(), self._getMicrographDir(mic), mic.getMicName())
+        # Make estimation steps independent between them, their
+        # results can be taken from the steps cache (e.g. when the
+        # protocol is copied and run again)
+        return self._insertNewItemsSteps(self.inputMics, '_estimateMicCTF',
+                                         _getMicArgs, prerequisites=[],
+                                         cacheable=True)
     
     def _insertRecalculateSteps(self):
         recalDeps = []
@@ -176,6 +221,13 @@ class ProtCTFMicrographs(ProtMicrographs):
         """
         raise Exception(Message.ERROR_NO_EST_CTF)
     
+    def _estimateMicCTF(self, micFn, micDir, micName):
+        """ Estimate the CTF of a micrograph (see _estimateCTF) and
+        return the files written in its directory.
+        """
+        self._estimateCTF(micFn, micDir, micName)
+        return sorted(getFiles(micDir))
+    
     def _restimateCTF(self, id):
         """ Do the CTF estimation with the specific program
         and the parameters required.
@@ -243,6 +295,19 @@ class ProtCTFMicrographs(ProtMicrographs):
     
             self._defocusMaxMin(defocusList)
             self._ctfCounter(defocusList)
+        elif self._streamingOutput:
+            # Add the micrographs not added yet (e.g. estimated in a
+            # previous run) and close the output
+            outputCTF = getattr(self, 'outputCTF', None)
+            doneIds = set() if outputCTF is None else set(ctf.getObjId() for ctf in outputCTF)
+            self._updateOutputCTF([mic.getObjId() for mic in self.inputMics
+                                   if mic.getObjId() not in doneIds], closed=True)
+            defocusList = []
+            for ctfModel in self.outputCTF:
+                defocusList.append(ctfModel.getDefocusU())
+                defocusList.append(ctfModel.getDefocusV())
+            self._defocusMaxMin(defocusList)
+            self._defineCtfRelation(self.inputMics, self.outputCTF)
         else:
             self._createOutputStep()
         
@@ -309,6 +374,26 @@ class ProtCTFMicrographs(ProtMicrographs):
                         'samplingRate': mic.getSamplingRate()
                        }
     
+    def _createCtfModel(self, mic):
+        """ Return the CTF model estimated for a micrograph, it should be
+        implemented by the subclasses with _streamingOutput.
+        """
+        raise Exception(Message.ERROR_NO_EST_CTF)
+    
+    def _updateOutputCTF(self, micIds, closed=False):
+        """ Add to outputCTF the CTF models of the given micrographs. """
+        def _createSetOfCTF():
+            ctfSet = self._createSetOfCTF()
+            ctfSet.setMicrographs(self.inputMics)
+            return ctfSet
+        
+        ctfModels = []
+        for micId in micIds:
+            ctfModel = self._createCtfModel(self.inputMics[micId])
+            ctfModel.setObjId(micId)
+            ctfModels.append(ctfModel)
+        self._appendToOutputSet('outputCTF', _createSetOfCTF, ctfModels, closed)
+    
     def _getPrevMicDir(self, ctfModel):
         return dirname(ctfModel.getPsdFile())
     
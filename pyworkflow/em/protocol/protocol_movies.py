@@ -54,6 +54,10 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
     This base class will iterate through the movies (extract them if compressed)
     and call a _processMovie method for each one.
     """
+    # If True, outputMicrographs is filled with the micrograph of each
+    # movie when it is processed (see _createOutputMicrograph), and the
+    # output is closed by createOutputStep
+    _streamingOutput = False
     
     def __init__(self, **kwargs):
         ProtPreprocessMicrographs.__init__(self, **kwargs)
@@ -82,19 +86,39 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
         # Build the list of all processMovieStep ids by 
         # inserting each of the steps for each movie
         self.samplingRate = self.inputMovies.get().getSamplingRate()
-        allMovies = [self._insertMovieStep(movie) for movie in self.inputMovies.get()]
-        self._insertFunctionStep('createOutputStep', prerequisites=allMovies)
+        self._movieSteps = []
+        self._insertNewMoviesSteps()
+        
+    def _insertNewMoviesSteps(self):
+        """ Insert the steps to process the movies not inserted yet
+        (several movies are processed in each step) and, if the
+        input set is closed, the step to create the output.
+        Return True if more movies can be added to the input set.
+        """
+        inputMovies = self.inputMovies.get()
+        self._movieSteps += self._insertNewItemsSteps(inputMovies, 'processMovieStep',
+                                                      self._getMovieStepArgs,
+                                                      prerequisites=[])
+        if inputMovies.isStreamOpen():
+            return True
+        self._insertFunctionStep('createOutputStep', prerequisites=self._movieSteps)
+        return False
+    
+    def _stepsCheck(self):
+        # Process the new movies of a streaming input set
+        self.inputMovies.get().loadStreamState()
+        return self._insertNewMoviesSteps()
+    
+    def _itemsDone(self, funcName, itemsIds):
+        if self._streamingOutput and funcName == 'processMovieStep':
+            self._updateOutputMicrographs(itemsIds)
 
-    def _insertMovieStep(self, movie):
-        """ Insert the processMovieStep for a given movie. """
+    def _getMovieStepArgs(self, movie):
+        """ Return the arguments of processMovieStep for a given movie. """
         # Note that at this point is safe to pass the movie, since this
         # is not executed in parallel, here we get the params
         # to pass to the actual step that is gone to be executed later on
-        movieStepId = self._insertFunctionStep('processMovieStep',
-                                               movie.getObjId(), movie.getFileName(),
-                                               prerequisites=[])  
-        
-        return movieStepId      
+        return (movie.getObjId(), movie.getFileName())
         
         
     #--------------------------- STEPS functions ---------------------------------------------------
@@ -136,12 +160,48 @@ class ProtProcessMovies(ProtPreprocessMicrographs):
             else:
                 self.info('Clean movie data DISABLED. Movie folder will remain in disk!!!')
         
+    def createOutputStep(self):
+        """ Add to outputMicrographs the movies not added yet (e.g.
+        processed in a previous run) and close it. Subclasses without
+        _streamingOutput should create their outputs here.
+        """
+        inputMovies = self.inputMovies.get()
+        outputMics = getattr(self, 'outputMicrographs', None)
+        doneIds = set() if outputMics is None else set(mic.getObjId() for mic in outputMics)
+        self._updateOutputMicrographs([movie.getObjId() for movie in inputMovies
+                                       if movie.getObjId() not in doneIds], closed=True)
+        self._defineTransformRelation(inputMovies, self.outputMicrographs)
+        
     #--------------------------- UTILS functions ---------------------------------------------------
     def _filterMovie(self, movieId, movieFn):
         """ Check if process or not this movie.
         """
         return True
     
+    def _createOutputMicrograph(self, movie):
+        """ Return the micrograph obtained from a processed movie, it
+        should be implemented by the subclasses with _streamingOutput.
+        """
+        raise Exception("_createOutputMicrograph should be implemented "
+                        "by the protocols with _streamingOutput")
+    
+    def _updateOutputMicrographs(self, moviesIds, closed=False):
+        """ Add to outputMicrographs the micrographs of the given movies. """
+        inputMovies = self.inputMovies.get()
+        
+        def _createSetOfMicrographs():
+            micSet = self._createSetOfMicrographs()
+            micSet.copyInfo(inputMovies)
+            return micSet
+        
+        mics = []
+        for movieId in moviesIds:
+            mic = self._createOutputMicrograph(inputMovies[movieId])
+            mic.setObjId(movieId)
+            mics.append(mic)
+        self._appendToOutputSet('outputMicrographs', _createSetOfMicrographs,
+                                mics, closed)
+    
     def _getMovieFolder(self, movieId):
         """ Create a Movie folder where to work with it. """
         return self._getTmpPath('movie_%06d' % movieId)  
@@ -31,7 +31,8 @@ This module contains protocols related to Set operations such us:
 ... etc
 """
 
-import random
+import numpy as np
+
 from protocol import EMProtocol
 import pyworkflow.protocol as pwprot
 
@@ -128,14 +129,16 @@ class ProtUnionSet(ProtSets):
         outputSet.copyInfo(set1)  # all sets must have the same info as set1!
 
         # Renumber from the beginning if either the renumber option is selected
-        # or we find duplicated ids in the sets
-        cleanIds = self.renumber.get() or self.duplicatedIds()
+        # or we find duplicated ids in the sets (unless we were asked to
+        # keep only the first copy of duplicated items)
+        duplicated = self.duplicatedIds()
+        ignoreDuplicates = duplicated and self.ignoreDuplicates.get()
+        cleanIds = self.renumber.get() or (duplicated and not ignoreDuplicates)
+        uniqueBy = 'id' if ignoreDuplicates and not cleanIds else None
 
         for itemSet in self.inputSets:
-            for obj in itemSet.get():
-                if cleanIds:
-                    obj.cleanObjId()
-                outputSet.append(obj)
+            outputSet.appendFromSet(itemSet.get(), renumber=cleanIds,
+                                    uniqueBy=uniqueBy)
 
         self._defineOutputs(outputSet=outputSet)
         for itemSet in self.inputSets:
@@ -146,15 +149,12 @@ class ProtUnionSet(ProtSets):
     
     def duplicatedIds(self):
         """ Check if there are duplicated ids to renumber from the beginning. """
-        usedIds = set()  # to keep track of the object ids we have already seen
-        
-        for itemSet in self.inputSets:
-            for obj in itemSet.get():
-                objId = obj.getObjId()
-                if objId in usedIds:
-                    return True
-                usedIds.add(objId)
-        return False
+        ids = [itemSet.get().getColumns(['id'])['id']
+               for itemSet in self.inputSets]
+        if not ids:
+            return False
+        allIds = np.concatenate(ids)
+        return len(np.unique(allIds)) < len(allIds)
 
     #--------------------------- INFO functions --------------------------------------------
     def _validate(self):
@@ -335,30 +335,18 @@ class ProtSubSet(ProtSets):
         outputSet.copyInfo(inputFullSet)
 
         if self.chooseAtRandom:
-            chosen = random.sample(xrange(len(inputFullSet)), self.nElements.get())
-            for i, elem in enumerate(inputFullSet):
-                if i in chosen:
-                    outputSet.append(elem)
+            for elem in inputFullSet.iterItems(orderBy='RANDOM()',
+                                               limit=self.nElements.get()):
+                outputSet.append(elem)
         else:
-            # Iterate over the elements in the smaller set
-            # and take the info from the full set
+            # Select the elements of the full set whose id is present
+            # (intersection) or not (difference) in the subset
             inputSubSet = self.inputSubSet.get()
-            # The function to include an element or not
-            # depends on the set operation
-            # if it is 'intersection' we want that item is not None (found)
-            # if it is 'difference' we want that item is None (not found, different)
             if self.setOperation == self.SET_INTERSECTION:
-                checkElem = lambda e: e is not None
+                outputSet.appendIntersection(inputFullSet, inputSubSet)
             else:
-                checkElem = lambda e: e is None 
-            
-            for origElem in inputFullSet:
-                # TODO: this can be improved if we perform
-                # intersection directly in sqlite
-                otherElem = inputSubSet[origElem.getObjId()]
-                if checkElem(otherElem):
-                    outputSet.append(origElem)
-            
+                outputSet.appendDifference(inputFullSet, inputSubSet)
+
         if outputSet.getSize():
             key = 'output' + inputClassName.replace('SetOf', '') 
             self._defineOutputs(**{key: outputSet})
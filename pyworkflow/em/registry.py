@@ -0,0 +1,265 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module implements a registry of the classes (protocols, objects,
+viewers and wizards) defined in the EM packages, that is stored in a file.
+The registry keeps where each class can be found and the targets of
+viewers and wizards, so the classes can be resolved by importing only
+the package that defines them, instead of importing all packages.
+It is built again when any file of the packages is modified.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import traceback
+
+
+# Where a class can be found: in a module (e.g. pyworkflow.em)
+# or in an EM package (e.g. xmipp3, imported from the packages path)
+LOCATION_MODULE = 'module'
+LOCATION_PACKAGE = 'package'
+
+
+class ClassesRegistry(object):
+    """ Keep the location of the classes of the EM packages,
+    and the targets of viewers and wizards, in a json file.
+    """
+    VERSION = 1
+
+    def __init__(self, path, packagesPath, sourcePaths=None):
+        """
+        Params:
+            path: the file where the registry is stored.
+            packagesPath: the folder with the EM packages, the
+                registry is valid while the files there do not change.
+            sourcePaths: other folders with registered classes
+                (e.g. pyworkflow/em), also checked for changes.
+        """
+        self.path = path
+        self.packagesPath = packagesPath
+        self.sourcePaths = sourcePaths or []
+        self._signature = None
+        self._classes = {}
+        self._viewers = {}
+        self._wizards = {}
+
+    def getSignature(self):
+        """ Return a digest of the path, size and modification time
+        of the python files of the packages (and the source paths).
+        """
+        if self._signature is None:
+            h = hashlib.md5('%s %d' % (self.packagesPath, self.VERSION))
+            paths = [self.packagesPath] + self.sourcePaths
+            walkPaths = set(os.path.abspath(p) for p in paths)
+            for path in paths:
+                for root, dirs, files in os.walk(path):
+                    # Do not walk twice the paths inside others
+                    # (e.g. the packages inside pyworkflow/em)
+                    dirs[:] = sorted(d for d in dirs if os.path.abspath(
+                        os.path.join(root, d)) not in walkPaths)
+                    for f in sorted(files):
+                        if f.endswith('.py'):
+                            st = os.stat(os.path.join(root, f))
+                            h.update('%s %d %d' % (os.path.join(root, f),
+                                                   st.st_size, st.st_mtime))
+            self._signature = h.hexdigest()
+        return self._signature
+
+    def load(self):
+        """ Read the registry from the file.
+        Return False if it does not exist or it is out of date.
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        if data.get('signature') != self.getSignature():
+            return False
+
+        self._classes = data['classes']
+        self._viewers = data['viewers']
+        self._wizards = data['wizards']
+        return True
+
+    def _getLocation(self, name, cls, modules, packages):
+        """ Find the module (or package) where the class
+        can be retrieved with the given name.
+        """
+        for module in modules:
+            if getattr(module, name, None) is cls:
+                return LOCATION_MODULE, module.__name__
+        # Look first in the package where the class is defined
+        moduleName = cls.__module__.replace('pyworkflow.em.packages.', '')
+        packageName = moduleName.split('.')[0]
+        for pkgName in [packageName] + sorted(packages):
+            if getattr(packages.get(pkgName), name, None) is cls:
+                return LOCATION_PACKAGE, pkgName
+        return LOCATION_MODULE, cls.__module__
+
+    def build(self, classes, viewers, wizards, modules, packages):
+        """ Create the registry from the loaded classes and write it.
+        Params:
+            classes: dict with the protocols and objects classes.
+            viewers, wizards: dicts with the viewers and wizards classes.
+            modules: the modules where the classes could be imported from
+                (e.g. pyworkflow.em), other than the packages.
+            packages: dict with the EM packages modules.
+        """
+        def _loc(name, cls):
+            return self._getLocation(name, cls, modules, packages)
+
+        self._signature = None  # the files could have changed since load
+
+        def _name(cls):
+            return cls if isinstance(cls, basestring) else cls.__name__
+
+        self._classes = dict((name, _loc(name, cls))
+                             for name, cls in classes.iteritems())
+        self._viewers = dict((name, {'location': _loc(name, cls),
+                                     'targets': [_name(t) for t in cls._targets],
+                                     'environments': list(cls._environments)})
+                             for name, cls in viewers.iteritems())
+        self._wizards = dict((name, {'location': _loc(name, cls),
+                                     'targets': [(_name(t), list(params))
+                                                 for t, params in cls._targets],
+                                     'environments': list(cls._environments)})
+                             for name, cls in wizards.iteritems())
+        self.write()
+
+    def write(self):
+        """ Write the registry, ignoring errors (e.g. no permission to
+        write it), since it will be built again the next time.
+        """
+        data = {'signature': self.getSignature(),
+                'classes': self._classes,
+                'viewers': self._viewers,
+                'wizards': self._wizards}
+        tmpPath = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(tmpPath, 'w') as f:
+                json.dump(data, f)
+            # Rename is atomic, so other processes never read a partial file
+            os.rename(tmpPath, self.path)
+        except (IOError, OSError):
+            if os.path.exists(tmpPath):
+                os.remove(tmpPath)
+
+    def _importPackage(self, packageName):
+        """ Import a single EM package as done by em.getPackages. """
+        if self.packagesPath not in sys.path:
+            sys.path.append(self.packagesPath)
+        return __import__(packageName)
+
+    def _resolve(self, name, location):
+        """ Return the class with the given name and location,
+        or None if it can not be imported.
+        """
+        kind, moduleName = location
+        try:
+            if kind == LOCATION_PACKAGE:
+                module = self._importPackage(moduleName)
+            else:
+                __import__(moduleName)
+                module = sys.modules[moduleName]
+        except Exception, ex:
+            print ">>> Error loading module: '%s'" % moduleName
+            print ">>> Exception: ", ex
+            traceback.print_exc()
+            return None
+
+        cls = getattr(module, name, None)
+        # Set the package of the classes defined in it,
+        # as done by getSubclassesFromModules
+        if (kind == LOCATION_PACKAGE and cls is not None and
+                cls.__module__.replace('pyworkflow.em.packages.', '').startswith(moduleName)):
+            cls._package = module
+        return cls
+
+    def hasClass(self, name):
+        return name in self._classes
+
+    def getClass(self, name):
+        """ Return a protocol or object class, or None if not found. """
+        if name not in self._classes:
+            return None
+        return self._resolve(name, self._classes[name])
+
+    def getViewer(self, name):
+        return self._resolve(name, self._viewers[name]['location'])
+
+    def getWizard(self, name):
+        return self._resolve(name, self._wizards[name]['location'])
+
+    def findViewers(self, classNames, environment):
+        """ Return the names of the viewers for the environment
+        with some target in classNames (e.g. the class hierarchy).
+        """
+        classNames = set(classNames)
+        return [name for name, viewer in sorted(self._viewers.iteritems())
+                if environment in viewer['environments'] and
+                classNames.intersection(viewer['targets'])]
+
+    def findWizards(self, classNames, environment):
+        """ Return the names of the wizards for the environment
+        with some target in classNames (e.g. the protocol hierarchy).
+        """
+        classNames = set(classNames)
+        return [name for name, wizard in sorted(self._wizards.iteritems())
+                if environment in wizard['environments'] and
+                any(t in classNames for t, _ in wizard['targets'])]
+
+
+class LazyClassesDict(dict):
+    """ Dictionary of classes by their names, where the classes that are
+    not in the dictionary are taken from a ClassesRegistry, importing
+    their package on first access.
+    """
+    def __init__(self, registry, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._registry = registry
+
+    def __missing__(self, key):
+        cls = self._registry.getClass(key)
+        if cls is None:
+            raise KeyError(key)
+        self[key] = cls
+        return cls
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
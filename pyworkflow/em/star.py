@@ -0,0 +1,363 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module implements a reader and a writer of STAR files
+(the metadata format used by Relion) that do not depend on xmipp.
+The rows of a block are read from the file while iterating, either one
+by one or in chunks of numpy arrays (one per column), so big files
+can be processed with bounded memory.
+"""
+
+import re
+from itertools import izip, islice
+from collections import OrderedDict
+
+import numpy
+
+
+CHUNK_SIZE = 100000
+
+# Conversion from the values types to the numpy arrays types
+NUMPY_TYPES = {int: numpy.int64,
+               float: numpy.float64,
+               bool: numpy.bool_}
+
+
+def _valueType(value):
+    """ Guess the type (int, float or str) of a value string. """
+    for valueType in [int, float]:
+        try:
+            valueType(value)
+            return valueType
+        except ValueError:
+            pass
+    return str
+
+
+def _fixType(valueType, value):
+    """ Return the type for a column of valueType with a value that
+    can not be converted to it: float for int columns if possible,
+    otherwise str (e.g. a column with 001 and then mic_a.mrc).
+    """
+    try:
+        valueType(value)
+        return valueType
+    except ValueError:
+        if valueType is int and _valueType(value) is float:
+            return float
+        return str
+
+
+def _toBool(value):
+    return value not in ('0', '-1', 'false', 'False')
+
+
+# Values quoted (e.g. 'a b') or without spaces
+_VALUES_RE = re.compile(r"""'([^']*)'|"([^"]*)"|(\S+)""")
+
+
+def _quoteValue(value):
+    """ Quote the string values that are empty or contain spaces,
+    so they are read back as a single value.
+    """
+    value = str(value)
+    if value and not _SPACES_RE.search(value):
+        return value
+    if "'" in value:
+        return '"%s"' % value
+    return "'%s'" % value
+
+
+_SPACES_RE = re.compile(r'\s')
+
+
+def _splitValues(line):
+    """ Split the values of a line, taking into account the
+    values quoted because they contain spaces.
+    """
+    if "'" not in line and '"' not in line:
+        return line.split()
+    return [q1 or q2 or v for q1, q2, v in _VALUES_RE.findall(line)]
+
+
+class StarReader(object):
+    """ Read the blocks of a STAR file. Blocks are identified by
+    their name (the text after data_), if the name is None
+    the first block of the file is used.
+    The columns are named as the labels without the
+    leading underscore (e.g. rlnImageName).
+    """
+    def __init__(self, filename):
+        self._filename = filename
+
+    def getBlocks(self):
+        """ Return the names of the blocks in the file. """
+        with open(self._filename) as f:
+            return [line.strip()[5:] for line in f if line.startswith('data_')]
+
+    def _openBlock(self, f, blockName):
+        """ Move the file f to the block with the given name and read its
+        header. Return the list of labels and an iterator over the
+        lines (with the values of each row) of the block.
+        """
+        for line in f:
+            if line.startswith('data_') and (blockName is None or
+                                             line.strip()[5:] == blockName):
+                break
+        else:
+            raise Exception("Block '%s' not found in file '%s'"
+                            % (blockName, self._filename))
+
+        labels = []
+        values = []
+        isLoop = False
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('loop_'):
+                isLoop = True
+            elif line.startswith('_'):
+                parts = line.split(None, 1)
+                labels.append(parts[0][1:])
+                if not isLoop: # label and value pairs
+                    values.append(parts[1].split('#')[0].strip())
+            else:
+                break
+        else:
+            line = None
+
+        if not isLoop:
+            return labels, iter([' '.join(values)])
+
+        def _iterLines(line):
+            while line is not None:
+                if line.startswith('data_'):
+                    return
+                if line and not line.startswith('#'):
+                    yield line
+                line = next(f, None)
+                if line is not None:
+                    line = line.strip()
+
+        return labels, _iterLines(line)
+
+    def getColumns(self, blockName=None):
+        """ Return the labels of the given block. """
+        with open(self._filename) as f:
+            return self._openBlock(f, blockName)[0]
+
+    def _getIndexes(self, labels, columns):
+        if columns is None:
+            return labels, range(len(labels))
+        missing = [c for c in columns if c not in labels]
+        if missing:
+            raise Exception("Columns %s not found in file '%s'"
+                            % (missing, self._filename))
+        return columns, [labels.index(c) for c in columns]
+
+    def iterRows(self, blockName=None, columns=None, types=None):
+        """ Iterate over the rows of a block, reading them from the file.
+        Params:
+            columns: the labels to read (all of them if None).
+            types: a dict with the type (int, float, bool or str) of some
+                columns, the type of the other ones is guessed from the
+                first row.
+        Returns:
+            tuples with the values of the columns for each row.
+        """
+        with open(self._filename) as f:
+            labels, lines = self._openBlock(f, blockName)
+            columns, indexes = self._getIndexes(labels, columns)
+            types = types or {}
+            converters = None
+
+            for line in lines:
+                values = _splitValues(line)
+                if len(values) != len(labels):
+                    raise Exception("Wrong number of values in row '%s' "
+                                    "of file '%s'" % (line, self._filename))
+                values = [values[i] for i in indexes]
+                if converters is None:
+                    converters = [types.get(c) or _valueType(v)
+                                  for c, v in izip(columns, values)]
+                    converters = [_toBool if t is bool else t
+                                  for t in converters]
+                try:
+                    yield tuple(conv(v) for conv, v in izip(converters, values))
+                except ValueError: # e.g. int columns with some float value
+                    converters = [_fixType(conv, v)
+                                  for conv, v in izip(converters, values)]
+                    yield tuple(conv(v) for conv, v in izip(converters, values))
+
+    def iterChunks(self, blockName=None, columns=None, types=None,
+                   chunkSize=CHUNK_SIZE):
+        """ Iterate over the rows of a block in chunks of at most
+        chunkSize rows. Each chunk is an OrderedDict with
+        a numpy array with the values of each column.
+        See iterRows for the other params.
+        """
+        with open(self._filename) as f:
+            labels, lines = self._openBlock(f, blockName)
+            columns, indexes = self._getIndexes(labels, columns)
+            types = dict(types or {})
+
+            while True:
+                chunk = list(islice(lines, chunkSize))
+                if not chunk:
+                    break
+                yield self._chunkToArrays(chunk, len(labels), columns,
+                                          indexes, types)
+
+    def _chunkToArrays(self, chunk, n, labels, indexes, types):
+        """ Convert the lines of a chunk of rows (with n values each)
+        to an array per column. All the lines are split at once and
+        the values of each column are taken from the list of values.
+        The types dict is updated with the type found for each column.
+        """
+        text = ' '.join(chunk)
+        if "'" in text or '"' in text:
+            values = [v for line in chunk for v in _splitValues(line)]
+        else:
+            values = text.split()
+        if len(values) != n * len(chunk):
+            raise Exception("Wrong number of values in some row of file '%s'"
+                            % self._filename)
+        arrays = OrderedDict()
+        for label, i in izip(labels, indexes):
+            column = values[i::n]
+            if label not in types:
+                types[label] = _valueType(column[0])
+            valueType = types[label]
+            if valueType is bool:
+                arrays[label] = numpy.array(map(_toBool, column), dtype=numpy.bool_)
+            elif valueType is int:
+                try:
+                    arrays[label] = numpy.array(column, dtype=numpy.int64)
+                except ValueError:
+                    types[label] = valueType = float
+            if valueType is float:
+                try:
+                    arrays[label] = numpy.array(column, dtype=numpy.float64)
+                except ValueError:
+                    types[label] = valueType = str
+            if valueType is str:
+                arrays[label] = numpy.array(column)
+        return arrays
+
+    def readArrays(self, blockName=None, columns=None, types=None):
+        """ Read all the rows of a block.
+        Return an OrderedDict with a numpy array for each column.
+        """
+        arrays = OrderedDict()
+        chunks = list(self.iterChunks(blockName, columns, types))
+        if chunks:
+            for label in chunks[0]:
+                arrays[label] = numpy.concatenate([c[label] for c in chunks])
+        else:
+            for label in columns or self.getColumns(blockName):
+                arrays[label] = numpy.array([])
+        return arrays
+
+
+class StarWriter(object):
+    """ Write blocks to a STAR file. The rows of a block can be written
+    in several calls to writeRows or writeArrays after beginBlock,
+    so they do not need to be in memory at the same time.
+    """
+    FLOAT_FORMAT = '%0.6f'
+
+    def __init__(self, filename, mode='w'):
+        self._file = open(filename, mode)
+        self._columns = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def beginBlock(self, blockName, columns):
+        """ Write the header of a block with the given labels. """
+        self._columns = list(columns)
+        self._format = None
+        self._file.write('\ndata_%s\n\nloop_\n' % blockName)
+        for i, label in enumerate(self._columns):
+            self._file.write('_%s #%d\n' % (label, i + 1))
+
+    def _getFormat(self, values, isArray=False):
+        """ Return the format of a line based on the type of the values
+        (the first row or the arrays of each column) and the indexes
+        of the string values, that should be quoted.
+        """
+        formats = []
+        strIndexes = []
+        for i, v in enumerate(values):
+            kind = v.dtype.kind if isArray else numpy.asarray(v).dtype.kind
+            if kind in 'biu':
+                formats.append('%d')
+            elif kind == 'f':
+                formats.append(self.FLOAT_FORMAT)
+            else:
+                formats.append('%s')
+                strIndexes.append(i)
+        return ' '.join(formats) + '\n', strIndexes
+
+    def writeRows(self, rows):
+        """ Write rows (tuples of values in the order of
+        the block columns) to the current block.
+        """
+        for row in rows:
+            if self._format is None:
+                self._format = self._getFormat(row)
+            fmt, strIndexes = self._format
+            if strIndexes:
+                row = list(row)
+                for i in strIndexes:
+                    row[i] = _quoteValue(row[i])
+            self._file.write(fmt % tuple(row))
+
+    def writeArrays(self, arrays):
+        """ Write to the current block the rows from a dict
+        with an array of values for each column.
+        """
+        columns = [numpy.asarray(arrays[label]) for label in self._columns]
+        fmt, strIndexes = self._getFormat(columns, isArray=True)
+        # Formatting python values is much faster than numpy scalars
+        columns = [c.tolist() for c in columns]
+        for i in strIndexes:
+            columns[i] = [_quoteValue(v) for v in columns[i]]
+        self._file.writelines(fmt % row for row in izip(*columns))
+
+    def writeBlock(self, blockName, arrays):
+        """ Write a whole block from a dict with the array
+        of values of each column.
+        """
+        self.beginBlock(blockName, arrays.keys())
+        self.writeArrays(arrays)
+
+    def close(self):
+        self._file.close()
@@ -1160,6 +1160,118 @@ def euler_from_matrix(matrix, axes='sxyz'):
     return ax, ay, az
 
 
+def euler_matrices(angles, axes='sxyz'):
+    """Return array of homogeneous rotation matrices from Euler angles.
+
+    Batch version of euler_matrix for many triplets of angles.
+
+    angles : array of shape (N, 3) with the ai, aj, ak angles of each matrix
+    axes : One of 24 axis sequences as string or encoded tuple
+
+    >>> angles = (4*math.pi) * (numpy.random.random((10, 3)) - 0.5)
+    >>> R = euler_matrices(angles, 'szyz')
+    >>> R.shape
+    (10, 4, 4)
+    >>> numpy.allclose(R[3], euler_matrix(axes='szyz', *angles[3]))
+    True
+
+    """
+    try:
+        firstaxis, parity, repetition, frame = _AXES2TUPLE[axes]
+    except (AttributeError, KeyError):
+        _TUPLE2AXES[axes]  # validation
+        firstaxis, parity, repetition, frame = axes
+
+    i = firstaxis
+    j = _NEXT_AXIS[i+parity]
+    k = _NEXT_AXIS[i-parity+1]
+
+    angles = numpy.array(angles, dtype=numpy.float64, ndmin=2)
+    ai, aj, ak = angles[:, 0], angles[:, 1], angles[:, 2]
+
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        ai, aj, ak = -ai, -aj, -ak
+
+    si, sj, sk = numpy.sin(ai), numpy.sin(aj), numpy.sin(ak)
+    ci, cj, ck = numpy.cos(ai), numpy.cos(aj), numpy.cos(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M = numpy.zeros((len(angles), 4, 4))
+    M[:, 3, 3] = 1.0
+    if repetition:
+        M[:, i, i] = cj
+        M[:, i, j] = sj*si
+        M[:, i, k] = sj*ci
+        M[:, j, i] = sj*sk
+        M[:, j, j] = -cj*ss+cc
+        M[:, j, k] = -cj*cs-sc
+        M[:, k, i] = -sj*ck
+        M[:, k, j] = cj*sc+cs
+        M[:, k, k] = cj*cc-ss
+    else:
+        M[:, i, i] = cj*ck
+        M[:, i, j] = sj*sc-cs
+        M[:, i, k] = sj*cc+ss
+        M[:, j, i] = cj*sk
+        M[:, j, j] = sj*ss+cc
+        M[:, j, k] = sj*cs-sc
+        M[:, k, i] = -sj
+        M[:, k, j] = cj*si
+        M[:, k, k] = cj*ci
+    return M
+
+
+def euler_from_matrices(matrices, axes='sxyz'):
+    """Return array of Euler angles from rotation matrices.
+
+    Batch version of euler_from_matrix for an array of shape (N, 4, 4)
+    or (N, 3, 3). Return an array of shape (N, 3).
+
+    >>> angles = (4*math.pi) * (numpy.random.random((10, 3)) - 0.5)
+    >>> R0 = euler_matrices(angles, 'szyz')
+    >>> A = euler_from_matrices(R0, 'szyz')
+    >>> numpy.allclose(A[3], euler_from_matrix(R0[3], 'szyz'))
+    True
+    >>> numpy.allclose(R0, euler_matrices(A, 'szyz'))
+    True
+
+    """
+    try:
+        firstaxis, parity, repetition, frame = _AXES2TUPLE[axes.lower()]
+    except (AttributeError, KeyError):
+        _TUPLE2AXES[axes]  # validation
+        firstaxis, parity, repetition, frame = axes
+
+    i = firstaxis
+    j = _NEXT_AXIS[i+parity]
+    k = _NEXT_AXIS[i-parity+1]
+
+    M = numpy.array(matrices, dtype=numpy.float64, copy=False)[:, :3, :3]
+    if repetition:
+        sy = numpy.sqrt(M[:, i, j]*M[:, i, j] + M[:, i, k]*M[:, i, k])
+        ok = sy > _EPS
+        ax = numpy.where(ok, numpy.arctan2( M[:, i, j],  M[:, i, k]),
+                             numpy.arctan2(-M[:, j, k],  M[:, j, j]))
+        ay = numpy.arctan2( sy,       M[:, i, i])
+        az = numpy.where(ok, numpy.arctan2( M[:, j, i], -M[:, k, i]), 0.0)
+    else:
+        cy = numpy.sqrt(M[:, i, i]*M[:, i, i] + M[:, j, i]*M[:, j, i])
+        ok = cy > _EPS
+        ax = numpy.where(ok, numpy.arctan2( M[:, k, j],  M[:, k, k]),
+                             numpy.arctan2(-M[:, j, k],  M[:, j, j]))
+        ay = numpy.arctan2(-M[:, k, i],  cy)
+        az = numpy.where(ok, numpy.arctan2( M[:, j, i],  M[:, i, i]), 0.0)
+
+    if parity:
+        ax, ay, az = -ax, -ay, -az
+    if frame:
+        ax, az = az, ax
+    return numpy.column_stack((ax, ay, az))
+
+
 def euler_from_quaternion(quaternion, axes='sxyz'):
     """Return Euler angles from quaternion for specified axis sequence.
 
@@ -41,14 +41,16 @@ import socket
 from pyworkflow.viewer import View, Viewer, CommandView, DESKTOP_TKINTER
 from pyworkflow.utils import Environ, runJob
 from pyworkflow.utils import getFreePort
-from pyworkflow.gui.matplotlib_image import ImageWindow
+from pyworkflow.utils.reflection import LazyModule
 
 # From pyworkflow.em level
 import showj
-import metadata as md
-import xmipp
 from data import PdbFile
 
+# Loaded on first use, since they are not needed to run protocols
+md = LazyModule('pyworkflow.em.metadata')
+xmipp = LazyModule('xmipp')
+
 
 #------------------------ Some common Views ------------------
 
@@ -579,6 +581,7 @@ class ChimeraProjectionClient(ChimeraAngDistClient):
         self.fourierprojector = xmipp.FourierProjector(self.image, paddingFactor, maxFreq, splineDegree)
         self.fourierprojector.projectVolume(self.projection, 0, 0, 0)
         self.showjPort = self.kwargs.get('showjPort', None)
+        from pyworkflow.gui.matplotlib_image import ImageWindow
         self.iw = ImageWindow(filename=os.path.basename(volfile),image=self.projection, dim=self.size, label="Projection")
         self.iw.updateData(flipud(self.projection.getData()))
         if self.showjPort:
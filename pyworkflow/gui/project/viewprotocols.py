@@ -41,6 +41,7 @@ import pyworkflow.gui as pwgui
 import pyworkflow.em as em
 
 from pyworkflow.viewer import DESKTOP_TKINTER, ProtocolViewer
+from pyworkflow.protocol.profiling import formatStepsProfile
 from pyworkflow.utils.properties import Message, Icon, Color
 
 
@@ -625,12 +626,23 @@ class ProtocolsView(tk.Frame):
         self.outputViewer.grid(row=0, column=0, sticky='news')
         self.outputViewer.windows = self.windows
         
+        # Profile of the steps
+        pframe = tk.Frame(tab)
+        pwgui.configureWeigths(pframe)
+        self.profileText = pwgui.text.Text(pframe, width=40, height=15, bg='white')
+        self.profileText.configure(font='TkFixedFont', wrap=tk.NONE)
+        self.profileText.grid(row=0, column=0, sticky='news')
+        # The steps are only loaded when the profile tab is shown
+        self.infoTabs, self.profileFrame = tab, pframe
+        tab.bind('<<NotebookTabChanged>>', self._infoTabChanged)
+        
         self._updateSelection()
         
         # Add all tabs
         tab.add(dframe, text=Message.LABEL_SUMMARY)   
         tab.add(mframe, text=Message.LABEL_METHODS)
         tab.add(ologframe, text=Message.LABEL_LOGS_OUTPUT)
+        tab.add(pframe, text=Message.LABEL_PROFILE)
 #         tab.add(elogframe, text=Message.LABEL_LOGS_ERROR)
 #         tab.add(slogframe, text=Message.LABEL_LOGS_SCIPION)
         tab.grid(row=1, column=0, sticky='news')
@@ -950,6 +962,8 @@ class ProtocolsView(tk.Frame):
         self._fillSummary()
         self._fillMethod()
         self._fillLogs()
+        if self._isProfileShown():
+            self._fillProfile()
 
         last = self.getSelectedProtocol()
         self._lastSelectedProtId = last.getObjId() if last else None
@@ -1147,6 +1161,24 @@ class ProtocolsView(tk.Frame):
         
         self.methodText.setReadOnly(True)
         
+    def _isProfileShown(self):
+        return self.infoTabs.select() == str(self.profileFrame)
+        
+    def _infoTabChanged(self, e=None):
+        if self._isProfileShown():
+            self._fillProfile()
+        
+    def _fillProfile(self):
+        """ Show the resources used by the steps of the selected run. """
+        self.profileText.setReadOnly(False)
+        self.profileText.clear()
+        prot = self.getSelectedProtocol()
+        
+        if len(self._selection) == 1 and prot:
+            self.profileText.addText(formatStepsProfile(prot.loadSteps()))
+            
+        self.profileText.setReadOnly(True)
+        
     def _fillLogs(self):
         prot = self.getSelectedProtocol()
 
@@ -66,6 +66,11 @@ class HostConfig():
         self.scipionHome = String()
         self.scipionConfig = String()
         self.address = String()
+        # Maximum number of cores and memory (in MB) that can be used
+        # by the parallel steps of a protocol (if not set, there is
+        # no limit other than the number of threads of the protocol)
+        self.maxCores = Integer()
+        self.maxMemory = Integer()
         self.queueSystem = QueueSystemConfig()
     
     def getLabel(self):
@@ -92,6 +97,15 @@ class HostConfig():
     def getCancelCommand(self):
         return self.queueSystem.cancelCommand.get()
     
+    def getSubmitArrayCommand(self):
+        return self.queueSystem.getSubmitArrayCommand()
+    
+    def getSubmitDependentCommand(self):
+        return self.queueSystem.getSubmitDependentCommand()
+    
+    def getArrayTaskId(self):
+        return self.queueSystem.getArrayTaskId()
+    
     def isQueueMandatory(self):
         return self.queueSystem.mandatory.get()
     
@@ -151,6 +165,12 @@ class HostConfig():
     
     def setAddress(self, newAddress):
         return self.address.set(newAddress)
+    
+    def getMaxCores(self):
+        return self.maxCores.get()
+    
+    def getMaxMemory(self):
+        return self.maxMemory.get()
 
 
 class QueueSystemConfig(OrderedObject):
@@ -170,6 +190,12 @@ class QueueSystemConfig(OrderedObject):
         self.checkCommand = String()
         self.cancelCommand = String()
         self.submitTemplate = String()
+        # Commands to submit an array job and a job that should
+        # run after other, and the variable with the array task id
+        # in the job script (see launch._submitArray)
+        self.submitArrayCommand = String()
+        self.submitDependentCommand = String()
+        self.arrayTaskId = String()
         
     def hasName(self):
         return self.name.hasValue()
@@ -195,6 +221,21 @@ class QueueSystemConfig(OrderedObject):
     def getCancelCommand(self):
         return self.cancelCommand.get()
     
+    def getSubmitArrayCommand(self):
+        return self.submitArrayCommand.get()
+    
+    def getSubmitDependentCommand(self):
+        return self.submitDependentCommand.get()
+    
+    def getArrayTaskId(self):
+        return self.arrayTaskId.get()
+    
+    def hasArrayJobs(self):
+        """ Return True if array jobs can be submitted. """
+        return (self.submitArrayCommand.hasValue() and
+                self.submitDependentCommand.hasValue() and
+                self.arrayTaskId.hasValue())
+    
     def getQueues(self):
         return self.queues
     
@@ -79,7 +79,31 @@ class Mapper():
     def insert(self, obj):
         """Insert a new object into the system, the id will be set"""
         pass
-    
+
+    def beginBulkInsert(self, bufferSize=None):
+        """ Prepare the mapper to insert many objects.
+        Subclasses can buffer the inserts until endBulkInsert is called.
+        """
+        pass
+
+    def endBulkInsert(self):
+        """ Write any buffered object and leave the bulk insert mode. """
+        pass
+
+    def ensureIndex(self, *labels):
+        """ Create indexes to speed up the queries on these labels.
+        Only meaningful for mappers that store the items of a Set.
+        """
+        pass
+
+    def ensureDefaultIndexes(self):
+        """ Create the indexes on the commonly queried labels. """
+        pass
+
+    def getIndexes(self):
+        """ Return the labels that have an index. """
+        return []
+
     def update(self, obj, direction='to'):
         """Update an existing object, the id should not be None
         direction can be "to" or "from" which indicates the 
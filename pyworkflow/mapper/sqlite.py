@@ -25,20 +25,24 @@
 # **************************************************************************
 
 
+from itertools import izip
+from operator import attrgetter, methodcaller
+
 from pyworkflow.utils.path import replaceExt, joinExt
 from mapper import Mapper
 from sqlite_db import SqliteDb
+from sqlite_query import compileWhere, compileOrderBy, compileLimit
 
 
 
 class SqliteMapper(Mapper):
     """Specific Mapper implementation using Sqlite database"""
-    def __init__(self, dbName, dictClasses=None):
+    def __init__(self, dbName, dictClasses=None, readOnly=False):
         Mapper.__init__(self, dictClasses)
         self.__initObjDict()
         self.__initUpdateDict()
         try:
-            self.db = SqliteObjectsDb(dbName)
+            self.db = SqliteObjectsDb(dbName, readOnly=readOnly)
         except Exception, ex:
             raise Exception('Error creating SqliteMapper, dbName: %s\n error: %s' % (dbName, ex))
     
@@ -359,7 +363,7 @@ class SqliteObjectsDb(SqliteDb):
     # Maintain the current version of the DB schema
     # useful for future updates and backward compatibility
     # version should be an integer number
-    VERSION = 1
+    VERSION = 2
     
     SELECT = "SELECT id, parent_id, name, classname, value, label, comment, datetime(creation, 'localtime') as creation FROM Objects WHERE "
     DELETE = "DELETE FROM Objects WHERE "
@@ -372,13 +376,16 @@ class SqliteObjectsDb(SqliteDb):
     def selectCmd(self, whereStr, orderByStr=' ORDER BY id'):
         return self.SELECT + whereStr + orderByStr
     
-    def __init__(self, dbName, timeout=1000):
+    def __init__(self, dbName, timeout=1000, readOnly=False):
         SqliteDb.__init__(self)
-        self._createConnection(dbName, timeout)
+        self._createConnection(dbName, timeout, readOnly)
         self._initialize()
 
     def _initialize(self):
         """ Create the required tables if needed. """
+        # Read only connections can not create or update the tables
+        if self.isReadOnly():
+            return
         tables = self.getTables()
         # Check if the tables have been created or not
         if not tables:
@@ -417,13 +424,26 @@ class SqliteObjectsDb(SqliteDb):
                       object_parent_extended TEXT DEFAULT NULL, -- extended property to consider internal objects
                       object_child_extended TEXT DEFAULT NULL
                       )""")
+        self.__createIndexes()
         self.commit()
         
+    def __createIndexes(self):
+        """ Create the indexes on Objects table to select objects
+        by parent and all the childs of an object (by name range,
+        see selectObjectsByAncestor).
+        """
+        self.executeCommand("CREATE INDEX IF NOT EXISTS "
+                            "idx_objects_parent_id ON Objects(parent_id)")
+        self.executeCommand("CREATE INDEX IF NOT EXISTS "
+                            "idx_objects_name ON Objects(name)")
+        
     def __updateTables(self):
         """ This method is intended to update the table schema
         in the case of dealing with old database version.
         """
-        if self.getVersion() < self.VERSION: # This applies for version 1
+        version = self.getVersion()
+        
+        if version < 1:
             # Add the extra column for pointer extended attribute in Relations table
             # from version 1 on, there is not needed since the table will 
             # already contains this column
@@ -434,7 +454,14 @@ class SqliteObjectsDb(SqliteDb):
             if not 'object_child_extended' in columns:    
                 self.executeCommand("ALTER TABLE Relations "
                                     "ADD COLUMN object_child_extended  TEXT DEFAULT NULL")
+        if version < 2:
+            # From version 2, the childs of an object are selected
+            # by an indexed range on the name instead of a LIKE scan
+            self.__createIndexes()
+            
+        if version < self.VERSION:
             self.setVersion(self.VERSION)
+            self.commit()
         
         
     def insertObject(self, name, classname, value, parent_id, label, comment):
@@ -479,9 +506,18 @@ class SqliteObjectsDb(SqliteDb):
             self.executeCommand(self.selectCmd("parent_id=?"), (parent_id,))
         return self._results(iterate)  
     
+    def _getAncestorRange(self, ancestor_namePrefix):
+        """ The names of all objects in the hierarchy of an ancestor
+        start with 'prefix.', so they are in the range ['prefix.', 'prefix/')
+        ('/' is the character after '.'), which can be searched with
+        the name index (a LIKE can not).
+        """
+        return (ancestor_namePrefix + '.', ancestor_namePrefix + '/')
+    
     def selectObjectsByAncestor(self, ancestor_namePrefix, iterate=False):
         """Select all objects in the hierarchy of ancestor_id"""
-        self.executeCommand(self.selectCmd("name LIKE '%s.%%'" % ancestor_namePrefix))
+        self.executeCommand(self.selectCmd("name >= ? AND name < ?"),
+                            self._getAncestorRange(ancestor_namePrefix))
         return self._results(iterate)          
     
     def selectObjectsBy(self, iterate=False, **args):     
@@ -504,7 +540,8 @@ class SqliteObjectsDb(SqliteDb):
     def deleteChildObjects(self, ancestor_namePrefix):
         """ Delete from db all objects that are childs 
         of an ancestor, now them will have the same starting prefix"""
-        self.executeCommand(self.DELETE + "name LIKE '%s.%%'" % ancestor_namePrefix)
+        self.executeCommand(self.DELETE + "name >= ? AND name < ?",
+                            self._getAncestorRange(ancestor_namePrefix))
         
     def deleteAll(self):
         """ Delete all objects from the db. """
@@ -535,11 +572,18 @@ class SqliteObjectsDb(SqliteDb):
 
 class SqliteFlatMapper(Mapper):
     """Specific Flat Mapper implementation using Sqlite database"""
-    def __init__(self, dbName, dictClasses=None, tablePrefix=''):
+    # Default number of rows kept in memory before writing
+    # them to the database when using bulk inserts
+    INSERT_BUFFER_SIZE = 10000
+
+    def __init__(self, dbName, dictClasses=None, tablePrefix='', readOnly=False):
         Mapper.__init__(self, dictClasses)
         self._objTemplate = None
+        # Rows waiting to be written when in bulk insert mode
+        self._insertBuffer = None
+        self._insertBufferSize = self.INSERT_BUFFER_SIZE
         try:
-            self.db = SqliteFlatDb(dbName, tablePrefix)
+            self.db = SqliteFlatDb(dbName, tablePrefix, readOnly=readOnly)
             self.doCreateTables = self.db.missingTables()
             
             if not self.doCreateTables:
@@ -548,18 +592,58 @@ class SqliteFlatMapper(Mapper):
             raise Exception('Error creating SqliteFlatMapper, dbName: %s, tablePrefix: %s\n error: %s' % (dbName, tablePrefix, ex))
     
     def commit(self):
+        self.flush()
         self.db.commit()
         
     def close(self):
+        self.flush()
         self.db.close()
         
     def insert(self, obj):
+        """Insert a new object into the system, the id will be set"""
         if self.doCreateTables:
-            self.db.createTables(obj.getObjDict(includeClass=True))
+            self.__setupCommands(obj, create=True)
             self.doCreateTables = False
-        """Insert a new object into the system, the id will be set"""
-        self.db.insertObject(obj.getObjId(), obj.isEnabled(), obj.getObjLabel(), obj.getObjComment(), 
-                             *obj.getObjDict().values())
+        args = (obj.getObjId(), obj.isEnabled(), obj.getObjLabel(),
+                obj.getObjComment()) + self.__getColumnValues(obj)
+        
+        if self._insertBuffer is None:
+            self.db.insertObject(*args)
+        else:
+            self._insertBuffer.append(args)
+            if len(self._insertBuffer) >= self._insertBufferSize:
+                self.flush()
+                
+    def beginBulkInsert(self, bufferSize=None):
+        """ Start buffering the inserted rows, that will be
+        written in chunks of bufferSize rows with a single
+        executemany and a bigger cache.
+        endBulkInsert should be called after the last insert.
+        """
+        if self._insertBuffer is not None: # Already in bulk mode
+            return
+        self._insertBuffer = []
+        self._insertBufferSize = bufferSize or self.INSERT_BUFFER_SIZE
+        self.db.enableBulkMode()
+        
+    def endBulkInsert(self):
+        """ Write any pending rows, commit and restore the
+        normal (one insert per object) mode.
+        """
+        if self._insertBuffer is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._insertBuffer = None
+            self.db.disableBulkMode()
+        self.updateStatistics()
+        
+    def flush(self):
+        """ Write to the database the rows in the insert buffer. """
+        if self._insertBuffer:
+            self.db.insertObjects(self._insertBuffer)
+            self._insertBuffer = []
         
     def enableAppend(self):
         """ This will allow to append items to existing db. 
@@ -569,30 +653,54 @@ class SqliteFlatMapper(Mapper):
         if not self.doCreateTables:
             obj = self.selectFirst()
             if obj is not None:
-                self.db.setupCommands(obj.getObjDict(includeClass=True))
+                self.__setupCommands(obj)
         
     def clear(self):
+        if self._insertBuffer:
+            self._insertBuffer = []
         self.db.clear()
         self.doCreateTables = True
     
     def deleteAll(self):
         """ Delete all objects stored """
+        self.flush()
         self.db.deleteAll()
                 
     def delete(self, obj):
         """Delete an object and all its childs"""
+        self.flush()
         self.db.deleteObject(obj.getObjId())
     
     def updateTo(self, obj, level=1):
         """ Update database entry with new object values. """ 
+        self.flush()
         if self.db.INSERT_OBJECT is None:
-            self.db.setupCommands(obj.getObjDict(includeClass=True))
-        args = list(obj.getObjDict().values())
-        args.append(obj.getObjId())
+            self.__setupCommands(obj)
+        args = self.__getColumnValues(obj) + (obj.getObjId(),)
         self.db.updateObject(obj.isEnabled(), obj.getObjLabel(), obj.getObjComment(), *args)
+        
+    def __setupCommands(self, obj, create=False):
+        """ Prepare the INSERT and UPDATE commands (creating the tables
+        if create=True) from the object dictionary, and compile the
+        function used to retrieve the column values of objects.
+        """
+        objDict = obj.getObjDict(includeClass=True)
+        if create:
+            self.db.createTables(objDict)
+        else:
+            self.db.setupCommands(objDict)
+        self._columnsGetter = _attrsGetter([k for k in objDict if k != SELF])
+        
+    def __getColumnValues(self, obj):
+        """ Return a tuple with the values to be stored in the columns.
+        The attributes are resolved with the getter compiled for
+        this set schema, avoiding to build the object dictionary.
+        """
+        return tuple(map(_getObjValue, self._columnsGetter(obj)))
             
     def selectById(self, objId):
         """Build the object which id is objId"""
+        self.flush()
         objRow = self.db.selectObjectById(objId)
         if objRow is None:
             obj = None
@@ -635,6 +743,11 @@ class SqliteFlatMapper(Mapper):
         basicRows = 5
         n = len(rows) + basicRows - 1
         self._objColumns = zip(range(basicRows, n), columnList)
+        # Compile the reading of the rows: all nested attributes of
+        # the template are retrieved at once (in column order) and
+        # the values are set from the row starting at basicRows
+        self._objColumnsGetter = _attrsGetter(columnList)
+        self._objFirstColumn = basicRows
          
     def __buildAndFillObj(self):
         obj = self._buildObject(self._objClassName)
@@ -654,21 +767,18 @@ class SqliteFlatMapper(Mapper):
             self.__loadObjDict()
             
         obj = self._objTemplate #self.__buildAndFillObj()
-        obj.setObjId(objRow['id'])
-        obj.setObjLabel(self._getStrValue(objRow['label']))
-        obj.setObjComment(self._getStrValue(objRow['comment']))
-        
-        try:
-            obj.setEnabled(objRow['enabled'])
-            obj.setObjCreation(self._getStrValue(objRow['creation']))
-        except Exception:
-            # THIS SHOULD NOT HAPPENS
-            print "WARNING: 'creation' column not found in object: %s" % obj.getObjId()
-            print "         db: %s" % self.db.getDbName()
-            print "         objRow: ", dict(objRow)
+        # Basic columns are: id, enabled, label, comment, creation
+        obj.setObjId(objRow[0])
+        obj.setEnabled(objRow[1])
+        obj.setObjLabel(self._getStrValue(objRow[2]))
+        obj.setObjComment(self._getStrValue(objRow[3]))
+        obj.setObjCreation(self._getStrValue(objRow[4]))
         
-        for c, attrName in self._objColumns:
-            obj.setAttributeValue(attrName, objRow[c])
+        # The attributes are retrieved from the template for every row,
+        # since they could have been replaced while iterating
+        values = tuple(objRow)[self._objFirstColumn:]
+        for attr, value in izip(self._objColumnsGetter(obj), values):
+            attr.set(value)
 
         return obj
         
@@ -692,6 +802,7 @@ class SqliteFlatMapper(Mapper):
          
     def selectBy(self, iterate=False, objectFilter=None, **args):
         """Select object meetings some criteria"""
+        self.flush()
         objRows = self.db.selectObjectsBy(**args)
         return self.__objectsFromRows(objRows, iterate, objectFilter)
     
@@ -699,20 +810,166 @@ class SqliteFlatMapper(Mapper):
                       , objectFilter=None
                       , orderBy='id'
                       , direction='ASC'
-                      , where='1'):
-        # Just a sanity check for emtpy sets, that doesn't contains 'Properties' table
-        if not self.db.hasTable('Properties'):
+                      , where='1'
+                      , limit=None
+                      , offset=None):
+        # Just a sanity check for emtpy sets, that doesn't contains the items tables
+        if self.db.missingTables():
             return iter([]) if iterate else []
             
         if self._objTemplate is None:
             self.__loadObjDict()
+        self.flush()
         objRows = self.db.selectAll(orderBy=orderBy,
                                     direction=direction,
-                                    where=where)
+                                    where=where,
+                                    limit=limit,
+                                    offset=offset)
         
         return self.__objectsFromRows(objRows, iterate, objectFilter) 
 
+    def getColumns(self, labels, orderBy='id', direction='ASC', where='1',
+                   limit=None, offset=None):
+        """ Return the values of the given attribute labels as a
+        numpy structured array (see SqliteFlatDb.selectColumns).
+        """
+        if self.doCreateTables or not self.db.hasTable('Properties'):
+            import numpy as np
+            return np.empty(0, dtype=[(str(l), object) for l in labels])
+        
+        self.flush()
+        return self.db.selectColumns(labels, orderBy=orderBy,
+                                     direction=direction, where=where,
+                                     limit=limit, offset=offset)
+
+    def insertFromSet(self, template, dbName, prefix='', where='1',
+                      renumber=False, uniqueBy=None,
+                      filterDbName=None, filterPrefix='', filterBy='id',
+                      exclude=False):
+        """ Insert the items of other set with a single INSERT ... SELECT,
+        attaching its database to the current connection. The items are
+        copied as they are stored, without building any object.
+        Params:
+            template: an item of the other set, used to create the
+                tables if this set is still empty.
+            dbName, prefix: the database and the tables prefix of the other
+                set (e.g. Class001, the _ is added as in SqliteFlatDb).
+            where: expression on the attribute labels of the other set
+                items to filter them (see sqlite_query).
+            renumber: if True, the inserted items will get new ids.
+            uniqueBy: 'id' or an attribute label, only the first item with
+                a value will be inserted (skipping also the values already
+                present in this set).
+            filterDbName, filterPrefix: a third set used to select the
+                items whose value of filterBy is in (or not in, if exclude
+                is True) the filterBy values of that set.
+        Return the number of inserted items.
+        """
+        prefix = getTablePrefix(prefix)
+        filterPrefix = getTablePrefix(filterPrefix)
+        if self.doCreateTables:
+            self.__setupCommands(template, create=True)
+            self.doCreateTables = False
+        self.flush()
+        db = self.db
+        db.attach(dbName, 'inputDb')
+        if filterDbName is not None:
+            db.attach(filterDbName, 'filterDb')
+
+        try:
+            source = db.getAttachedColumnsMapping('inputDb', prefix)
+
+            def _getSourceCol(label):
+                if label not in source:
+                    raise Exception("Unknown attribute label '%s' for db: %s"
+                                    % (label, dbName))
+                return 'src.%s' % source[label]
+
+            whereStr, params = compileWhere(where, _getSourceCol)
+            conditions = [whereStr]
+
+            if filterDbName is not None:
+                filterCol = db.getAttachedColumnsMapping('filterDb', filterPrefix)[filterBy]
+                conditions.append('%s %sIN (SELECT %s FROM filterDb.%sObjects '
+                                  'WHERE %s IS NOT NULL)'
+                                  % (_getSourceCol(filterBy), 'NOT ' if exclude else '',
+                                     filterCol, filterPrefix, filterCol))
+
+            orIgnore = False
+            if uniqueBy == 'id' and not renumber:
+                orIgnore = True
+            elif uniqueBy is not None:
+                uniqueCol = _getSourceCol(uniqueBy)
+                conditions.append('src.id IN (SELECT MIN(id) FROM inputDb.%sObjects '
+                                  'GROUP BY %s)' % (prefix, source[uniqueBy]))
+                if uniqueBy != 'id':
+                    targetCol = db._getRealCol(uniqueBy)
+                    conditions.append('%s NOT IN (SELECT %s FROM main.%sObjects '
+                                      'WHERE %s IS NOT NULL)'
+                                      % (uniqueCol, targetCol, db.tablePrefix, targetCol))
+
+            count = db.insertFromAttached('inputDb', prefix,
+                                          ' AND '.join('(%s)' % c for c in conditions),
+                                          params, renumber=renumber, orIgnore=orIgnore)
+        finally:
+            db.detach('inputDb')
+            if filterDbName is not None:
+                db.detach('filterDb')
+
+        return count
+
+    def maxId(self):
+        if self.doCreateTables:
+            return 0
+        self.flush()
+        return self.db.maxId()
+
+    def getColumnClasses(self):
+        """ Return a dictionary with the class name of the column
+        of each attribute label, or None if the tables were not created.
+        """
+        if self.doCreateTables or self.db.missingTables():
+            return None
+        return self.db.loadColumnsMapping()
+
+    def ensureIndex(self, *labels):
+        """ Create the indexes (if not existing) on the columns of
+        the given labels and update the db statistics.
+        """
+        if self.doCreateTables or not self.db.hasTable('Properties'):
+            return
+        self.flush()
+        self.db.loadColumnsMapping()
+        created = [label for label in labels if self.db.createIndex(label)]
+        if created or self.db.needsAnalyze():
+            self.db.analyze()
+            self.db.commit()
+
+    def updateStatistics(self):
+        """ Update the db statistics if the rows have grown
+        substantially since the last time (see SqliteFlatDb.needsAnalyze).
+        """
+        if self.doCreateTables or not self.db.hasTable('Properties'):
+            return
+        if self.db.needsAnalyze():
+            self.db.analyze()
+
+    def ensureDefaultIndexes(self):
+        """ Index the columns used to filter, group or sort
+        very often (see SqliteFlatDb.INDEX_LABELS), if present.
+        """
+        if self.doCreateTables or not self.db.hasTable('Properties'):
+            return
+        classes = self.db.loadColumnsMapping()
+        self.ensureIndex(*[label for label in self.db.INDEX_LABELS
+                           if label in classes])
+
+    def getIndexes(self):
+        """ Return the labels that have been indexed. """
+        return self.db.getIndexes()
+
     def aggregate(self, operations, operationLabel, groupByLabels=None):
+        self.flush()
         rows = self.db.aggregate(operations, operationLabel, groupByLabels)
         results = []
         for row in rows:
@@ -730,6 +987,7 @@ class SqliteFlatMapper(Mapper):
     def count(self):
         if self.doCreateTables:
             return 0
+        self.flush()
         return self.db.count()   
     
     def __objectsFromIds(self, objIds):
@@ -753,8 +1011,35 @@ class SqliteFlatMapper(Mapper):
         return self.db.getPropertyKeys()
         
 
+def _attrsGetter(labels):
+    """ Return a function that receives an object and returns a tuple
+    with its attributes named in labels (nested ones with dots,
+    e.g. '_ctfModel._defocusU'). The attributes lookup is done
+    in C by operator.attrgetter, so the labels are not parsed
+    again for each object.
+    """
+    if not labels:
+        return lambda obj: ()
+    getter = attrgetter(*labels)
+    if len(labels) == 1:
+        return lambda obj: (getter(obj),)
+    return getter
+
+_getObjValue = methodcaller('getObjValue')
+
+
 SELF = 'self'
 
+def getTablePrefix(prefix):
+    """ Return the prefix of the tables of a set (e.g. Class001_)
+    from the prefix stored in the set, without _ for an empty prefix.
+    """
+    prefix = (prefix or '').strip()
+    if prefix and not prefix.endswith('_'):
+        prefix += '_'
+    return prefix
+
+
 class SqliteFlatDb(SqliteDb):
     """Class to handle a Sqlite database.
     It will create connection, execute queries and commands"""
@@ -768,11 +1053,32 @@ class SqliteFlatDb(SqliteDb):
                  'Boolean': 'INTEGER'
                  }
 
-    def __init__(self, dbName, tablePrefix='', timeout=1000):
+    # Columns common to all items and the class used to store them
+    BASIC_COLUMNS = {'id': 'Integer',
+                     'enabled': 'Boolean',
+                     'label': 'String',
+                     'comment': 'String',
+                     'creation': 'String'
+                     }
+
+    # Columns that are commonly used to filter, group or sort the items
+    # (e.g. coordinates by micrograph), they will be indexed if present
+    INDEX_LABELS = ['_micId', '_classId', '_filename']
+
+    # The statistics of the indexed columns are updated (see analyze)
+    # when the rows grow by this factor since the last update
+    ANALYZE_GROWTH = 2
+
+    # PRAGMAs used while inserting many rows (see enableBulkMode).
+    # cache_size is negative to be expressed in KiB instead of pages.
+    # The journal and synchronous modes are not changed, the connection
+    # could be shared and the db would be corrupted if the process is
+    # killed (e.g. stopping a run) in the middle of the inserts.
+    BULK_PRAGMAS = [('cache_size', -65536)]
+
+    def __init__(self, dbName, tablePrefix='', timeout=1000, readOnly=False):
         SqliteDb.__init__(self)
-        tablePrefix = tablePrefix.strip()
-        if tablePrefix and not tablePrefix.endswith('_'): # Avoid having _ for empty prefix
-            tablePrefix += '_'
+        tablePrefix = getTablePrefix(tablePrefix)
         #NOTE (Jose Miguel, 2014/01/02
         # Reusing connections is a bit dangerous, since it have lead to
         # unexpected and hard to trace errors due to using an out-of-date
@@ -792,7 +1098,7 @@ class SqliteFlatDb(SqliteDb):
         self.INSERT_CLASS = "INSERT INTO %sClasses (label_property, column_name, class_name) VALUES (?, ?, ?)" % tablePrefix
         self.SELECT_CLASS = "SELECT * FROM %sClasses;" % tablePrefix
         self.tablePrefix = tablePrefix
-        self._createConnection(dbName, timeout)
+        self._createConnection(dbName, timeout, readOnly)
         self.INSERT_OBJECT = None
         self.UPDATE_OBJECT = None
         self._columnsMapping = {}
@@ -832,9 +1138,11 @@ class SqliteFlatDb(SqliteDb):
 
     def setProperty(self, key, value):
         """ Insert or update the property with a value. """
-        # Just ignore the set property for empty sets
+        # Empty sets do not have the tables created yet, but the
+        # properties are still needed (e.g. the stream state of a
+        # set that will be filled later)
         if not self.hasTable('Properties'):
-            return         
+            self._createPropertiesTable()
         if self.hasProperty(key):
             self.executeCommand(self.UPDATE_PROPERTY, (str(value), key))
         else:
@@ -864,17 +1172,20 @@ class SqliteFlatDb(SqliteDb):
         self.executeCommand("DROP TABLE IF EXISTS %sClasses;" % self.tablePrefix)
         self.executeCommand("DROP TABLE IF EXISTS %sObjects;" % self.tablePrefix)
 
+    def _createPropertiesTable(self):
+        """ Create a general Properties table to store some needed values. """
+        self.executeCommand("""CREATE TABLE IF NOT EXISTS Properties
+                     (key       TEXT UNIQUE, -- property key                 
+                      value     TEXT  DEFAULT NULL -- property value
+                      )""")
+
     def createTables(self, objDict):
         """Create the Classes and Object table to store items of a Set.
         Each object will be stored in a single row.
         Each nested property of the object will be stored as a column value.
         """
         self.setVersion(self.VERSION)
-        # Create a general Properties table to store some needed values
-        self.executeCommand("""CREATE TABLE IF NOT EXISTS Properties
-                     (key       TEXT UNIQUE, -- property key                 
-                      value     TEXT  DEFAULT NULL -- property value
-                      )""")
+        self._createPropertiesTable()
         # Create the Classes table to store each column name and type
         self.executeCommand("""CREATE TABLE IF NOT EXISTS %sClasses
                      (id        INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -946,6 +1257,145 @@ class SqliteFlatDb(SqliteDb):
         """
         self.executeCommand(self.INSERT_OBJECT, args)
 
+    def insertObjects(self, rows):
+        """ Insert many objects with a single executemany call.
+        rows: list of tuples with the same values that
+            insertObject receives for a single object.
+        """
+        self.cursor.executemany(self.INSERT_OBJECT, rows)
+
+    def enableBulkMode(self):
+        """ Tune the connection PRAGMAs for writing many rows.
+        The previous values are kept to be restored later by
+        disableBulkMode.
+        """
+        self._bulkPragmas = [(name, self.getPragma(name))
+                             for name, _ in self.BULK_PRAGMAS]
+        for name, value in self.BULK_PRAGMAS:
+            self.setPragma(name, value)
+
+    def disableBulkMode(self):
+        """ Commit pending changes and restore the PRAGMAs
+        that were modified by enableBulkMode.
+        """
+        self.commit()
+        for name, value in getattr(self, '_bulkPragmas', []):
+            self.setPragma(name, value)
+        self._bulkPragmas = []
+
+    def attach(self, dbName, alias):
+        """ Attach the database file dbName to the current connection,
+        its tables can be accessed then as alias.TableName.
+        """
+        self.commit()
+        self.executeCommand("ATTACH DATABASE ? AS %s" % alias, (dbName,))
+
+    def detach(self, alias):
+        self.commit()
+        self.executeCommand("DETACH DATABASE %s" % alias)
+
+    def getAttachedColumnsMapping(self, alias, tablePrefix=''):
+        """ Return the label to column mapping of the items stored
+        in the tables with the given prefix of an attached db.
+        """
+        self.executeCommand("SELECT label_property, column_name FROM %s.%sClasses"
+                            % (alias, tablePrefix))
+        mapping = dict((r[0], r[1]) for r in self.cursor.fetchall())
+        mapping.pop(SELF, None)
+        for column in self.BASIC_COLUMNS:
+            mapping[column] = column
+        return mapping
+
+    def insertFromAttached(self, alias, tablePrefix='', whereStr='1', params=(),
+                           renumber=False, orIgnore=False):
+        """ Copy into this table, with a single INSERT ... SELECT, the rows
+        of the Objects table of an attached db that satisfy whereStr
+        (where the table is referred as 'src').
+        The columns are matched by their attribute labels, so both
+        tables can have different columns layout.
+        Params:
+            renumber: if True, new ids will be assigned to the rows.
+            orIgnore: if True, rows with an id already existing are skipped.
+        Return the number of inserted rows.
+        """
+        source = self.getAttachedColumnsMapping(alias, tablePrefix)
+        if not self._columnsMapping:
+            self.loadColumnsMapping()
+        labels = [l for l in self._columnsMapping if l != SELF]
+        targetCols = ['id', 'enabled', 'label', 'comment', 'creation']
+        sourceCols = ['NULL' if renumber else 'src.id',
+                      'src.enabled', 'src.label', 'src.comment', 'src.creation']
+        for label in labels:
+            targetCols.append(self._columnsMapping[label])
+            sourceCols.append('src.%s' % source[label] if label in source else 'NULL')
+
+        self.executeCommand("INSERT %s INTO main.%sObjects (%s) "
+                            "SELECT %s FROM %s.%sObjects AS src WHERE %s ORDER BY src.id"
+                            % ('OR IGNORE' if orIgnore else '', self.tablePrefix,
+                               ', '.join(targetCols), ', '.join(sourceCols),
+                               alias, tablePrefix, whereStr), params)
+        return self.cursor.rowcount
+
+    def maxId(self):
+        """ Return the maximum id of the items (or 0 if there are none). """
+        self.executeCommand("SELECT MAX(id) %s" % self.FROM)
+        return self.cursor.fetchone()[0] or 0
+
+    def loadColumnsMapping(self):
+        """ Read the Classes table to map attribute labels to columns.
+        Return a dictionary with the class name of each label.
+        """
+        classes = {}
+        for r in self.getClassRows():
+            label = r['label_property']
+            self._columnsMapping[label] = r['column_name']
+            classes[label] = r['class_name']
+        return classes
+
+    def _getIndexesKey(self):
+        # Use a key that can not be confused with a Set attribute
+        return '%s@indexes' % self.tablePrefix
+
+    def getIndexes(self):
+        """ Return the list of labels that have an index,
+        as recorded in the Properties table.
+        """
+        value = self.getProperty(self._getIndexesKey(), '')
+        return [label for label in value.split(',') if label]
+
+    def createIndex(self, label):
+        """ Create an index on the column of the given label and record
+        it in the Properties table. Return False if it already existed.
+        """
+        indexes = self.getIndexes()
+        if label in indexes:
+            return False
+        column = self._getRealCol(label)
+        self.executeCommand("CREATE INDEX IF NOT EXISTS %sidx_%s ON %sObjects(%s)"
+                            % (self.tablePrefix, column, self.tablePrefix, column))
+        indexes.append(label)
+        self.setProperty(self._getIndexesKey(), ','.join(indexes))
+        return True
+
+    def _getAnalyzedKey(self):
+        return '%s@analyzed' % self.tablePrefix
+
+    def analyze(self):
+        """ Update the statistics used by the query planner and
+        record the number of rows when they were updated.
+        """
+        self.executeCommand("ANALYZE %sObjects" % self.tablePrefix)
+        self.setProperty(self._getAnalyzedKey(), self.count())
+
+    def needsAnalyze(self):
+        """ Return True if the db has indexes and its rows have grown
+        (by ANALYZE_GROWTH) since the statistics were updated.
+        """
+        if not self.getIndexes():
+            return False
+        analyzed = int(self.getProperty(self._getAnalyzedKey(), 0))
+        return self.count() > analyzed * self.ANALYZE_GROWTH
+
     def updateObject(self, *args):
         """Update object data """
         self.executeCommand(self.UPDATE_OBJECT, args)
@@ -955,44 +1405,101 @@ class SqliteFlatDb(SqliteDb):
         self.executeCommand(self.selectCmd("id=?"), (objId,))
         return self.cursor.fetchone()
 
-    def selectAll(self, iterate=True, orderBy='id', direction='ASC', where='1'):
-        # Handle the specials orderBy values of 'id' and 'RANDOM()'
-        # other columns names should be mapped to table column
-        # such as: _micId -> c04
-
-        def _getRealCol(colName):
-            """ Transform the column name taking into account
-             special columns such as: id or RANDOM(), and
-             getting the mapping translation otherwise.
-            """
-            if colName in ['id', 'RANDOM()']:
-                return colName
-            else:
-                return self._columnsMapping[colName]
+    def _getRealCol(self, colName):
+        """ Transform the column name taking into account
+         special columns such as: id or enabled, and
+         getting the mapping translation otherwise.
+        """
+        if colName in self.BASIC_COLUMNS:
+            return colName
+        if colName not in self._columnsMapping:
+            raise Exception("Unknown attribute label '%s' for db: %s"
+                            % (colName, self.getDbName()))
+        return self._columnsMapping[colName]
 
-        if isinstance(orderBy, basestring):
-            orderByCol = _getRealCol(orderBy)
-        elif isinstance(orderBy, list):
-            orderByCol = ','.join([_getRealCol(c) for c in orderBy])
-        else:
-            raise Exception('Invalid type for orderBy: %s' % type(orderBy))
-
-        # Parse the where string to replace the colunm name with
-        # the real table column name ( for example: _micId -> c01 )
-        # Right now we are asuming a simple where string in the form
-        # colName=VALUE
-        if '=' in where:
-            whereCol = where.split('=')[0]
-            whereRealCol = _getRealCol(whereCol)
-            whereStr = where.replace(whereCol, whereRealCol)
-        else:
-            whereStr = where
+    def _getQuery(self, where, orderBy, direction, limit=None, offset=None):
+        """ Compile the WHERE, ORDER BY and LIMIT clauses
+        (see module sqlite_query), mapping the attribute labels to
+        the table columns ( for example: _micId -> c01 ).
+        Returns the sql string after the FROM and the query params.
+        """
+        whereStr, params = compileWhere(where, self._getRealCol)
+        limitStr, limitParams = compileLimit(limit, offset)
+        orderByStr = compileOrderBy(orderBy, direction, self._getRealCol)
+        return 'WHERE %s%s%s' % (whereStr, orderByStr, limitStr), params + limitParams
 
-        cmd = self.selectCmd(whereStr,
-                             orderByStr=' ORDER BY %s %s' % (orderByCol, direction))
-        self.executeCommand(cmd)
+    def selectAll(self, iterate=True, orderBy='id', direction='ASC', where='1',
+                  limit=None, offset=None):
+        query, params = self._getQuery(where, orderBy, direction, limit, offset)
+        self.executeCommand('SELECT * %s %s' % (self.FROM, query), params)
         return self._results(iterate)
 
+    def selectColumns(self, labels, orderBy='id', direction='ASC', where='1',
+                      limit=None, offset=None, chunkSize=65536):
+        """ Return the values of the columns (given by the attribute
+        labels, e.g. '_ctfModel._defocusU') as a numpy structured array
+        with one field per label. The values are read from a single
+        SELECT, without building any object.
+        Integer and Boolean columns are returned as int64 and bool,
+        unless they contain NULL values (then float64 with nan is used),
+        Float columns as float64 and other columns as Python objects.
+        """
+        import numpy as np
+
+        classes = self.loadColumnsMapping()
+        columns = map(self._getRealCol, labels)
+
+        types = []
+        for label in labels:
+            className = self.BASIC_COLUMNS.get(label, classes.get(label))
+            if className == 'Float':
+                types.append(np.float64)
+            elif className == 'Integer':
+                types.append(np.int64)
+            elif className == 'Boolean':
+                types.append(np.bool_)
+            else:
+                types.append(object)
+
+        # Use a separated cursor returning tuples instead of Rows.
+        # The arrays are built from the fetched rows (not preallocated
+        # from a previous count) since other processes could be
+        # inserting rows at the same time (e.g. streaming).
+        # Each chunk of rows is converted to typed arrays at once,
+        # so the values are never kept as Python objects.
+        cursor = self.connection.cursor()
+        cursor.row_factory = None
+        query, params = self._getQuery(where, orderBy, direction, limit, offset)
+        cursor.execute('SELECT %s %s %s'
+                       % (', '.join(columns), self.FROM, query), params)
+        chunks = []
+        hasNulls = [False] * len(columns)
+        rows = cursor.fetchmany(chunkSize)
+        while rows:
+            chunk = []
+            for i, (t, chunkValues) in enumerate(izip(types, izip(*rows))):
+                # NULL values of integers and booleans are stored as nan
+                if t in (np.int64, np.bool_) and None in chunkValues:
+                    hasNulls[i] = True
+                    t = np.float64
+                chunk.append(np.array(chunkValues, dtype=t))
+            chunks.append(chunk)
+            rows = cursor.fetchmany(chunkSize)
+        cursor.close()
+
+        dtype = [(str(label), np.float64 if hasNull else t)
+                 for label, t, hasNull in izip(labels, types, hasNulls)]
+        result = np.empty(sum(len(c[0]) for c in chunks), dtype=dtype)
+        start = 0
+        while chunks:
+            chunk = chunks.pop(0)
+            end = start + len(chunk[0])
+            for (label, _), array in izip(dtype, chunk):
+                result[label][start:end] = array
+            start = end
+
+        return result
+
     def aggregate(self, operations, operationLabel, groupByLabels=None):
         #let us count for testing
         selectStr = 'SELECT '
@@ -40,16 +40,34 @@ class SqliteDb():
     
     def __init__(self):
         self._reuseConnections = False
+        self._readOnly = False
+        self._wal = False
         
-    def _createConnection(self, dbName, timeout):
-        """Establish db connection"""
+    def _createConnection(self, dbName, timeout, readOnly=False):
+        """Establish db connection
+        Params:
+            dbName: the path to the database file.
+            timeout: seconds to wait for a lock on the database
+                (held by other connection) before raising an error.
+            readOnly: if True, any attempt to modify the db will fail.
+                This kind of connections are meant for viewers or to
+                monitor dbs that are written by other processes.
+        If the environment variable SCIPION_SQLITE_WAL is on, the
+        database will be switched to the Write-Ahead Logging mode
+        (see enableWal).
+        """
         self._dbName = dbName
-        if self._reuseConnections and dbName in self.OPEN_CONNECTIONS:
+        self._readOnly = readOnly
+        # Read-only connections are never shared, the query_only
+        # mode would also apply to the writers using the connection
+        if (self._reuseConnections and not readOnly and
+            dbName in self.OPEN_CONNECTIONS):
             self.connection = self.OPEN_CONNECTIONS[dbName]
         else:
             self.connection = sqlite.Connection(dbName, timeout, check_same_thread=False)
             self.connection.row_factory = sqlite.Row
-            self.OPEN_CONNECTIONS[dbName] = self.connection
+            if not readOnly:
+                self.OPEN_CONNECTIONS[dbName] = self.connection
             
         self.cursor = self.connection.cursor()
         # Define some shortcuts functions
@@ -59,6 +77,12 @@ class SqliteDb():
             self.executeCommand = self.cursor.execute
         self.commit = self.connection.commit
         
+        if readOnly:
+            self.setPragma('query_only', 'ON')
+        elif envVarOn('SCIPION_SQLITE_WAL'):
+            self.enableWal()
+        self._wal = self.isWal()
+        
     @classmethod
     def closeConnection(cls, dbName):
         if dbName in cls.OPEN_CONNECTIONS:
@@ -70,8 +94,15 @@ class SqliteDb():
         return self._dbName
     
     def close(self):
+        if self._wal and not self._readOnly:
+            # Move the committed changes from the log to the db file,
+            # without waiting for readers that may be still using it
+            try:
+                self.checkpoint()
+            except sqlite.ProgrammingError:
+                pass # The (shared) connection was already closed
         self.connection.close()
-        if self._dbName in self.OPEN_CONNECTIONS:
+        if self.OPEN_CONNECTIONS.get(self._dbName) is self.connection:
             del self.OPEN_CONNECTIONS[self._dbName]
         
     def _debugExecute(self, *args):
@@ -125,4 +156,43 @@ class SqliteDb():
     def setVersion(self, version):
         self.executeCommand('PRAGMA user_version=%d' % version)
         self.commit()
-        
+
+    def getPragma(self, name):
+        """ Return the current value of the SQLite PRAGMA 'name'. """
+        self.executeCommand('PRAGMA %s' % name)
+        return self.cursor.fetchone()[0]
+
+    def setPragma(self, name, value):
+        """ Set a new value for the SQLite PRAGMA 'name'. """
+        self.executeCommand('PRAGMA %s=%s' % (name, value))
+
+    def isReadOnly(self):
+        return self._readOnly
+
+    def isWal(self):
+        """ Return True if the db is using the Write-Ahead Logging mode. """
+        return self.getPragma('journal_mode') == 'wal'
+
+    def enableWal(self):
+        """ Switch the db to the Write-Ahead Logging journal mode.
+        In this mode, the readers do not block the writer and the writer
+        does not block the readers, so dbs that are being written by
+        running protocols can be monitored by the GUI without locks.
+        The mode is persistent, it will be used by all new connections.
+        """
+        if self.getPragma('journal_mode') != 'wal':
+            self.commit()
+            self.setPragma('journal_mode', 'WAL')
+        self._wal = True
+        # In WAL mode, NORMAL is safe against corruption and much faster
+        self.setPragma('synchronous', 'NORMAL')
+
+    def checkpoint(self, mode='PASSIVE'):
+        """ Copy the changes from the WAL log into the database file.
+        The PASSIVE mode does not wait for readers or writers,
+        TRUNCATE waits for them and also truncates the log file.
+        Return the tuple (busy, logFrames, checkpointedFrames).
+        """
+        self.executeCommand('PRAGMA wal_checkpoint(%s)' % mode)
+        return tuple(self.cursor.fetchone())
+
@@ -0,0 +1,168 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Compile the simple query expressions used to select items from flat sets
+(see Set.iterItems) into SQL for the SqliteFlatDb.
+
+The where expressions use the attribute labels of the items, for example:
+    _micId=3
+    _micId IN (1, 2, 3) AND _ctfModel._defocusU BETWEEN 10000 AND 20000
+    (_index > 10 OR _filename='particles.stk') AND enabled=1
+Labels are translated to the table columns (e.g. _micId -> c04) and all
+literal values are passed as bound parameters. Only comparisons,
+AND/OR/NOT, IN, BETWEEN, IS [NOT] NULL and LIKE are allowed, so no
+arbitrary SQL can be injected through the expressions.
+"""
+
+import re
+
+
+KEYWORDS = set(['AND', 'OR', 'NOT', 'IN', 'BETWEEN', 'IS', 'NULL', 'LIKE'])
+OPERATORS = set(['=', '==', '!=', '<>', '<', '<=', '>', '>=', '(', ')', ','])
+DIRECTIONS = set(['ASC', 'DESC'])
+BOOLEANS = {'TRUE': 1, 'FALSE': 0}
+
+_TOKENS_RE = re.compile(r"""
+    \s*(?:
+      (?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | '(?P<squote>(?:[^']|'')*)'
+    | "(?P<dquote>(?:[^"]|"")*)"
+    | (?P<label>[A-Za-z_][A-Za-z0-9_.]*)
+    | (?P<op><=|>=|<>|!=|==|[=<>(),])
+    )""", re.VERBOSE)
+
+
+def _tokenize(expression):
+    """ Split the expression in (kind, value) tokens. """
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = _TOKENS_RE.match(expression, pos)
+        if m is None or m.end() == pos:
+            raise Exception("Invalid query expression near '%s' in: %s"
+                            % (expression[pos:], expression))
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'number':
+            value = float(value) if re.search('[.eE]', value) else int(value)
+        elif kind == 'squote':
+            kind, value = 'string', value.replace("''", "'")
+        elif kind == 'dquote':
+            kind, value = 'string', value.replace('""', '"')
+        yield kind, value
+
+
+def compileWhere(where, getColumn):
+    """ Compile a where expression based on attribute labels.
+    Params:
+        where: the expression string (e.g. '_micId IN (1, 2)').
+        getColumn: function to map a label to the table column.
+    Returns:
+        a tuple (whereStr, params) to be used with cursor.execute
+    """
+    parts = []
+    params = []
+    depth = 0
+
+    for kind, value in _tokenize(where):
+        if kind == 'label':
+            upper = value.upper()
+            if upper in KEYWORDS:
+                parts.append(upper)
+            elif upper in BOOLEANS:
+                parts.append('?')
+                params.append(BOOLEANS[upper])
+            else:
+                parts.append(getColumn(value))
+        elif kind == 'op':
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+                if depth < 0:
+                    raise Exception("Unbalanced parenthesis in: %s" % where)
+            parts.append('=' if value == '==' else value)
+        else:
+            parts.append('?')
+            params.append(value)
+
+    if depth:
+        raise Exception("Unbalanced parenthesis in: %s" % where)
+
+    return ' '.join(parts) or '1', params
+
+
+def compileOrderBy(orderBy, direction, getColumn):
+    """ Compile the ORDER BY clause.
+    Params:
+        orderBy: a label or a list of labels. Each label can be followed
+            by its own direction, for example: ['_micId', 'id DESC'].
+            The special value 'RANDOM()' is also accepted.
+        direction: 'ASC' or 'DESC', used for the last label when it does
+            not specify its own direction.
+        getColumn: function to map a label to the table column.
+    """
+    if isinstance(orderBy, basestring):
+        orderBy = [orderBy]
+    elif not isinstance(orderBy, (list, tuple)):
+        raise Exception('Invalid type for orderBy: %s' % type(orderBy))
+
+    direction = direction.upper()
+    if direction not in DIRECTIONS:
+        raise Exception('Invalid order direction: %s' % direction)
+
+    columns = []
+    for label in orderBy:
+        parts = label.split()
+        if len(parts) == 2 and parts[1].upper() in DIRECTIONS:
+            columns.append('%s %s' % (_getOrderColumn(parts[0], getColumn),
+                                      parts[1].upper()))
+        elif len(parts) == 1:
+            columns.append(_getOrderColumn(parts[0], getColumn))
+        else:
+            raise Exception('Invalid orderBy label: %s' % label)
+
+    # Keep the previous behaviour of applying the direction to the last column
+    if len(columns[-1].split()) == 1:
+        columns[-1] += ' %s' % direction
+
+    return ' ORDER BY %s' % ', '.join(columns)
+
+
+def _getOrderColumn(label, getColumn):
+    if label.upper() == 'RANDOM()':
+        return 'RANDOM()'
+    return getColumn(label)
+
+
+def compileLimit(limit=None, offset=None):
+    """ Return the LIMIT/OFFSET clause and its params. """
+    if limit is None and offset is None:
+        return '', []
+    # SQLite requires a LIMIT when OFFSET is used, -1 means no limit
+    return ' LIMIT ? OFFSET ?', [-1 if limit is None else int(limit),
+                                 int(offset or 0)]
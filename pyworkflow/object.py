@@ -29,6 +29,7 @@ The Object class is the root in the hierarchy and some other
 basic classes.
 """
 
+import sys
 from itertools import izip
 from collections import OrderedDict
 
@@ -908,6 +909,11 @@ class Set(OrderedObject):
     All items will have an unique id that identifies each element in the set.
     """
     ITEM_TYPE = None # This property should be defined to know the item type
+    # Stream states of the set: an open set is still being filled
+    # by the protocol that produces it (maybe while other protocols
+    # are processing its items), a closed one will not change
+    STREAM_OPEN = 1
+    STREAM_CLOSED = 2
     
     def __init__(self, filename=None, prefix='', 
                  mapperClass=None, classesDict=None, **kwargs):
@@ -916,6 +922,7 @@ class Set(OrderedObject):
         self._mapper = None
         self._idCount = 0
         self._size = Integer(0) # cached value of the number of images  
+        self._streamState = Integer(Set.STREAM_CLOSED)
         self.setMapperClass(mapperClass)
         self._mapperPath = CsvList() # sqlite filename
         self._representative = None
@@ -954,10 +961,37 @@ class Set(OrderedObject):
         """ element in Set """
         return self._getMapper().selectById(itemId) != None
 
-    def iterItems(self, orderBy='id', direction='ASC', where='1'):
+    def iterItems(self, orderBy='id', direction='ASC', where='1',
+                  limit=None, offset=None):
+        """ Iterate over the items of the set.
+        Params:
+            orderBy: attribute label or list of labels to sort the items,
+                each label can have its own direction, e.g. ['_micId', 'id DESC']
+            direction: 'ASC' or 'DESC' for the last label of orderBy.
+            where: filter expression on the attribute labels, e.g.
+                "_micId IN (1, 2) AND _ctfModel._defocusU BETWEEN 1000 AND 2000"
+                (see pyworkflow.mapper.sqlite_query for the allowed syntax)
+            limit, offset: only iterate over a range of the selected items.
+        """
         return self._getMapper().selectAll(orderBy=orderBy,
                                            direction=direction,
-                                           where=where)#has flat mapper, iterate is true
+                                           where=where,
+                                           limit=limit,
+                                           offset=offset)#has flat mapper, iterate is true
+
+    def getColumns(self, labels, orderBy='id', direction='ASC', where='1',
+                   limit=None, offset=None):
+        """ Return the values of some attributes of all items, without
+        building the items objects. The result is a numpy structured
+        array with one field per label, for example:
+            values = partSet.getColumns(['_ctfModel._defocusU', '_micId'])
+            defocusU = values['_ctfModel._defocusU']
+        The special labels 'id' and 'enabled' can also be used.
+        The other params are the same as in iterItems.
+        """
+        return self._getMapper().getColumns(labels, orderBy=orderBy,
+                                            direction=direction, where=where,
+                                            limit=limit, offset=offset)
 
     def getFirstItem(self):
         """ Return the first item in the Set. """
@@ -1001,6 +1035,7 @@ class Set(OrderedObject):
             objDict = self.getObjDict()
             for key, value in objDict.iteritems():
                 self._getMapper().setProperty(key, value)
+        self._getMapper().ensureDefaultIndexes()
         self._getMapper().commit()
     
     def _loadClassesDict(self):
@@ -1043,8 +1078,9 @@ class Set(OrderedObject):
         # under the assumption that once a Set is stored,
         # then it is read-only (no more appends).
         #
-        # Anyway, this can be easily changed by updating
-        # both from the underlying sqlite when reading a set.
+        # Sets that are filled in several steps (e.g. streaming)
+        # should call enableAppend to update both from the
+        # underlying sqlite when reading a set.
 
         if not item.hasObjId():
             self._idCount += 1
@@ -1054,9 +1090,172 @@ class Set(OrderedObject):
         self._insertItem(item)
         self._size.increment()
 
+    def appendMany(self, items, bufferSize=None):
+        """ Add all items from an iterable to the set.
+        Each item goes through append (so ids and size are kept
+        as usual), but the mapper buffers the rows and writes
+        them in chunks of bufferSize within a single transaction.
+        This is much faster than append when adding many items.
+        """
+        mapper = self._getMapper()
+        mapper.beginBulkInsert(bufferSize)
+        try:
+            for item in items:
+                self.append(item)
+        except:
+            # Write the items already appended, but without
+            # hiding the original error if that also fails
+            excInfo = sys.exc_info()
+            try:
+                mapper.endBulkInsert()
+            except Exception:
+                pass
+            raise excInfo[0], excInfo[1], excInfo[2]
+        mapper.endBulkInsert()
+
     def _insertItem(self, item):
         self._getMapper().insert(item)
-        
+
+    def enableAppend(self):
+        """ Allow to append items to a set already stored, updating
+        the number of items and the last id from the database.
+        """
+        mapper = self._getMapper()
+        mapper.enableAppend()
+        self._size.set(mapper.count())
+        self._idCount = mapper.maxId()
+
+    def setStreamState(self, value):
+        """ Set the stream state (STREAM_OPEN or STREAM_CLOSED), it
+        will be visible to other processes after the set is written.
+        """
+        self._streamState.set(value)
+
+    def getStreamState(self):
+        return self._streamState.get()
+
+    def isStreamOpen(self):
+        return self.getStreamState() == Set.STREAM_OPEN
+
+    def isStreamClosed(self):
+        return self.getStreamState() == Set.STREAM_CLOSED
+
+    def loadStreamState(self):
+        """ Read the stream state and the number of items from the set
+        database, since they could have been changed by the protocol
+        producing the set (running in other process).
+        """
+        self.close()
+        self.load()
+        self.loadProperty('_streamState', self.getStreamState())
+
+    def _canCopyRows(self, inputSet):
+        """ Return True if the items of inputSet can be copied directly
+        between the databases (see _appendRows), instead of building
+        and appending each item.
+        """
+        from pyworkflow.mapper.sqlite import SqliteFlatMapper
+        # In-memory databases can not be attached from other connections
+        if not (self._MapperClass is SqliteFlatMapper and
+                inputSet._MapperClass is SqliteFlatMapper and
+                inputSet.getFileName() not in (None, '', ':memory:')):
+            return False
+        # Items that are sets (e.g. classes) have their own tables
+        if isinstance(inputSet.getFirstItem(), Set):
+            return False
+        # The columns of this set (if already created) should
+        # store the same attributes as in the input set
+        outputClasses = self._getMapper().getColumnClasses()
+        if outputClasses is None:
+            return True
+        inputClasses = inputSet._getMapper().getColumnClasses() or {}
+        return all(outputClasses.get(label) == className
+                   for label, className in inputClasses.iteritems())
+
+    def _appendRows(self, inputSet, filterSet=None, **kwargs):
+        """ Copy the rows of inputSet into this set database
+        (see SqliteFlatMapper.insertFromSet for the arguments).
+        If filterSet is passed, its database and prefix are used
+        as the filterDbName and filterPrefix.
+        Return the number of inserted items.
+        """
+        template = inputSet.getFirstItem()
+        if template is None:
+            return 0
+        # The attached databases only see the committed rows
+        inputSet._getMapper().commit()
+        if filterSet is not None:
+            filterSet._getMapper().commit()
+            kwargs.update(filterDbName=filterSet.getFileName(),
+                          filterPrefix=filterSet.getPrefix() or '')
+        mapper = self._getMapper()
+        count = mapper.insertFromSet(template, inputSet.getFileName(),
+                                     inputSet.getPrefix() or '', **kwargs)
+        self._size.set(mapper.count())
+        self._idCount = max(self._idCount, mapper.maxId())
+        return count
+
+    def appendFromSet(self, inputSet, where='1', renumber=False, uniqueBy=None):
+        """ Append all items from inputSet (union of sets).
+        When possible, the items are copied with a single sql command
+        between the sets databases, without building the items.
+        Params:
+            where: filter the items to append, e.g. 'enabled=1'
+                (see iterItems for the syntax).
+            renumber: give new ids to the appended items.
+            uniqueBy: 'id' or an attribute label, if passed only the first
+                item with each value will be appended (and only if no
+                other item of this set already has that value).
+        Return the number of items appended.
+        """
+        if self._canCopyRows(inputSet):
+            return self._appendRows(inputSet, where=where, renumber=renumber,
+                                    uniqueBy=uniqueBy)
+        usedValues = None
+        if uniqueBy is not None and not self.isEmpty():
+            usedValues = set(self.getColumns([uniqueBy])[uniqueBy].tolist())
+        return self.__appendItems(inputSet.iterItems(where=where),
+                                  renumber, uniqueBy, usedValues)
+
+    def appendIntersection(self, inputSet, otherSet, by='id'):
+        """ Append the items from inputSet whose value of 'by'
+        (the id or an attribute label) is present in otherSet.
+        Return the number of items appended.
+        """
+        return self.__appendFiltered(inputSet, otherSet, by, exclude=False)
+
+    def appendDifference(self, inputSet, otherSet, by='id'):
+        """ Append the items from inputSet whose value of 'by'
+        (the id or an attribute label) is NOT present in otherSet.
+        Return the number of items appended.
+        """
+        return self.__appendFiltered(inputSet, otherSet, by, exclude=True)
+
+    def __appendFiltered(self, inputSet, otherSet, by, exclude):
+        if self._canCopyRows(inputSet) and otherSet.getFileName():
+            return self._appendRows(inputSet, filterSet=otherSet,
+                                    filterBy=by, exclude=exclude)
+        otherValues = set(otherSet.getColumns([by])[by].tolist())
+        items = (item for item in inputSet
+                 if (_getItemValue(item, by) in otherValues) != exclude)
+        return self.__appendItems(items)
+
+    def __appendItems(self, items, renumber=False, uniqueBy=None, usedValues=None):
+        """ Append items one by one, the slow path of appendFromSet. """
+        usedValues = usedValues or set()
+        count = 0
+        for item in items:
+            if uniqueBy is not None:
+                value = _getItemValue(item, uniqueBy)
+                if value in usedValues:
+                    continue
+                usedValues.add(value)
+            if renumber:
+                item.cleanObjId()
+            self.append(item)
+            count += 1
+        return count
+
     def update(self, item):
         """ Update an existing item. """
         self._getMapper().update(item)
@@ -1106,15 +1305,26 @@ class Set(OrderedObject):
     def loadAllProperties(self):
         """ Retrieve all properties stored by the mapper. """
         for key in self._getMapper().getPropertyKeys():
-            if key != 'self':
+            # Skip also the keys used internally by the mapper (with @)
+            if key != 'self' and '@' not in key:
                 self.loadProperty(key)
+
+    def ensureIndex(self, *labels):
+        """ Create an index in the underlying database for the
+        given attribute labels (e.g. '_micId'), this will speed up
+        the queries that filter or sort by these attributes.
+        Some commonly used attributes are indexed when the set
+        is written (see write).
+        """
+        self._getMapper().ensureIndex(*labels)
+
+    def getIndexes(self):
+        """ Return the labels of the attributes that are indexed. """
+        return self._getMapper().getIndexes()
         
     def getIdSet(self):
         """ Return a Python set object containing all ids. """
-        s = set()
-        for item in self.iterItems():
-            s.add(item.getObjId())
-        return s
+        return set(self.getColumns(['id'])['id'].tolist())
     
     def getFiles(self):
         files = set()
@@ -1123,6 +1333,17 @@ class Set(OrderedObject):
         return files
 
 
+def _getItemValue(item, label):
+    """ Return the value of an item for a label as used in the sets
+    columns: 'id', 'enabled' or an attribute label like '_micId'.
+    """
+    if label == 'id':
+        return item.getObjId()
+    if label == 'enabled':
+        return item.isEnabled()
+    return item.getNestedValue(label)
+
+
 def ObjectWrap(value):
     """This function will act as a simple Factory
     to create objects from Python basic types"""
@@ -41,7 +41,9 @@ import pyworkflow.protocol as pwprot
 import pyworkflow.object as pwobj
 import pyworkflow.utils as pwutils
 from pyworkflow.mapper import SqliteMapper
+from pyworkflow.utils.graph import Graph
 from pyworkflow.protocol.constants import MODE_RESTART
+from pyworkflow.protocol.cache import StepsCache
 
 PROJECT_DBNAME = 'project.sqlite'
 PROJECT_LOGS = 'Logs'
@@ -52,6 +54,7 @@ PROJECT_SETTINGS = 'settings.sqlite'
 PROJECT_CONFIG = '.config'
 PROJECT_CONFIG_HOSTS = 'hosts.conf'
 PROJECT_CONFIG_PROTOCOLS = 'protocols.conf'
+PROJECT_STEPS_CACHE = 'StepsCache'
 
 # Regex to get numbering suffix and automatically propose runName
 REGEX_NUMBER_ENDING = re.compile('(?P<prefix>.+\D)(?P<number>\d*)\s*$')
@@ -88,6 +91,7 @@ class Project(object):
         # Host configuration
         self._hosts = None
         self._protocolViews = None
+        self._stepsCache = None
 
     def getObjId(self):
         """ Return the unique id assigned to this project. """
@@ -153,23 +157,35 @@ class Project(object):
     def getSettings(self):
         return self.settings
     
+    def getStepsCachePath(self):
+        return os.path.join(self.path, PROJECT_STEPS_CACHE)
+    
+    def getStepsCache(self):
+        """ Return the StepsCache of the project or None if not enabled.
+        The cache is enabled if the StepsCache folder exists in the
+        project, it can also be a link to a folder shared between projects.
+        """
+        if self._stepsCache is None:
+            path = self.getStepsCachePath()
+            if os.path.isdir(path):
+                self._stepsCache = StepsCache(path)
+        return self._stepsCache
+    
     def saveSettings(self):
         # Read only mode
         if not self.isReadOnly():
             self.settings.write()
             
-    def createMapper(self, sqliteFn):
+    def createMapper(self, sqliteFn, readOnly=False):
         """ Create a new SqliteMapper object and pass as classes dict
         all globas and update with data and protocols from em.
+        The classes of EM packages are imported only when needed
+        (see em.getClassesDict).
         """
-        #TODO: REMOVE THE USE OF globals() here
-        classesDict = dict(pwobj.__dict__)
-        classesDict.update(em.getProtocols())
-        classesDict.update(em.getObjects())
-        return SqliteMapper(sqliteFn, classesDict)
+        return SqliteMapper(sqliteFn, em.getClassesDict(), readOnly=readOnly)
     
     def load(self, dbPath=None, hostsConf=None, protocolsConf=None, chdir=True, 
-             loadAllConfig=True):
+             loadAllConfig=True, readOnlyDb=False):
         """ Load project data, configuration and settings.
         Params:
             dbPath: the path to the project database.
@@ -180,6 +196,8 @@ class Project(object):
             settings: where to read the settings.
                 If None, use the settings.sqlite in project folder.
             If forProtocol is True, the settings and protocols.conf will not be loaded.
+            readOnlyDb: open the database with a read only connection,
+                for example to monitor the db of a running protocol.
         """
         if not os.path.exists(self.path):
             raise Exception("Cannot load project, path doesn't exist: %s" % self.path)
@@ -187,7 +205,7 @@ class Project(object):
         if chdir:
             os.chdir(self.path) #Before doing nothing go to project dir
         
-        self._loadDb(dbPath)
+        self._loadDb(dbPath, readOnlyDb)
         
         self._loadHosts(hostsConf)
         
@@ -206,7 +224,7 @@ class Project(object):
                 self.settings = None
             
     #---- Helper functions to load different pieces of a project
-    def _loadDb(self, dbPath):
+    def _loadDb(self, dbPath, readOnly=False):
         """ Load the mapper from the sqlite file in dbPath. """
         if dbPath is not None:
             self.setDbPath(dbPath)
@@ -214,7 +232,7 @@ class Project(object):
         absDbPath = os.path.join(self.path, self.dbPath)
         if not os.path.exists(absDbPath):
             raise Exception("Project database not found in '%s'" % absDbPath)
-        self.mapper = self.createMapper(absDbPath)
+        self.mapper = self.createMapper(absDbPath, readOnly)
         
     def closeMapper(self):
         if self.mapper is not None:
@@ -377,7 +395,7 @@ class Project(object):
 
                 #join(protocol.getHostConfig().getHostPath(), protocol.getDbPath())
                 prot2 = pwprot.getProtocolFromDb(self.path, protocol.getDbPath(), 
-                                          protocol.getObjId())
+                                          protocol.getObjId(), readOnly=True)
 
                 # Copy is only working for db restored objects
                 protocol.setMapper(self.mapper)
@@ -833,7 +851,7 @@ class Project(object):
         if refresh or self._runsGraph is None:
             outputDict = {} # Store the output dict
             runs = [r for r in self.getRuns(refresh=refresh) if not r.isChild()]
-            g = pwutils.graph.Graph(rootName='PROJECT')
+            g = Graph(rootName='PROJECT')
             
             for r in runs:
                 n = g.createNode(r.strId())
@@ -882,7 +900,7 @@ class Project(object):
         """ Retrieve objects produced as outputs and
         make a graph taking into account the SOURCE relation. """
         relations = self.mapper.getRelationsByName(relation)
-        g = pwutils.graph.Graph(rootName='PROJECT')
+        g = Graph(rootName='PROJECT')
         root = g.getRoot()
         root.pointer = None
         runs = self.getRuns(refresh=refresh)
@@ -0,0 +1,283 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module implements a cache of steps results.
+Each entry is identified by a hash of the protocol class, the step
+function name, its arguments, the protocol params values and the
+content of the input files.
+The result files of the step are stored (hard-linked when possible)
+and restored in a later run of a step with the same key,
+instead of running it again.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from pyworkflow.utils.path import makePath, cleanPath
+
+
+INFO_FILE = 'info.json'
+# Params that do not change the results of the steps
+IGNORED_PARAMS = ['runName', 'runMode', 'hostName', 'numberOfThreads',
+                  'numberOfMpi', 'mpiJobSize']
+FILES_FOLDER = 'files'
+TMP_PREFIX = '.tmp_'
+
+
+class StepsCache(object):
+    """ Store the result files of steps in a folder,
+    with a subfolder for each entry (named by its key).
+    """
+    def __init__(self, path):
+        self.path = path
+        # Digests of the files content already computed,
+        # indexed by (path, size, modification time)
+        self._digests = {}
+        # Digests of the input files of protocols
+        self._inputsDigests = {}
+
+    def _getEntryPath(self, key, *paths):
+        return os.path.join(self.path, key[:2], key, *paths)
+
+    def _fileDigest(self, path):
+        """ Return the sha1 of the content of a given file. """
+        st = os.stat(path)
+        memoKey = (os.path.abspath(path), st.st_size, st.st_mtime)
+
+        if memoKey not in self._digests:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), ''):
+                    h.update(block)
+            self._digests[memoKey] = h.hexdigest()
+
+        return self._digests[memoKey]
+
+    def _filesDigest(self, paths):
+        """ Return a single digest for the content of all given files. """
+        h = hashlib.sha1()
+        for path in sorted(paths):
+            if os.path.isfile(path):
+                h.update(self._fileDigest(path))
+        return h.hexdigest()
+
+    def _inputsDigest(self, protocol):
+        """ Return the digest of the protocol input files, it is
+        only computed once since the inputs do not change while running.
+        """
+        protId = protocol.getObjId()
+        if protId not in self._inputsDigests:
+            self._inputsDigests[protId] = self._filesDigest(protocol.getInputFiles())
+        return self._inputsDigests[protId]
+
+    def _paramsDigest(self, protocol):
+        """ Return the digest of the values of the protocol params,
+        except the inputs (included by the content of their files)
+        and the IGNORED_PARAMS.
+        """
+        from pyworkflow.protocol.params import PointerParam, RelationParam
+        h = hashlib.sha1()
+        for name, param in sorted(protocol.getDefinition().iterParams()):
+            if (name in IGNORED_PARAMS or
+                isinstance(param, (PointerParam, RelationParam))):
+                continue
+            attr = getattr(protocol, name, None)
+            if hasattr(attr, 'getObjValue'):
+                h.update('%s=%r\n' % (name, attr.getObjValue()))
+        return h.hexdigest()
+
+    def getStepKey(self, protocol, step):
+        """ Compute the key of a FunctionStep of a given protocol.
+        The protocol working dir is removed from the step arguments,
+        so the same step of different runs have the same key.
+        Arguments that are existing files, such as files produced by
+        previous steps, are included by their content, and the protocol
+        params by their values, since steps can use them.
+        """
+        workingDir = protocol.getWorkingDir()
+        h = hashlib.sha1()
+        h.update(protocol.getClassName())
+        h.update(step.funcName.get())
+        h.update(step.argsStr.get().replace(workingDir, '$WORKING_DIR'))
+        h.update(self._inputsDigest(protocol))
+        h.update(self._paramsDigest(protocol))
+        argFiles = [arg for arg in step._args if isinstance(arg, basestring)]
+        h.update(self._filesDigest(argFiles))
+
+        return h.hexdigest()
+
+    def _linkFile(self, source, dest):
+        """ Hard-link source into dest, or copy it
+        if the link is not possible (e.g. other filesystem).
+        """
+        if os.path.lexists(dest):
+            os.remove(dest)
+        try:
+            os.link(source, dest)
+        except OSError:
+            shutil.copy2(source, dest)
+
+    def store(self, key, workingDir, resultFiles, **info):
+        """ Store the result files of a step with the given key.
+        The files should be inside the protocol working dir.
+        Params:
+            key: the step key (see getStepKey)
+            workingDir: working dir of the protocol that run the step.
+            resultFiles: list of paths of the step result files.
+            **info: other values stored with the entry.
+        Returns:
+            True if the entry was stored.
+        """
+        relFiles = [os.path.relpath(f, workingDir) for f in resultFiles]
+
+        if any(f.startswith(os.pardir) for f in relFiles):
+            return False
+
+        makePath(self.path)
+        tmpPath = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.path)
+        files = []
+
+        for fn, relFn in zip(resultFiles, relFiles):
+            dest = os.path.join(tmpPath, FILES_FOLDER, relFn)
+            makePath(os.path.dirname(dest))
+            self._linkFile(fn, dest)
+            st = os.stat(dest)
+            files.append((relFn, st.st_size, st.st_mtime))
+
+        info.update(key=key, files=files, created=time.time())
+        with open(os.path.join(tmpPath, INFO_FILE), 'w') as f:
+            json.dump(info, f)
+
+        entryPath = self._getEntryPath(key)
+        makePath(os.path.dirname(entryPath))
+        try:
+            os.rename(tmpPath, entryPath)
+        except OSError: # Already stored by other process
+            cleanPath(tmpPath)
+
+        return True
+
+    def _loadInfo(self, key):
+        infoFn = self._getEntryPath(key, INFO_FILE)
+        if not os.path.exists(infoFn):
+            return None
+        with open(infoFn) as f:
+            return json.load(f)
+
+    def restore(self, key, workingDir):
+        """ Restore the result files of a given entry to workingDir.
+        The cached files are checked to be unmodified, otherwise
+        the entry is removed.
+        Returns:
+            The list of result files or None if the entry does not exist.
+        """
+        info = self._loadInfo(key)
+
+        if info is None:
+            return None
+
+        for relFn, size, mtime in info['files']:
+            fn = self._getEntryPath(key, FILES_FOLDER, relFn)
+            if not os.path.exists(fn):
+                self.remove(key)
+                return None
+            st = os.stat(fn)
+            if st.st_size != size or st.st_mtime != mtime:
+                self.remove(key)
+                return None
+
+        resultFiles = []
+        for relFn, _, _ in info['files']:
+            dest = os.path.join(workingDir, relFn)
+            makePath(os.path.dirname(dest))
+            self._linkFile(self._getEntryPath(key, FILES_FOLDER, relFn), dest)
+            resultFiles.append(dest)
+        # Keep the last time the entry was used in the info file
+        os.utime(self._getEntryPath(key, INFO_FILE), None)
+
+        return resultFiles
+
+    def remove(self, key):
+        cleanPath(self._getEntryPath(key))
+
+    def clear(self):
+        """ Remove all entries of the cache. """
+        for key in [entry['key'] for entry in self.iterEntries()]:
+            self.remove(key)
+
+    def iterEntries(self):
+        """ Iterate over the entries info (dicts), with the
+        keys stored when created plus 'size' (in bytes) and
+        'lastUsed' (time of the last store or restore).
+        """
+        if not os.path.exists(self.path):
+            return
+
+        for prefix in sorted(os.listdir(self.path)):
+            prefixPath = os.path.join(self.path, prefix)
+            if prefix.startswith(TMP_PREFIX) or not os.path.isdir(prefixPath):
+                continue
+            for key in sorted(os.listdir(prefixPath)):
+                info = self._loadInfo(key)
+                if info is not None:
+                    info['size'] = sum(f[1] for f in info['files'])
+                    info['lastUsed'] = os.path.getmtime(self._getEntryPath(key, INFO_FILE))
+                    yield info
+
+    def getSize(self):
+        """ Return the total size (in bytes) of the cached files. """
+        return sum(entry['size'] for entry in self.iterEntries())
+
+    def prune(self, maxSize=None, maxAge=None):
+        """ Remove the entries not used in more than maxAge days
+        and then the least recently used ones until the cache size
+        is below maxSize (in bytes).
+        Returns:
+            The list of removed entries.
+        """
+        entries = sorted(self.iterEntries(), key=lambda e: e['lastUsed'])
+        removed = []
+
+        if maxAge is not None:
+            minTime = time.time() - maxAge * 24 * 3600
+            while entries and entries[0]['lastUsed'] < minTime:
+                removed.append(entries.pop(0))
+
+        if maxSize is not None:
+            size = sum(e['size'] for e in entries)
+            while entries and size > maxSize:
+                entry = entries.pop(0)
+                size -= entry['size']
+                removed.append(entry)
+
+        for entry in removed:
+            self.remove(entry['key'])
+
+        return removed
@@ -0,0 +1,129 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module keeps track of the steps of a protocol run claimed by
+the tasks of a queue array job (see ArrayStepExecutor). The steps
+are claimed in blocks, inside an exclusive transaction, so each step
+is run by a single task. The final task of the run (the usual protocol
+run) uses the steps finished by the array tasks instead of running them.
+"""
+
+import json
+import time
+import hashlib
+
+from pyworkflow.mapper.sqlite_db import SqliteDb
+from constants import STATUS_NEW, STATUS_RUNNING, STATUS_FINISHED
+
+
+def getStepKey(step):
+    """ Key to check that a claimed step is the same
+    (same function and arguments) when read by other task.
+    """
+    return hashlib.md5(step.funcName.get() + step.argsStr.get()).hexdigest()
+
+
+class StepsClaimsDb(SqliteDb):
+    """ Store the status of each step (by its index) and the task
+    that claimed it. When the step is done, the info needed to
+    update the step in the final task is also stored.
+    """
+    def __init__(self, dbName, timeout=600):
+        SqliteDb.__init__(self)
+        self._createConnection(dbName, timeout)
+        self.executeCommand("""CREATE TABLE IF NOT EXISTS Claims
+                     (id INTEGER PRIMARY KEY, -- step index
+                      key TEXT,
+                      status TEXT,
+                      task INTEGER,
+                      claimTime REAL,
+                      info TEXT)""")
+        self.commit()
+
+    def addSteps(self, steps):
+        """ Add the given steps (if not added by other task before).
+        Steps that have changed since they were added are set as new.
+        """
+        self.executeCommand('BEGIN IMMEDIATE')
+        for i, step in enumerate(steps):
+            key = getStepKey(step)
+            self.executeCommand("INSERT OR IGNORE INTO Claims (id, key, status) "
+                                "VALUES (?, ?, ?)", (i + 1, key, STATUS_NEW))
+            self.executeCommand("UPDATE Claims SET key=?, status=?, task=NULL "
+                                "WHERE id=? AND key!=?",
+                                (key, STATUS_NEW, i + 1, key))
+        self.commit()
+
+    def getStatus(self):
+        """ Return a dict {stepIndex: status}. """
+        self.executeCommand('SELECT id, status FROM Claims')
+        return dict((row['id'], row['status']) for row in self._iterResults())
+
+    def claim(self, taskId, selectFunc):
+        """ Claim some steps for the given task.
+        Params:
+            taskId: the id of the task claiming the steps.
+            selectFunc: function that receives the dict returned
+                by getStatus and returns the indexes of the steps
+                to claim (with status STATUS_NEW).
+        Returns:
+            (indexes of the claimed steps, status dict)
+        """
+        # Lock the db for writing before reading the status,
+        # so other tasks can not claim the same steps
+        self.executeCommand('BEGIN IMMEDIATE')
+        status = self.getStatus()
+        indexes = selectFunc(status)
+        now = time.time()
+        for i in indexes:
+            self.executeCommand("UPDATE Claims SET status=?, task=?, claimTime=? "
+                                "WHERE id=?", (STATUS_RUNNING, taskId, now, i))
+            status[i] = STATUS_RUNNING
+        self.commit()
+        return indexes, status
+
+    def setDone(self, index, status, **info):
+        """ Set the final status of the step with given index,
+        storing the info values (e.g. initTime, endTime).
+        """
+        self.executeCommand("UPDATE Claims SET status=?, info=? WHERE id=?",
+                            (status, json.dumps(info), index))
+        self.commit()
+
+    def resetUnfinished(self):
+        """ Set as new the steps not finished, e.g. claimed by tasks
+        of a previous array job that were cancelled.
+        """
+        self.executeCommand("UPDATE Claims SET status=?, task=NULL "
+                            "WHERE status!=?", (STATUS_NEW, STATUS_FINISHED))
+        self.commit()
+
+    def getFinished(self):
+        """ Return a dict {stepIndex: (key, task, info)} of the finished steps. """
+        self.executeCommand("SELECT id, key, task, info FROM Claims "
+                            "WHERE status=?", (STATUS_FINISHED,))
+        return dict((row['id'], (row['key'], row['task'], json.loads(row['info'])))
+                    for row in self._iterResults())
@@ -56,6 +56,14 @@ MODE_CHOICES = ('Continue', 'Restart')#, 'Continue')
 STEPS_SERIAL = 0      # Execute steps serially, some of the steps can be mpi programs
 STEPS_PARALLEL = 1    # Execute steps in parallel, through threads or mpi
 
+# Items grouping in steps (see Protocol._insertItemsSteps)
+ITEMS_CHUNKS_PER_WORKER = 4  # Minimum number of steps for each parallel worker
+ITEMS_MAX_CHUNK_SIZE = 50    # Maximum number of items in each step
+
+# Resources used by each step (see FunctionStep.getProfile)
+PROFILE_KEYS = ('wallTime', 'cpuUser', 'cpuSystem',
+                'maxRss', 'readBytes', 'writeBytes')
+
 
 # Level of expertise for the input parameters, mainly used in the protocol form
          
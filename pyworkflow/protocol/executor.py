@@ -27,13 +27,17 @@
 This module have the classes for execution of protocol steps.
 The basic one will run steps, one by one, after completion.
 There is one based on threads to execute steps in parallel
-using different threads and the last one with MPI processes.
+using different threads, other using a pool of processes
+and the last one with MPI processes.
 """
 
+import os
 import time
 import datetime
 import traceback
 import threading
+import collections
+import Queue
 
 import pyworkflow.utils.process as process
 import constants as cts
@@ -55,25 +59,53 @@ class StepExecutor():
                        self.hostConfig,
                        env=env, cwd=cwd)
     
-    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback):
-        """ Simply iterate over the steps and run each one. """
-        for s in steps:
-            if not s.isFinished():
-                s.setRunning()
-                stepStartedCallback(s)
-                s.run()
-                doContinue = stepFinishedCallback(s)
-                if not doContinue:
-                    break
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                 stepsCheckCallback=None, stepsCheckSecs=5):
+        """ Simply iterate over the steps and run each one.
+        If stepsCheckCallback is passed (e.g. protocols processing
+        a streaming input), it is called when all steps are done
+        (and then every stepsCheckSecs) and it can append new steps
+        to the list. It should return False when no more steps will
+        be appended.
+        """
+        index = 0
+        
+        while True:
+            for s in steps[index:]:
+                index += 1
+                if not s.isFinished():
+                    s.setRunning()
+                    stepStartedCallback(s)
+                    s.run()
+                    doContinue = stepFinishedCallback(s)
+                    if not doContinue:
+                        return
+            
+            if stepsCheckCallback is None:
+                break
+            n = len(steps)
+            if not stepsCheckCallback():
+                stepsCheckCallback = None
+            elif len(steps) == n:
+                time.sleep(stepsCheckSecs)
 
 
 class StepThread(threading.Thread):
     """ Thread to run Steps in parallel. """
-    def __init__(self, thId, step, lock):
+    def __init__(self, thId, step, lock, finishedQueue=None):
+        """
+        Params:
+            thId: the id (node) of the thread.
+            step: the step to run.
+            lock: lock used to update the step status.
+            finishedQueue: if passed, (thId, step) will be put in
+                the queue when the step finishes.
+        """
         threading.Thread.__init__(self)
         self.thId = thId
         self.step = step
         self.lock = lock
+        self.finishedQueue = finishedQueue
 
     def run(self):
         error = None
@@ -89,94 +121,534 @@ class StepThread(threading.Thread):
                 else:
                     self.step.setFailed(error)
                 self.step.endTime.set(datetime.datetime.now())
+            # Notify the executor that this step is done
+            if self.finishedQueue is not None:
+                self.finishedQueue.put((self.thId, self.step))
+
+
+class StepsScheduler():
+    """ Keep track of the steps that are ready to run according to
+    their prerequisites. The number of unfinished prerequisites of each
+    step is computed once, and updated when a step finishes, so getting
+    the next ready step does not require to scan all steps.
+    """
+    def __init__(self, steps):
+        """ steps: list of steps, where the _prerequisites of each
+        step are the (1-based) indexes of the steps in the list.
+        """
+        self._steps = steps
+        self._pending = []  # number of unfinished prerequisites
+        self._dependents = []  # steps waiting for each step
+        self._ready = collections.deque()
+        self.addNewSteps()
+
+    def addNewSteps(self):
+        """ Take into account the steps appended to the list
+        since the scheduler was created or this was called.
+        """
+        for i in range(len(self._pending), len(self._steps)):
+            self._pending.append(0)
+            self._dependents.append([])
+            for p in self._steps[i]._prerequisites:
+                prevIndex = int(p) - 1
+                if not self._steps[prevIndex].isFinished():
+                    self._pending[i] += 1
+                    self._dependents[prevIndex].append(i)
+            self._addIfReady(i)
+
+    def _addIfReady(self, i):
+        if (self._pending[i] == 0 and
+                self._steps[i].getStatus() == cts.STATUS_NEW):
+            self._ready.append(i)
+
+    def hasReady(self):
+        return len(self._ready) > 0
+
+    def popReady(self, fits=None):
+        """ Return the next step ready to run, or None if there is none.
+        If fits function is passed, return the first ready step
+        for which fits(step) is True (e.g. with enough free resources).
+        """
+        i = 0
+        while i < len(self._ready):
+            step = self._steps[self._ready[i]]
+            # The status could have changed since it was added
+            if step.getStatus() != cts.STATUS_NEW:
+                del self._ready[i]
+            elif fits is None or fits(step):
+                del self._ready[i]
+                return step
+            else:
+                i += 1
+        return None
+
+    def stepFinished(self, step, index):
+        """ Update the steps that depend on the step at the given
+        (0-based) index, if the step has finished successfully.
+        """
+        if step.isFinished():
+            for i in self._dependents[index]:
+                self._pending[i] -= 1
+                self._addIfReady(i)
 
 
 class ThreadStepExecutor(StepExecutor):
     """ Run steps in parallel using threads. """
-    def __init__(self, hostConfig, nThreads):
+    def __init__(self, hostConfig, nThreads, maxCores=None, maxMemory=None):
+        """
+        Params:
+            nThreads: maximum number of steps running at the same time.
+            maxCores: number of cores that can be used by the running
+                steps, each one using the cores it requested (see
+                Step.setResources). If None, nThreads will be used.
+            maxMemory: memory (in MB) that can be used by the running
+                steps. If None, memory will not be taken into account.
+        """
         StepExecutor.__init__(self, hostConfig)
         self.numberOfProcs = nThreads
+        self.maxCores = maxCores or nThreads
+        self.maxMemory = maxMemory
+        
+    def _getResources(self, step):
+        """ Return the (cores, memory) used by the step, limited by
+        the maximum ones, so big steps can be run alone.
+        """
+        cores = min(step.getCores(), self.maxCores)
+        memory = step.getMemory()
+        if self.maxMemory is not None:
+            memory = min(memory, self.maxMemory)
+        return cores, memory
         
-    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback):
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                 stepsCheckCallback=None, stepsCheckSecs=5):
         """ Create threads and synchronize the steps execution.
-        n: the number of threads.
+        The steps are dispatched as soon as their prerequisites
+        are done and there is a free thread and enough free cores
+        and memory for them. The threads notify the end of each step
+        through a queue, so there is no need to poll the status
+        of the running steps, except when stepsCheckCallback is passed
+        (see StepExecutor.runSteps), which is called every stepsCheckSecs.
         """
-
         sharedLock = threading.Lock()
+        finishedQueue = Queue.Queue()
+        scheduler = StepsScheduler(steps)
+        indexes = dict((id(s), i) for i, s in enumerate(steps))
+        lastCheck = time.time()
 
         runningSteps = {}  # currently running step in each node ({node: step})
         freeNodes = range(self.numberOfProcs)  # available nodes to send mpi jobs
+        self._threads = []
+        free = {'cores': self.maxCores, 'memory': self.maxMemory}
+
+        def _fits(step):
+            cores, memory = self._getResources(step)
+            return (cores <= free['cores'] and
+                    (free['memory'] is None or memory <= free['memory']))
 
-        def getRunnable():
-            """ Return the first step that is 'new' and all its
-            dependencies have been finished, or None if none ready.
-            """
-            for s in steps:
-                if (s.getStatus() == cts.STATUS_NEW and
-                        all(steps[i-1].isFinished() for i in s._prerequisites)):
-                    return s
-            return None
+        def _useResources(step, sign):
+            cores, memory = self._getResources(step)
+            free['cores'] -= sign * cores
+            if free['memory'] is not None:
+                free['memory'] -= sign * memory
 
         while True:
-            # See which of the runningSteps are not really running anymore.
-            # Update them and freeNodes, and call final callback for step.
-            with sharedLock:
-                nodesFinished = [node for node, step in runningSteps.iteritems()
-                                 if not step.isRunning()]
-            doContinue = True
-            for node in nodesFinished:
-                step = runningSteps.pop(node)  # remove entry from runningSteps
+            # Send runnable steps to all available nodes
+            while freeNodes:
+                with sharedLock:
+                    step = scheduler.popReady(_fits)
+                    if step is None:
+                        break
+                    step.setRunning()
+                _useResources(step, 1)
+                stepStartedCallback(step)
+                node = freeNodes.pop()  # take an available node
+                runningSteps[node] = step
+                self._startStep(node, step, sharedLock, finishedQueue)
+
+            if not runningSteps and stepsCheckCallback is None:
+                break  # yeah, we are done, either failed or finished :)
+
+            # Wait until some of the running steps finishes, then
+            # release its node and call final callback for step
+            try:
+                timeout = None
+                if stepsCheckCallback is not None:
+                    timeout = max(0, lastCheck + stepsCheckSecs - time.time())
+                node, step = finishedQueue.get(timeout=timeout)
+            except Queue.Empty:
+                step = None
+
+            if step is not None:
+                runningSteps.pop(node)
                 freeNodes.append(node)  # the node is available now
-                doContinue = stepFinishedCallback(step)  # and do final work on the finished step
-                if not doContinue:
+                _useResources(step, -1)
+                if not stepFinishedCallback(step):  # do final work on the finished step
                     break
-            if not doContinue:
+                with sharedLock:
+                    scheduler.stepFinished(step, indexes[id(step)])
+
+            if (stepsCheckCallback is not None and
+                    time.time() - lastCheck >= stepsCheckSecs):
+                n = len(steps)
+                if not stepsCheckCallback():
+                    stepsCheckCallback = None
+                lastCheck = time.time()
+                with sharedLock:
+                    indexes.update((id(s), i) for i, s in enumerate(steps[n:], n))
+                    scheduler.addNewSteps()
+
+        self._waitSteps()
+
+    def _startStep(self, node, step, lock, finishedQueue):
+        """ Start running the step in the given node. When the step
+        is done, its status should be updated (holding the lock)
+        and (node, step) put in the finishedQueue.
+        """
+        t = StepThread(node, step, lock, finishedQueue)
+        t.daemon = True  # won't keep process up if main thread ends
+        t.start()
+        self._threads.append(t)
+
+    def _waitSteps(self):
+        """ Wait for the steps that are still running. """
+        for t in self._threads:
+            t.join()
+
+
+# Protocol used to run the steps in each process of a ProcessStepExecutor
+_workerProtocol = None
+_workerError = None
+# Queue where the workers put (index, pid) when starting a step
+_workerQueue = None
+
+
+def _initStepsWorker(projectPath, protDbPath, protId, startedQueue):
+    """ Load the protocol (in read only mode, since only the main process
+    writes to the databases) and define its steps, as it is done when
+    running the protocol.
+    """
+    global _workerProtocol, _workerError, _workerQueue
+    _workerQueue = startedQueue
+    try:
+        from protocol import getProtocolFromDb
+        from pyworkflow.utils.log import ScipionLogger
+        protocol = getProtocolFromDb(projectPath, protDbPath, protId,
+                                     chdir=True, readOnly=True)
+        protocol._log = ScipionLogger(protocol.getLogPaths()[2])
+        protocol.setStepsExecutor(StepExecutor(protocol.getHostConfig()))
+        protocol._insertAllSteps()
+        _workerProtocol = protocol
+    except Exception as e:
+        _workerError = 'Error loading protocol in worker: %s' % e
+        traceback.print_exc()
+
+
+def _runStepInWorker(index, key):
+    """ Run the step with this (0-based) index in the protocol of
+    this worker. The key of the step in the main process
+    (see claims.getStepKey) is used to check that the worker
+    defined the same step.
+    Return (index, errorMessage, resultFiles, profile).
+    """
+    _workerQueue.put((index, os.getpid()))
+    if _workerProtocol is None:
+        return index, _workerError, None, None
+    step = None
+    try:
+        from claims import getStepKey
+        step = _workerProtocol._steps[index]
+        if getStepKey(step) != key:
+            raise Exception("Step %d defined in the worker (%s) is different "
+                            "from the one of the main process"
+                            % (index + 1, step.funcName.get()))
+        # Protocol.runJob uses the cores of the step of the current thread
+        threading.current_thread().step = step
+        step._run()
+        return index, None, step._resultFiles.get(), step.getProfile()
+    except Exception as e:
+        traceback.print_exc()
+        return (index, str(e), None,
+                None if step is None else step.getProfile())
+    finally:
+        threading.current_thread().step = None
+
+
+class ProcessStepExecutor(ThreadStepExecutor):
+    """ Run steps in parallel using a pool of processes.
+    This is useful when the steps do heavy work in Python, which can not
+    be done in parallel by threads. Each process loads the protocol from
+    the database and runs the steps by their index. The status of the
+    steps is sent back to this process, that is the only one writing
+    to the databases.
+    Steps that should be run in the main process (e.g. those defining
+    the outputs) should be inserted with mainProcess=True, and they
+    will be run in threads as done by ThreadStepExecutor.
+    """
+    # Seconds between checks of the steps sent to the pool
+    POLL_SECS = 0.1
+
+    def __init__(self, hostConfig, nProcs, projectPath, protDbPath, protId,
+                 maxCores=None, maxMemory=None):
+        ThreadStepExecutor.__init__(self, hostConfig, nProcs,
+                                    maxCores, maxMemory)
+        self._protocolArgs = (projectPath, protDbPath, protId)
+        self._pool = None
+
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                 stepsCheckCallback=None, stepsCheckSecs=5):
+        # Import multiprocessing here since it is only needed
+        # by this executor
+        import multiprocessing
+        from multiprocessing.queues import SimpleQueue
+        self._startedQueue = SimpleQueue()
+        self._pool = multiprocessing.Pool(self.numberOfProcs, _initStepsWorker,
+                                          self._protocolArgs +
+                                          (self._startedQueue,))
+        # Steps sent to the pool: {index: (node, step, asyncResult, lock, queue)}
+        self._pending = {}
+        self._pendingLock = threading.Lock()
+        self._workerSteps = {}  # index of the step run by each worker pid
+        self._lostSteps = False
+        self._stopWatch = threading.Event()
+        watcher = threading.Thread(target=self._watchSteps)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            ThreadStepExecutor.runSteps(self, steps, stepStartedCallback,
+                                        stepFinishedCallback,
+                                        stepsCheckCallback, stepsCheckSecs)
+        finally:
+            self._waitSteps()
+            self._stopWatch.set()
+            watcher.join()
+            # The tasks of dead workers are never removed from the pool,
+            # so join would wait for them forever
+            if self._lostSteps:
+                self._pool.terminate()
+            else:
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+
+    def _startStep(self, node, step, lock, finishedQueue):
+        if step.isMainProcess() or step.isInteractive():
+            ThreadStepExecutor._startStep(self, node, step, lock, finishedQueue)
+            return
+
+        from claims import getStepKey
+        index = step.getIndex() - 1
+        try:
+            result = self._pool.apply_async(_runStepInWorker,
+                                            (index, getStepKey(step)))
+        except Exception as e:
+            self._stepDone(node, step, lock, finishedQueue,
+                           (index, 'Error sending step to worker: %s' % e,
+                            None, None))
+            return
+        with self._pendingLock:
+            self._pending[index] = (node, step, result, lock, finishedQueue)
+
+    def _stepDone(self, node, step, lock, finishedQueue, result):
+        """ Update the step with the result of _runStepInWorker. """
+        _, error, resultFiles, profile = result
+        with lock:
+            if profile is not None:
+                step.setProfile(**profile)
+            if error is None:
+                step._resultFiles.set(resultFiles)
+                step.setStatus(cts.STATUS_FINISHED)
+            else:
+                step.setFailed(error)
+            step.endTime.set(datetime.datetime.now())
+        finishedQueue.put((node, step))
+
+    def _getWorkersPids(self):
+        """ Return the pids of the live processes of the pool. """
+        # The pool replaces the dead workers, but the tasks they
+        # were running are lost, without any notification
+        return set(p.pid for p in self._pool._pool if p.exitcode is None)
+
+    def _watchSteps(self):
+        """ Check the steps sent to the pool, since (in python 2.7)
+        apply_async callbacks are not called on errors (e.g. the
+        arguments or the result can not be pickled) and the result
+        of a task never comes if its worker dies.
+        """
+        while not self._stopWatch.is_set():
+            while not self._startedQueue.empty():
+                index, pid = self._startedQueue.get()
+                self._workerSteps[pid] = index
+            alivePids = self._getWorkersPids()
+            lostIndexes = set(index for pid, index in self._workerSteps.items()
+                              if pid not in alivePids)
+            done = []
+            with self._pendingLock:
+                for index, pending in self._pending.items():
+                    result = pending[2]
+                    if result.ready():
+                        try:
+                            value = result.get()
+                        except Exception as e:
+                            value = (index, 'Error running step in worker: %s'
+                                     % e, None, None)
+                    elif index in lostIndexes:
+                        self._lostSteps = True
+                        value = (index, 'The worker process running the step '
+                                        'died', None, None)
+                    else:
+                        continue
+                    del self._pending[index]
+                    done.append((pending, value))
+            for (node, step, _, lock, finishedQueue), value in done:
+                self._stepDone(node, step, lock, finishedQueue, value)
+            time.sleep(self.POLL_SECS)
+
+    def _waitSteps(self):
+        ThreadStepExecutor._waitSteps(self)
+        while self._pending:
+            time.sleep(self.POLL_SECS)
+
+
+class ArrayStepExecutor(StepExecutor):
+    """ Run steps in one of the tasks of a queue array job.
+    All tasks define the same steps and claim blocks of them from
+    a StepsClaimsDb, when their prerequisites are finished.
+    Steps that should be run in the main process or interactive
+    ones are left for the final task of the protocol run.
+    """
+    # Seconds waiting between claims when no step is ready,
+    # increased from the min to the max while nothing changes
+    MIN_WAIT = 0.1
+    MAX_WAIT = 10
+
+    def __init__(self, hostConfig, claimsFile, taskId, nTasks, maxWait=3600):
+        """
+        Params:
+            claimsFile: the db file shared by all tasks.
+            taskId: the id of this task (from 1 to nTasks).
+            nTasks: number of tasks of the array job, used to
+                compute the size of the blocks of steps claimed.
+            maxWait: stop after waiting these seconds without
+                any step done (e.g. a task was killed while running
+                steps that others depend on).
+        """
+        StepExecutor.__init__(self, hostConfig)
+        self.claimsFile = claimsFile
+        self.taskId = taskId
+        self.nTasks = nTasks
+        self.maxWait = maxWait
+
+    def _canRun(self, step):
+        return not (step.isMainProcess() or step.isInteractive())
+
+    def _selectSteps(self, steps, status):
+        """ Return the indexes of the steps to claim: a block of
+        the ones ready to run, smaller as fewer steps remain.
+        """
+        ready = [i + 1 for i, step in enumerate(steps)
+                 if status[i + 1] == cts.STATUS_NEW and self._canRun(step) and
+                 all(status[int(p)] == cts.STATUS_FINISHED
+                     for p in step._prerequisites)]
+        n = len(ready) // (self.nTasks * cts.ITEMS_CHUNKS_PER_WORKER)
+        return ready[:max(1, n)]
+
+    def _isWaiting(self, steps, status):
+        """ Return True if some step could be run by this task
+        when the steps running in other tasks finish.
+        """
+        waiting = {}
+        for i, step in enumerate(steps):
+            waiting[i + 1] = (status[i + 1] == cts.STATUS_NEW and
+                              self._canRun(step) and
+                              all(status[int(p)] in (cts.STATUS_FINISHED,
+                                                     cts.STATUS_RUNNING) or
+                                  waiting[int(p)]
+                                  for p in step._prerequisites))
+        return any(waiting.values())
+
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                 stepsCheckCallback=None, stepsCheckSecs=5):
+        """ Claim and run steps until there are no more steps
+        that this task can run. Failed steps do not stop the task,
+        they will be run again by the final task, which is also
+        the one checking for new steps (stepsCheckCallback is ignored).
+        """
+        from claims import StepsClaimsDb
+        claims = StepsClaimsDb(self.claimsFile)
+        claims.addSteps(steps)
+        wait = self.MIN_WAIT
+        lastStatus, lastChange = None, time.time()
+
+        while True:
+            indexes, status = claims.claim(self.taskId,
+                                           lambda st: self._selectSteps(steps, st))
+            for i in indexes:
+                step = steps[i - 1]
+                step.setRunning()
+                stepStartedCallback(step)
+                step.run()
+                claims.setDone(i, step.getStatus(),
+                               initTime=step.initTime.get(),
+                               endTime=step.endTime.get(),
+                               resultFiles=step._resultFiles.get(),
+                               profile=step.getProfile())
+                stepFinishedCallback(step)
+
+            if indexes:
+                wait = self.MIN_WAIT
+                lastChange = time.time()
+            elif not self._isWaiting(steps, status):
                 break
+            else:
+                if status != lastStatus:
+                    lastStatus, lastChange = status, time.time()
+                elif time.time() - lastChange > self.maxWait:
+                    break
+                time.sleep(wait)
+                wait = min(2 * wait, self.MAX_WAIT)
 
-            # If there are available nodes, send next runnable step.
-            with sharedLock:
-                if freeNodes:
-                    step = getRunnable()
-                    if step is not None:
-                        # We found a step to work in, so let's start a new
-                        # thread to do the job and book it.
-                        step.setRunning()
-                        stepStartedCallback(step)
-                        node = freeNodes.pop()  # take an available node
-                        runningSteps[node] = step
-                        t = StepThread(node, step, sharedLock)
-                        t.daemon = True  # won't keep process up if main thread ends
-                        t.start()
-                    elif not any(s.isRunning() for s in steps):  # nothing running
-                        break  # yeah, we are done, either failed or finished :)
-
-            time.sleep(0.1)  # be gentle on the main thread
-
-        # Wait for all threads now.
-        for t in threading.enumerate():
-            if t is not threading.current_thread():
-                t.join()
+        claims.close()
 
 
 class MPIStepExecutor(ThreadStepExecutor):
     """ Run steps in parallel using threads.
     But call runJob through MPI workers.
     """
-    def __init__(self, hostConfig, nMPI, comm):
-        ThreadStepExecutor.__init__(self, hostConfig, nMPI)
+    def __init__(self, hostConfig, nMPI, comm, maxCores=None, maxMemory=None,
+                 pipeline=2):
+        """
+        Params:
+            nMPI: number of MPI workers.
+            pipeline: number of steps that can send jobs to the same
+                worker, so a job is already waiting in the worker
+                when the previous one finishes. The workers only
+                receive the next job while running one, so the jobs
+                of bigger pipelines could timeout waiting to be sent.
+        """
+        # The cores are counted per worker, the queued jobs
+        # do not use them until the running ones finish
+        if maxCores is not None:
+            maxCores *= pipeline
+        ThreadStepExecutor.__init__(self, hostConfig, nMPI * pipeline,
+                                    maxCores, maxMemory)
+        self.numberOfMpi = nMPI
         self.comm = comm
     
     def runJob(self, log, programName, params,
                numberOfMpi=1, numberOfThreads=1, env=None, cwd=None):
         # Import mpi here so if MPI4py was not properly compiled
         # we can still run in parallel with threads.
-        from pyworkflow.utils.mpi import runJobMPI
-        node = threading.current_thread().thId + 1
+        from pyworkflow.utils.mpi import runJobMPI, TAG_JOB_DONE
+        thId = threading.current_thread().thId
+        node = thId % self.numberOfMpi + 1
         runJobMPI(programName, params, self.comm, node,
-                  numberOfMpi, hostConfig=self.hostConfig, env=env, cwd=cwd)
+                  numberOfMpi, hostConfig=self.hostConfig, env=env, cwd=cwd,
+                  replyTag=TAG_JOB_DONE + thId)
 
-    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback):
-        ThreadStepExecutor.runSteps(self, steps, stepStartedCallback, stepFinishedCallback)
+    def runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                 stepsCheckCallback=None, stepsCheckSecs=5):
+        ThreadStepExecutor.runSteps(self, steps, stepStartedCallback, stepFinishedCallback,
+                                    stepsCheckCallback, stepsCheckSecs)
 
         # Import mpi here so if MPI4py was not properly compiled
         # we can still run in parallel with threads.
@@ -184,5 +656,5 @@ class MPIStepExecutor(ThreadStepExecutor):
 
         # Send special command 'None' to MPI slaves to notify them
         # that there are no more jobs to do and they can finish.
-        for node in range(1, self.numberOfProcs+1):
+        for node in range(1, self.numberOfMpi+1):
             self.comm.send('None', dest=node, tag=(TAG_RUN_JOB+node))
@@ -119,7 +119,10 @@ def _launchLocal(protocol, wait, stdin=None, stdout=None, stderr=None):
         submitDict = hostConfig.getQueuesDefault()
         submitDict.update(protocol.getSubmitDict())
         submitDict['JOB_COMMAND'] = command
-        jobId = _submit(hostConfig, submitDict)
+        if int(submitDict.get('JOB_ARRAY_TASKS', 0) or 0) > 0:
+            jobId = _submitArray(protocol, hostConfig, submitDict)
+        else:
+            jobId = _submit(hostConfig, submitDict)
     else:
         jobId = _run(command, wait, stdin, stdout, stderr)
 
@@ -185,8 +188,60 @@ def _copyFiles(protocol, rpath):
         rpath.putFile(f, remoteFile)
 
 
-def _submit(hostConfig, submitDict):
+def _submitArray(protocol, hostConfig, submitDict):
+    """ Submit the steps of a protocol as an array job with
+    JOB_ARRAY_TASKS tasks, each one running blocks of the steps
+    (see ArrayStepExecutor), and the usual protocol run as a job
+    that depends on it, to run the remaining steps.
+    Return the job ids of both jobs (separated by a space).
+    """
+    if not hostConfig.getQueueSystem().hasArrayJobs():
+        print redStr("** Array jobs are not configured for this host, "
+                     "submitting a single job.")
+        return _submit(hostConfig, submitDict)
+    
+    if not protocol.stepsInProcesses:
+        print redStr("** The steps of %s can not be run in other processes, "
+                     "submitting a single job." % protocol.getClassName())
+        return _submit(hostConfig, submitDict)
+    
+    if protocol.hasStreamingInput():
+        print redStr("** The input of %s is still being produced, "
+                     "submitting a single job." % protocol.getClassName())
+        return _submit(hostConfig, submitDict)
+    
+    from claims import StepsClaimsDb
+    claimsFn = protocol.getStepsClaimsFile()
+    if os.path.exists(claimsFn):
+        # Steps finished by a previous array job are not run again
+        claims = StepsClaimsDb(claimsFn)
+        claims.resetUnfinished()
+        claims.close()
+    
+    nTasks = int(submitDict['JOB_ARRAY_TASKS'])
+    arrayDict = dict(submitDict)
+    arrayDict['JOB_SCRIPT'] = submitDict['JOB_SCRIPT'].replace('.job', '_array.job')
+    arrayDict['JOB_NAME'] = submitDict['JOB_NAME'] + '_array'
+    arrayDict['JOB_ARRAY_SIZE'] = nTasks
+    arrayDict['JOB_COMMAND'] = '%s %s runprotocol pw_protocol_array.py "%s" "%s" %s %s %d' % (
+        os.environ['SCIPION_PYTHON'],
+        os.path.join(os.environ['SCIPION_HOME'], 'scipion'),
+        protocol.getProject().path, protocol.getDbPath(), protocol.strId(),
+        hostConfig.getArrayTaskId(), nTasks)
+    arrayJobId = _submit(hostConfig, arrayDict, hostConfig.getSubmitArrayCommand())
+    
+    if arrayJobId == UNKNOWN_JOBID:
+        return _submit(hostConfig, submitDict)
+    
+    submitDict['JOB_DEPENDENCY'] = arrayJobId
+    jobId = _submit(hostConfig, submitDict, hostConfig.getSubmitDependentCommand())
+
+    return '%s %s' % (jobId, arrayJobId)
+    
+    
+def _submit(hostConfig, submitDict, submitCommand=None):
     """ Submit a protocol to a queue system. Return its job id.
+    If submitCommand is None, the host submit command will be used.
     """
     # Create forst the submission script to be launched
     # formatting using the template
@@ -202,7 +257,7 @@ def _submit(hostConfig, submitDict):
     f.close()
     # This should format the command using a template like: 
     # "qsub %(JOB_SCRIPT)s"
-    command = hostConfig.getSubmitCommand() % submitDict
+    command = (submitCommand or hostConfig.getSubmitCommand()) % submitDict
     gcmd = greenStr(command)
     print "** Submiting to queue: '%s'" % gcmd
     p = Popen(command, shell=True, stdout=PIPE)
@@ -235,10 +290,11 @@ def _run(command, wait, stdin=None, stdout=None, stderr=None):
 def _stopLocal(protocol):
     
     if protocol.useQueue():     
-        jobId = protocol.getJobId()        
         host = protocol.getHostConfig()
-        cancelCmd = host.getCancelCommand() % {'JOB_ID': jobId}
-        _run(cancelCmd, wait=True)
+        # There could be several jobs (see _submitArray)
+        for jobId in str(protocol.getJobId()).split():
+            cancelCmd = host.getCancelCommand() % {'JOB_ID': jobId}
+            _run(cancelCmd, wait=True)
     else:
         process.killWithChilds(protocol.getPid())
 
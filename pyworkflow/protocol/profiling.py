@@ -0,0 +1,112 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+This module summarizes the resources used by the steps of a protocol
+(see FunctionStep.getProfile), to find which steps take most of the
+time and if they are cpu, memory or io bound.
+"""
+
+from collections import OrderedDict
+
+from pyworkflow.utils import prettySize
+from constants import PROFILE_KEYS
+
+
+def _getProfile(step):
+    """ Return the step profile with 0 for the missing values,
+    (e.g. the step has not run yet).
+    """
+    return dict((k, v or 0) for k, v in step.getProfile().iteritems())
+
+
+def getHotSteps(steps, n=10, key='wallTime'):
+    """ Return the n steps with highest value of key
+    (one of PROFILE_KEYS), as a list of (step, profile).
+    """
+    profiles = [(s, _getProfile(s)) for s in steps
+                if s.wallTime.hasValue()]
+    profiles.sort(key=lambda sp: sp[1][key], reverse=True)
+    return profiles[:n]
+
+
+def getFunctionsProfile(steps):
+    """ Aggregate the profile of the steps by function name.
+    Returns:
+        an OrderedDict {funcName: profile}, sorted by total wall time,
+        where the profile has the sum of the values of the steps, except
+        for maxRss that is the maximum, plus 'count' (number of steps).
+    """
+    functions = {}
+    for step in steps:
+        if not step.wallTime.hasValue():
+            continue
+        profile = _getProfile(step)
+        funcName = step.funcName.get()
+        if funcName not in functions:
+            functions[funcName] = dict((k, 0) for k in PROFILE_KEYS)
+            functions[funcName]['count'] = 0
+        agg = functions[funcName]
+        agg['count'] += 1
+        for k in PROFILE_KEYS:
+            if k == 'maxRss':
+                agg[k] = max(agg[k], profile[k])
+            else:
+                agg[k] += profile[k]
+
+    return OrderedDict(sorted(functions.iteritems(),
+                              key=lambda fp: fp[1]['wallTime'], reverse=True))
+
+
+def _formatRow(name, count, profile):
+    cpu = profile['cpuUser'] + profile['cpuSystem']
+    return '%-30s %6s %10.2f %10.2f %6d%% %10s %10s %10s' % (
+        name[:30], count, profile['wallTime'], cpu,
+        100 * cpu / profile['wallTime'] if profile['wallTime'] else 0,
+        prettySize(profile['maxRss']) or '',
+        prettySize(profile['readBytes']) or '',
+        prettySize(profile['writeBytes']) or '')
+
+
+def formatStepsProfile(steps, n=10):
+    """ Return the lines of a report with the n steps that took
+    most wall time and the aggregated values by function.
+    CPU% above 100 means that more than one core was used
+    and much below 100 that the step was waiting (e.g. for io).
+    """
+    header = '%-30s %6s %10s %10s %7s %10s %10s %10s' % (
+        '', 'STEPS', 'WALL (s)', 'CPU (s)', 'CPU%', 'MAX RSS', 'READ', 'WRITTEN')
+    lines = ['Hot steps (by wall time):', header.replace('STEPS', 'INDEX')]
+
+    for step, profile in getHotSteps(steps, n):
+        # Steps loaded from the database have no index, but their id
+        index = step.getIndex() or step.getObjId()
+        lines.append(_formatRow(step.funcName.get(), index, profile))
+
+    lines += ['', 'Functions (by total wall time):', header]
+    for funcName, profile in getFunctionsProfile(steps).iteritems():
+        lines.append(_formatRow(funcName, profile['count'], profile))
+
+    return lines
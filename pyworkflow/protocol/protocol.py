@@ -30,9 +30,12 @@ execution and tracking like: Step and Protocol
 
 import os
 import sys
+import time
+import threading
 import datetime as dt
 import pickle
 import json
+import hashlib
 from collections import OrderedDict
 
 import pyworkflow as pw
@@ -41,7 +44,9 @@ from pyworkflow.utils import redStr, greenStr, magentaStr, envVarOn, runJob
 from pyworkflow.utils.path import (makePath, join, missingPaths, cleanPath, cleanPattern,
                                    getFiles, exists, renderTextFile, copyFile)
 from pyworkflow.utils.log import ScipionLogger
-from executor import StepExecutor, ThreadStepExecutor, MPIStepExecutor
+from pyworkflow.utils.profiler import Profiler
+from executor import (StepExecutor, ThreadStepExecutor, ProcessStepExecutor,
+                      MPIStepExecutor, ArrayStepExecutor)
 from constants import *
 from params import Form
 import scipion
@@ -64,6 +69,13 @@ class Step(OrderedObject):
         self.interactive = Boolean(False)
         self._resultFiles = String()
         self._index = None
+        # If True, the step should not be run in a different process
+        # than the protocol one (see ProcessStepExecutor)
+        self._mainProcess = False
+        # Cores and memory (in MB) required to run the step, used by
+        # the parallel executors to decide how many steps can be run
+        self._cores = 1
+        self._memory = 0
 
     def getIndex(self):
         return self._index
@@ -160,6 +172,25 @@ class Step(OrderedObject):
     def isInteractive(self):
         return self.interactive.get()
 
+    def setMainProcess(self, value):
+        self._mainProcess = value
+
+    def isMainProcess(self):
+        return self._mainProcess
+    
+    def setResources(self, cores=1, memory=0):
+        """ Set the number of cores and memory (in MB) that the step
+        requires to run, when running steps in parallel.
+        """
+        self._cores = max(1, int(cores))
+        self._memory = max(0, int(memory))
+        
+    def getCores(self):
+        return self._cores
+    
+    def getMemory(self):
+        return self._memory
+
     def run(self):
         """ Do the job of this step"""
         self.setRunning() 
@@ -201,14 +232,68 @@ class FunctionStep(Step):
         self.funcName = String(funcName)
         self.argsStr = String(pickle.dumps(funcArgs))
         self.setInteractive(kwargs.get('interactive', False))
+        self.setMainProcess(kwargs.get('mainProcess', False))
+        self.setResources(kwargs.get('cores', 1), kwargs.get('memory', 0))
+        # (StepsCache, protocol) if the step is cacheable, in a tuple
+        # so the protocol is not stored as an attribute of the step
+        self._cache = None
+        # Resources used by the last run of the step (see Profiler)
+        self.wallTime = Float()
+        self.cpuUser = Float()
+        self.cpuSystem = Float()
+        self.maxRss = Integer()
+        self.readBytes = Integer()
+        self.writeBytes = Integer()
+        
+    def setProfile(self, **profile):
+        """ Set the resources used by the step, with the keys
+        returned by Profiler.stop (e.g. wallTime, maxRss).
+        """
+        for key, value in profile.iteritems():
+            getattr(self, key).set(value)
+            
+    def getProfile(self):
+        """ Return a dict with the resources used by the step. """
+        return dict((key, getattr(self, key).get())
+                    for key in PROFILE_KEYS)
+        
+    def setCache(self, cache, protocol):
+        """ Set the StepsCache used to restore the results of
+        this step, instead of running it, if already computed.
+        """
+        self._cache = (cache, protocol)
         
     def _runFunc(self):
         """ Return the possible result files after running the function. """
         return self._func(*self._args)
 
     def _run(self):
-        """ Run the function and check the result files if any. """
-        resultFiles = self._runFunc() 
+        """ Run the function measuring the resources used. """
+        profiler = Profiler()
+        profiler.start()
+        try:
+            self._runWithCache()
+        finally:
+            self.setProfile(**profiler.stop())
+
+    def _runWithCache(self):
+        """ Run the function and check the result files if any.
+        If a cache is set, the result files are restored from it
+        when possible, or stored there after running the function.
+        """
+        key = None
+        resultFiles = None
+        if self._cache is not None:
+            cache, protocol = self._cache
+            workingDir = protocol.getWorkingDir()
+            key = cache.getStepKey(protocol, self)
+            resultFiles = cache.restore(key, workingDir)
+            
+        if resultFiles is None:
+            resultFiles = self._runFunc()
+        else:
+            key = None # Restored from cache, nothing to store
+            
         if isinstance(resultFiles, basestring):
             resultFiles = [resultFiles]
         if resultFiles and len(resultFiles):
@@ -216,6 +301,10 @@ class FunctionStep(Step):
             if len(missingFiles):
                 raise Exception('Missing filePaths: ' + ' '.join(missingFiles))
             self._resultFiles.set(pickle.dumps(resultFiles))
+            if key is not None:
+                cache.store(key, workingDir, resultFiles,
+                            protocol=protocol.getClassName(),
+                            funcName=self.funcName.get())
     
     def _postconditions(self):
         """ This type of Step, will simply check
@@ -265,6 +354,10 @@ class RunJobStep(FunctionStep):
         return self._args[0] # return program name         
                 
                 
+# Used to record the items done by _runItemsStep
+_itemsLock = threading.Lock()
+
+        
 class StepSet(Set):
     """ Special type of Set for storing steps. """
     def __init__(self, filename=None, prefix='', 
@@ -323,6 +416,35 @@ class Protocol(Step):
         # Maybe this property can be inferred from the 
         # prerequisites of steps, but is easier to keep it
         self.stepsExecutionMode = STEPS_SERIAL
+        # If True, parallel steps will be run in processes instead
+        # of threads, useful for steps doing heavy work in Python
+        # (see ProcessStepExecutor)
+        self.stepsInProcesses = False
+        # Changes in the steps status are written to the steps database
+        # in a single transaction every stepsFlushInterval seconds or
+        # stepsFlushCount changes (see _stepStarted and _stepFinished)
+        self.stepsFlushInterval = float(os.environ.get('SCIPION_STEPS_FLUSH_INTERVAL', 2))
+        self.stepsFlushCount = int(os.environ.get('SCIPION_STEPS_FLUSH_COUNT', 100))
+        # Number of items processed in each step inserted by
+        # _insertItemsSteps, if None it is computed from the
+        # number of items and parallel workers
+        self.itemsChunkSize = None
+        # Protocols with a streaming input (see hasStreamingInput) check
+        # every stepsCheckSecs seconds if there are new steps to run
+        # (see _stepsCheck)
+        self.stepsCheckSecs = float(os.environ.get('SCIPION_STEPS_CHECK_SECS', 5))
+        # Last id of the input items with steps inserted by
+        # _insertNewItemsSteps, for each step function
+        self._lastItemsIds = {}
+        # (funcName, itemsIds) of the steps inserted by
+        # _insertNewItemsSteps, by step index (see _itemsDone)
+        self._itemsStepsIds = {}
+        self._pendingSteps = OrderedDict()
+        self._lastStepsFlush = 0
+        self._stepsDoneChanged = False
+        # Lock to write the steps, they are also flushed from
+        # other thread while a step is running (see _runSteps)
+        self._stepsLock = threading.RLock()
         
         # Run mode
         self.runMode = Integer(kwargs.get('runMode', MODE_RESUME))
@@ -369,6 +491,38 @@ class Protocol(Step):
             
         self._storeAttributes(self._outputs, kwargs)
         
+    def _updateOutputSet(self, outputName, outputSet, state=Set.STREAM_OPEN):
+        """ Define or update an output set that is produced in streaming,
+        so other protocols can process its items while it is filled.
+        The set is written with the given stream state, that should be
+        Set.STREAM_CLOSED after appending the last items.
+        Before appending items to a set that was updated before (e.g.
+        in a previous step), enableAppend should be called on it.
+        """
+        outputSet.setStreamState(state)
+        outputSet.write()
+        
+        if hasattr(self, outputName):
+            outputAttr = getattr(self, outputName)
+            # Keep the updated properties (e.g. size and stream state)
+            # in the object that is stored as output of the protocol
+            if outputAttr is not outputSet:
+                outputAttr.copy(outputSet, copyId=False)
+            self._store(outputAttr)
+        else:
+            self._defineOutputs(**{outputName: outputSet})
+            self._store(outputSet)
+        
+    def hasStreamingInput(self):
+        """ Return True if some of the input sets is open, i.e.
+        still being produced by other protocol (see Set.STREAM_OPEN).
+        """
+        for _, attr in self.iterInputAttributes():
+            obj = attr.get()
+            if isinstance(obj, Set) and obj.isStreamOpen():
+                return True
+        return False
+        
     def getProject(self):
         return self.__project
     
@@ -623,7 +777,17 @@ class Protocol(Step):
          Params:
            funcName: the string name of the function to be run in the Step.
            *funcArgs: the variable list of arguments to pass to the function.
-           **kwargs: see __insertStep
+           **kwargs: see __insertStep, also 'interactive' and 'mainProcess',
+               the last one should be True if the step can not be run in
+               other process (e.g. it defines outputs, see ProcessStepExecutor).
+               If 'cacheable' is True, the step results can be taken from
+               the project steps cache (see getStepsCache), so the
+               step should only write the files it returns and they
+               should only depend on the step arguments, the protocol
+               params and the protocol input files.
+               'cores' and 'memory' (in MB) are the resources needed by
+               the step when running steps in parallel (see Step.setResources),
+               runJob will use 'cores' threads by default in these steps.
         """
         # Get the function give its name
         func = getattr(self, funcName, None)
@@ -635,6 +799,11 @@ class Protocol(Step):
             raise Exception("Protocol._insertFunctionStep: '%s' is not callable" % funcName)
         step = FunctionStep(func, funcName, *funcArgs, **kwargs)
         
+        if kwargs.get('cacheable', False):
+            cache = self.getStepsCache()
+            if cache is not None:
+                step.setCache(cache, self)
+        
         return self.__insertStep(step, **kwargs)
         
     def _insertRunJobStep(self, progName, progArguments, resultFiles=[], **kwargs):
@@ -643,6 +812,111 @@ class Protocol(Step):
         """
         return self._insertFunctionStep('runJob', progName, progArguments, **kwargs)
     
+    def _insertItemsSteps(self, funcName, itemsArgs, chunkSize=None,
+                          itemsIds=None, **kwargs):
+        """ Insert the steps to call a function for each item (e.g.
+        each micrograph), grouping the items in chunks, with one step
+        for each chunk instead of one step for each item.
+        The finished items (and their result files) are recorded, so
+        they are not processed again when the protocol is resumed.
+        Params:
+            funcName: name of the function called as func(*args) for each item.
+            itemsArgs: list with the arguments of each item.
+            chunkSize: number of items in each step, if None, itemsChunkSize
+                or a size computed from the items and workers is used.
+            itemsIds: ids of the items, if given, they will be passed
+                to _itemsDone when the step of each item finishes.
+            **kwargs: see _insertFunctionStep.
+        Returns:
+            the list with the ids of the inserted steps.
+        """
+        itemsArgs = [tuple(args) for args in itemsArgs]
+        n = len(itemsArgs)
+        chunkSize = chunkSize or self.itemsChunkSize or self._getItemsChunkSize(n)
+        stepsIds = []
+        
+        for i in range(0, n, chunkSize):
+            stepId = self._insertFunctionStep('_runItemsStep', funcName,
+                                              itemsArgs[i:i+chunkSize], **kwargs)
+            if itemsIds is not None:
+                self._itemsStepsIds[stepId] = (funcName, itemsIds[i:i+chunkSize])
+            stepsIds.append(stepId)
+            
+        return stepsIds
+        
+    def _insertNewItemsSteps(self, inputSet, funcName, itemArgsFunc, **kwargs):
+        """ Insert the steps (see _insertItemsSteps) for the items of
+        inputSet added since the last call with the same funcName.
+        This is used to process the new items of streaming input sets.
+        Params:
+            inputSet: the set whose items will be processed.
+            funcName: name of the function called for each item.
+            itemArgsFunc: function that returns the arguments
+                of funcName for a given item.
+            **kwargs: see _insertItemsSteps.
+        Returns:
+            the list with the ids of the inserted steps.
+        """
+        lastId = self._lastItemsIds.get(funcName, 0)
+        itemsArgs = []
+        itemsIds = []
+        
+        for item in inputSet.iterItems(where='id > %d' % lastId):
+            itemsArgs.append(itemArgsFunc(item))
+            lastId = item.getObjId()
+            itemsIds.append(lastId)
+        self._lastItemsIds[funcName] = lastId
+        
+        if not itemsArgs:
+            return []
+        return self._insertItemsSteps(funcName, itemsArgs,
+                                      itemsIds=itemsIds, **kwargs)
+        
+    def _getItemsChunkSize(self, n):
+        """ Return the number of items in each step for n items, so
+        there are at least ITEMS_CHUNKS_PER_WORKER steps for each parallel
+        worker (to balance the load) and at most ITEMS_MAX_CHUNK_SIZE
+        items in each step (to have a reasonable progress).
+        """
+        workers = max(self.numberOfThreads.get(), self.numberOfMpi.get(), 1)
+        size = -(-n // (ITEMS_CHUNKS_PER_WORKER * workers)) # ceil
+        return max(1, min(size, ITEMS_MAX_CHUNK_SIZE))
+    
+    def _getItemsDoneFile(self, funcName):
+        return self._getLogsPath('items_%s.done' % funcName.strip('_'))
+    
+    def _runItemsStep(self, funcName, itemsArgs):
+        """ Step inserted by _insertItemsSteps, call the function for
+        the items not done yet and record them as done.
+        """
+        func = getattr(self, funcName)
+        doneFn = self._getItemsDoneFile(funcName)
+        done = {} # key -> result files of the item
+        if exists(doneFn):
+            with open(doneFn) as f:
+                for line in f:
+                    values = line.rstrip('\n').split('\t')
+                    done[values[0]] = values[1:]
+        resultFiles = []
+        
+        for args in itemsArgs:
+            key = hashlib.md5(pickle.dumps(args)).hexdigest()
+            if key in done:
+                # The files of the items done are also returned, so
+                # the step results are complete when resuming
+                resultFiles.extend(done[key])
+                continue
+            result = func(*args)
+            if isinstance(result, basestring):
+                result = [result]
+            result = list(result or [])
+            resultFiles.extend(result)
+            with _itemsLock: # Items can be done by several threads
+                with open(doneFn, 'a') as f:
+                    f.write('\t'.join([key] + result) + '\n')
+                    
+        return resultFiles or None
+        
     def _insertCopyFileStep(self, sourceFile, targetFile, **kwargs):
         """ Shortcut function to insert an step for copying a file to a destiny. """
         step = FunctionStep(copyFile, 'copyFile', sourceFile, targetFile, **kwargs)
@@ -743,6 +1017,43 @@ class Protocol(Step):
             
         return n
     
+    def __copyArraySteps(self, startIndex):
+        """ Set as finished the steps done by the tasks of a queue
+        array job (see ArrayStepExecutor), so they are not run again.
+        Return the index of the first step not finished from startIndex.
+        """
+        claimsFn = self.getStepsClaimsFile()
+        if not exists(claimsFn):
+            return startIndex
+        
+        from claims import StepsClaimsDb, getStepKey
+        claims = StepsClaimsDb(claimsFn)
+        finished = claims.getFinished()
+        claims.close()
+        copied = 0
+        
+        for i, step in enumerate(self._steps):
+            if step.isFinished() or (i + 1) not in finished:
+                continue
+            key, _, info = finished[i + 1]
+            if key != getStepKey(step):
+                continue
+            step._resultFiles.set(info['resultFiles'])
+            if step._postconditions():
+                step.initTime.set(info['initTime'])
+                step.endTime.set(info['endTime'])
+                step.setProfile(**info['profile'])
+                step.setStatus(STATUS_FINISHED)
+                copied += 1
+            else:
+                step._resultFiles.set(None)
+        
+        if copied:
+            self.info(" %d steps were done by queue array tasks." % copied)
+        while startIndex < len(self._steps) and self._steps[startIndex].isFinished():
+            startIndex += 1
+        return startIndex
+    
     def __storeSteps(self):
         """ Store the new steps list that can be retrieved 
         in further execution of this protocol.
@@ -760,10 +1071,82 @@ class Protocol(Step):
 
         self._stepsSet.write()
         
-    def __updateStep(self, step):
-        """ Store a given step and write changes. """
-        self._stepsSet.update(step)
-        self._stepsSet.write()
+    def __updateStep(self, step, flush=False):
+        """ Keep the changes of a given step to be written later.
+        All pending changes are written together if flush is True,
+        or if the flush interval or count have been reached.
+        """
+        with self._stepsLock:
+            self._pendingSteps[step.getObjId()] = step
+            
+            if (flush or len(self._pendingSteps) >= self.stepsFlushCount or
+                time.time() - self._lastStepsFlush >= self.stepsFlushInterval):
+                self._flushSteps()
+            
+    def _flushSteps(self, storeProtocol=True):
+        """ Write the pending steps changes in a single transaction
+        and, if storeProtocol is True, the number of steps done.
+        """
+        with self._stepsLock:
+            if self._pendingSteps:
+                for step in self._pendingSteps.itervalues():
+                    self._stepsSet.update(step)
+                self._stepsSet.write(properties=False)
+                self._pendingSteps.clear()
+                self._stepsDoneChanged = True
+            if storeProtocol and self._stepsDoneChanged:
+                self._store(self._stepsDone)
+                self._stepsDoneChanged = False
+            self._lastStepsFlush = time.time()
+            
+    def __flushStepsLoop(self, stopEvent):
+        """ Flush the pending steps changes every stepsFlushInterval,
+        so they are written even while a long step is running.
+        Only the steps db is written here, the protocol db could
+        be in use by the step (the number of steps done is stored
+        with the next flush done when a step starts or finishes).
+        """
+        while not stopEvent.wait(self.stepsFlushInterval):
+            with self._stepsLock:
+                if (time.time() - self._lastStepsFlush >=
+                    self.stepsFlushInterval):
+                    self._flushSteps(storeProtocol=False)
+        
+    def _stepsCheck(self):
+        """ This function is called every stepsCheckSecs while running
+        the steps of a protocol with streaming input (see hasStreamingInput).
+        It should insert the steps for the new input items (e.g. with
+        _insertNewItemsSteps) and return True while the input is still
+        open, i.e. more steps could be inserted later. The steps that
+        need all items (e.g. creating the outputs) should be inserted
+        when the input is closed.
+        """
+        return False
+        
+    def _itemsDone(self, funcName, itemsIds):
+        """ This function is called (in the main process) when a step
+        inserted with _insertNewItemsSteps finishes, with the ids of
+        the input items processed by it. Protocols producing their
+        outputs in streaming can update them here (see _updateOutputSet).
+        """
+        pass
+        
+    def __stepsCheck(self):
+        """ Call _stepsCheck and store the steps inserted by it. """
+        n = len(self._steps)
+        doCheck = self._stepsCheck()
+        
+        if len(self._steps) > n:
+            with self._stepsLock:
+                for step in self._steps[n:]:
+                    self.setInteractive(self.isInteractive() or step.isInteractive())
+                    self._stepsSet.append(step)
+                self._stepsSet.write(properties=False)
+                self._numberOfSteps.set(len(self._steps))
+                self._store(self._numberOfSteps)
+            self.info(" %d new steps inserted." % (len(self._steps) - n))
+            
+        return doCheck
         
     def _stepStarted(self, step):
         """This function will be called whenever an step
@@ -789,9 +1172,13 @@ class Protocol(Step):
             self.error(errorMsg)
         self.lastStatus = step.getStatus()
         
-        self.__updateStep(step)
         self._stepsDone.increment()
-        self._store(self._stepsDone)
+        # Always write if the run stops here, so resuming it
+        # later will start from the proper step
+        self.__updateStep(step, flush=not doContinue)
+        
+        if step.isFinished() and step._index in self._itemsStepsIds:
+            self._itemsDone(*self._itemsStepsIds.pop(step._index))
         
         self.info(magentaStr(step.getStatus().upper()) + ": %s, step %d" %
                   (step.funcName.get(), step._index))
@@ -812,12 +1199,28 @@ class Protocol(Step):
         self.runMode.set(MODE_RESUME) # Always set to resume, even if set to restart
         self._store()
         
-        if startIndex == len(self._steps):
+        # Protocols with streaming input will be checking
+        # for new steps until the input is closed
+        stepsCheck = self.__stepsCheck if self.hasStreamingInput() else None
+        
+        if startIndex == len(self._steps) and stepsCheck is None:
             self.lastStatus = STATUS_FINISHED
             self.info("All steps seems to be FINISHED, nothing to be done.")
         else:
             self.lastStatus = self.status.get()
-            self._stepsExecutor.runSteps(self._steps, self._stepStarted, self._stepFinished)
+            stopFlush = threading.Event()
+            flushThread = threading.Thread(target=self.__flushStepsLoop,
+                                           args=(stopFlush,))
+            flushThread.daemon = True
+            flushThread.start()
+            try:
+                self._stepsExecutor.runSteps(self._steps, self._stepStarted,
+                                             self._stepFinished, stepsCheck,
+                                             self.stepsCheckSecs)
+            finally:
+                stopFlush.set()
+                flushThread.join()
+                self._flushSteps()
         
         self.setStatus(self.lastStatus)
         self._store(self.status)
@@ -930,6 +1333,7 @@ class Protocol(Step):
         self._insertAllSteps() # Define steps for execute later
         #self._makePathsAndClean() This is done now in project
         startIndex = self.__findStartingStep() # Find at which step we need to start
+        startIndex = self.__copyArraySteps(startIndex)
         self.info(" Starting at step: %d" % (startIndex + 1))
         self.__storeSteps() 
         self.info(" Running steps ")
@@ -948,8 +1352,11 @@ class Protocol(Step):
             kwargs['numberOfMpi'] = kwargs.get('numberOfMpi', self.numberOfMpi.get())
             kwargs['numberOfThreads'] = kwargs.get('numberOfThreads', self.numberOfThreads.get())
         else:
+            # Use the cores requested by the step running in this thread
+            step = getattr(threading.current_thread(), 'step', None)
             kwargs['numberOfMpi'] = kwargs.get('numberOfMpi', 1)
-            kwargs['numberOfThreads'] = kwargs.get('numberOfThreads', 1)
+            kwargs['numberOfThreads'] = kwargs.get('numberOfThreads',
+                                                   step.getCores() if step else 1)
         if 'env' not in kwargs:
             #self._log.info("calling self._getEnviron...")
             kwargs['env'] = self._getEnviron()
@@ -1031,6 +1438,12 @@ class Protocol(Step):
     def getStepsFile(self):
         """ Return the steps.sqlite file under logs directory. """
         return self._getLogsPath('steps.sqlite')
+    
+    def getStepsClaimsFile(self):
+        """ Return the db with the steps claimed by the tasks
+        of a queue array job (see ArrayStepExecutor).
+        """
+        return self._getLogsPath('steps_claims.sqlite')
 
     def __openLogsFiles(self, mode):
         self.__fOut = open(self.getLogPaths()[0], mode)
@@ -1113,14 +1526,27 @@ class Protocol(Step):
             
         self._stepsExecutor = executor
                 
-    def getFiles(self):
-        resultFiles = set()
+    def getInputFiles(self):
+        """ Return the files of the objects pointed by the input params. """
+        inputFiles = set()
         for paramName, _ in self.getDefinition().iterPointerParams():
             attrPointer = getattr(self, paramName) # Get all self attribute that are pointers
             obj = attrPointer.get() # Get object pointer by the attribute
             if hasattr(obj, 'getFiles'):
-                resultFiles.update(obj.getFiles()) # Add files if any
-        return resultFiles | getFiles(self.workingDir.get())
+                inputFiles.update(obj.getFiles()) # Add files if any
+        return inputFiles
+    
+    def getFiles(self):
+        return self.getInputFiles() | getFiles(self.workingDir.get())
+    
+    def getStepsCache(self):
+        """ Return the steps cache of the project or None
+        if it is not enabled (see Project.getStepsCache).
+        """
+        project = self.getProject()
+        if project is None:
+            return None
+        return project.getStepsCache()
 
     def getHostName(self):
         """ Get the execution host name """
@@ -1160,8 +1586,11 @@ class Protocol(Step):
     def getClassPackage(cls):
         """ Return the package module to which this protocol belongs
         """
-        import pyworkflow.em as em
-        em.getProtocols() # make sure the _package is set for each Protocol class
+        if '_package' not in cls.__dict__:
+            import pyworkflow.em as em
+            # Getting the class from the registry sets its _package,
+            # importing only the package where it is defined
+            em.getClassesDict().get(cls.__name__)
         return getattr(cls, '_package', scipion)
         
     @classmethod 
@@ -1530,6 +1959,7 @@ def runProtocolMain(projectPath, protDbPath, protId):
     protocol = getProtocolFromDb(projectPath, protDbPath, protId, chdir=True)
     
     hostConfig = protocol.getHostConfig()  
+    maxCores, maxMemory = _getStepsResources(protocol, hostConfig)
   
     # Create the steps executor
     executor = None
@@ -1544,9 +1974,19 @@ def runProtocolMain(projectPath, protDbPath, protId):
             retcode = runJob(None, prog, params,
                              numberOfMpi=protocol.numberOfMpi.get(), hostConfig=hostConfig)
             sys.exit(retcode)
+        elif (protocol.numberOfThreads > 1 and protocol.stepsInProcesses and
+              not protocol.hasStreamingInput()):
+            # The processes define the steps from the input items
+            # when they start, so they can not be used if new
+            # items (and steps) can be added while running
+            executor = ProcessStepExecutor(hostConfig,
+                                           protocol.numberOfThreads.get()-1,
+                                           projectPath, protDbPath, protId,
+                                           maxCores, maxMemory)
         elif protocol.numberOfThreads > 1:
             executor = ThreadStepExecutor(hostConfig,
-                                          protocol.numberOfThreads.get()-1) 
+                                          protocol.numberOfThreads.get()-1,
+                                          maxCores, maxMemory) 
     if executor is None:
         executor = StepExecutor(hostConfig)
     protocol.setStepsExecutor(executor)
@@ -1554,6 +1994,49 @@ def runProtocolMain(projectPath, protDbPath, protId):
     protocol.run()
     
     
+def runProtocolArrayTask(projectPath, protDbPath, protId, taskId, nTasks):
+    """ Entry point of each task of a queue array job. The protocol
+    steps are defined as when running it and the task runs the blocks
+    of them that it can claim (see ArrayStepExecutor). The protocol
+    is loaded in read only mode, since the steps status is only written
+    by the final task of the run.
+    """
+    protocol = getProtocolFromDb(projectPath, protDbPath, protId,
+                                 chdir=True, readOnly=True)
+    protocol._log = ScipionLogger(protocol.getLogPaths()[2])
+    executor = ArrayStepExecutor(protocol.getHostConfig(),
+                                 protocol.getStepsClaimsFile(), taskId, nTasks)
+    protocol.setStepsExecutor(executor)
+    protocol._insertAllSteps()
+    
+    def _stepStarted(step):
+        print magentaStr("STARTED") + ": %s, step %d (task %d)" % (step.funcName.get(),
+                                                                 step.getIndex(), taskId)
+    
+    def _stepFinished(step):
+        print magentaStr(step.getStatus().upper()) + ": %s, step %d (task %d)" % (
+            step.funcName.get(), step.getIndex(), taskId)
+        
+    executor.runSteps(protocol._steps, _stepStarted, _stepFinished)
+    
+    
+def _getStepsResources(protocol, hostConfig):
+    """ Return the cores and memory (in MB) that can be used by the
+    steps running in parallel: the protocol threads (or MPI) and
+    the host memory, limited by the maximum set in the host config.
+    """
+    if protocol.numberOfMpi > 1:
+        maxCores = protocol.numberOfMpi.get() - 1
+    else:
+        maxCores = protocol.numberOfThreads.get()
+    maxMemory = None
+    if hostConfig is not None:
+        if hostConfig.getMaxCores():
+            maxCores = min(maxCores, hostConfig.getMaxCores())
+        maxMemory = hostConfig.getMaxMemory()
+    return maxCores, maxMemory
+    
+    
 def runProtocolMainMPI(projectPath, protDbPath, protId, mpiComm):
     """ This function only should be called after enter in runProtocolMain
     and the proper MPI scripts have been started...so no validations 
@@ -1561,17 +2044,20 @@ def runProtocolMainMPI(projectPath, protDbPath, protId, mpiComm):
     """ 
     protocol = getProtocolFromDb(projectPath, protDbPath, protId, chdir=True)
     hostConfig = protocol.getHostConfig()
+    maxCores, maxMemory = _getStepsResources(protocol, hostConfig)
     # Create the steps executor
-    executor = MPIStepExecutor(hostConfig, protocol.numberOfMpi.get()-1, mpiComm)
+    executor = MPIStepExecutor(hostConfig, protocol.numberOfMpi.get()-1, mpiComm,
+                               maxCores, maxMemory)
     
     protocol.setStepsExecutor(executor)
     # Finally run the protocol
     protocol.run()        
     
      
-def getProtocolFromDb(projectPath, protDbPath, protId, chdir=False):
+def getProtocolFromDb(projectPath, protDbPath, protId, chdir=False, readOnly=False):
     """ Retrieve the Protocol object from a given .sqlite file
-    and the protocol id.
+    and the protocol id. If readOnly is True, the db will be opened
+    with a read only connection (e.g. to check a running protocol).
     """
     # We need this import here because from Project is imported
     # all from protocol indirectly, so if move this to the top
@@ -1589,7 +2075,7 @@ def getProtocolFromDb(projectPath, protDbPath, protId, chdir=False):
     from pyworkflow.project import Project
     project = Project(projectPath)
     project.load(dbPath=os.path.join(projectPath, protDbPath), chdir=chdir,
-                 loadAllConfig=False)     
+                 loadAllConfig=False, readOnlyDb=readOnly)     
     protocol = project.getProtocol(protId)
     return protocol
 
@@ -27,6 +27,7 @@
 # **************************************************************************
 
 import os
+from itertools import izip
 from pyworkflow.em.data import SetOfVolumes
 import unittest
 
@@ -584,6 +585,41 @@ class TestAlignment(TestConvertBase):
 
         self.launchTest('alignShiftRot', mList, alignType=ALIGN_2D)
 
+    def test_batchAlignment(self):
+        """ Check that reading and writing the alignment columns
+        of a metadata at once gives the same matrices and values
+        than converting each row.
+        """
+        n = 50
+        angles = np.random.uniform(-180, 180, (n, 3))
+        shifts = np.random.uniform(-20, 20, (n, 3))
+        flips = np.random.randint(0, 2, n).astype(bool)
+
+        for alignType in [ALIGN_2D, ALIGN_3D, ALIGN_PROJ]:
+            md = xmipp.MetaData()
+            for a, s, f in izip(angles, shifts, flips):
+                row = XmippMdRow()
+                row.setValue(xmipp.MDL_SHIFT_X, s[0])
+                row.setValue(xmipp.MDL_SHIFT_Y, s[1])
+                row.setValue(xmipp.MDL_SHIFT_Z, s[2])
+                row.setValue(xmipp.MDL_ANGLE_ROT, a[0])
+                row.setValue(xmipp.MDL_ANGLE_TILT, a[1])
+                row.setValue(xmipp.MDL_ANGLE_PSI, a[2])
+                row.setValue(xmipp.MDL_FLIP, bool(f))
+                row.writeToMd(md, md.addObject())
+
+            matrices = readAlignmentMatrices(md, alignType)
+            for row, m in izip(iterMdRows(md), matrices):
+                expected = rowToAlignment(row, alignType).getMatrix()
+                self.assertTrue(np.allclose(m, expected))
+
+            writeAlignmentMatrices(md, matrices, alignType)
+            for row, m in izip(iterMdRows(md), matrices):
+                expectedRow = XmippMdRow()
+                alignmentToRow(Transform(m.copy()), expectedRow, alignType)
+                for label, value in expectedRow:
+                    self.assertAlmostEqual(row.getValue(label), value, 4)
+
 
 class TestReconstruct(TestConvertBase):
     IS_ALIGNMENT = False
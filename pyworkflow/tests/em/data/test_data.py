@@ -8,6 +8,7 @@ from glob import glob, iglob
 import unittest
 import os, traceback
 from itertools import izip
+from collections import OrderedDict
 from pyworkflow.tests import *
 from pyworkflow.em.data import *
 from pyworkflow.utils.path import makePath
@@ -57,6 +58,63 @@ class TestImageHandler(unittest.TestCase):
         # Test that the new filename still exists even with the :mrc suffix
         self.assertTrue(ih.existsLocation(newFn))
 
+
+class TestImageHandlerMrc(BaseTest):
+    """ Check the ImageHandler operations done with
+    numpy on MRC files (without xmipp).
+    """
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_stack(self):
+        import pyworkflow.em.mrc as mrc
+        ih = ImageHandler()
+        stackFn = self.getOutputPath('images.mrcs')
+        images = np.random.rand(5, 16, 12).astype(np.float32)
+        for i, img in enumerate(images):
+            mrc.writeData(img, stackFn, i+1)
+
+        self.assertEqual((12, 16, 1, 5), ih.getDimensions(stackFn))
+        self.assertEqual((12, 16, 1, 1), ih.getDimensions((2, stackFn)))
+        self.assertTrue(np.allclose(images, ih.readData(stackFn)))
+        self.assertTrue(np.allclose(images[3], ih.readData((4, stackFn))))
+
+        # Stacks with .mrc extension are recognized from the header
+        outFn = self.getOutputPath('images_reversed.mrc')
+        ih.writeStack([(i, stackFn) for i in range(5, 0, -1)], outFn)
+        self.assertEqual((12, 16, 1, 5), ih.getDimensions(outFn))
+        self.assertTrue(np.allclose(images[::-1], ih.readData(outFn)))
+
+        outFn = self.getOutputPath('images_converted.mrcs')
+        ih.convertStack(stackFn, outFn)
+        self.assertTrue(np.allclose(images, ih.readData(outFn)))
+        ih.convert((1, stackFn), (6, outFn)) # enlarge the stack
+        self.assertEqual((12, 16, 1, 6), ih.getDimensions(outFn))
+        self.assertTrue(np.allclose(images[0], ih.readData((6, outFn))))
+
+    def test_volume(self):
+        import pyworkflow.em.mrc as mrc
+        ih = ImageHandler()
+        volFn = self.getOutputPath('volume.mrc')
+        vol = np.random.rand(8, 10, 12).astype(np.float32)
+        mrc.writeData(vol, volFn)
+
+        self.assertEqual((12, 10, 8, 1), ih.getDimensions(volFn))
+        self.assertEqual((12, 10, 8, 1), ih.getDimensions(volFn + ':mrc'))
+        self.assertTrue(np.allclose(vol, ih.readData(volFn)))
+
+        # Write the volume to a stack of volumes
+        stackFn = self.getOutputPath('volumes.mrcs')
+        ih.convert(volFn, (2, stackFn))
+        self.assertEqual((12, 10, 8, 2), ih.getDimensions(stackFn))
+        self.assertTrue(np.allclose(vol, ih.readData((2, stackFn))))
+
+        # Images with other dimensions can not be written to the stack
+        imgFn = self.getOutputPath('image.mrc')
+        mrc.writeData(vol[0], imgFn)
+        self.assertRaises(Exception, ih.convert, imgFn, (3, stackFn))
+
         
 class TestSetOfMicrographs(BaseTest):
     
@@ -177,6 +235,40 @@ class TestSetOfParticles(BaseTest):
                                                    direction='ASC')):
             self.assertEquals(item1.getMicId(), item2.getMicId())
 
+    def test_matrixStoreFormat(self):
+        """ Check that transformation matrices can be stored with
+        any format and read back, also from sets mixing formats.
+        """
+        dbName = self.getOutputPath('particles_matrix.sqlite')
+        cleanPath(dbName)
+        imgSet = SetOfParticles(filename=dbName)
+        imgSet.setSamplingRate(1.5)
+        img = Particle()
+        matrices = []
+
+        for i, storeFormat in enumerate([None, Matrix.STORE_FLOAT64,
+                                         Matrix.STORE_FLOAT32]):
+            imgSet.setMatrixStoreFormat(storeFormat)
+            m = np.random.rand(4, 4)
+            matrices.append(m)
+            img.setLocation(i+1, 'mystack.stk')
+            img.setTransform(Transform(m))
+            imgSet.append(img)
+            img.cleanObjId()
+        imgSet.write()
+        imgSet.close()
+
+        imgSet = SetOfParticles(filename=dbName)
+        for m, img in izip(matrices, imgSet):
+            self.assertTrue(np.allclose(m, img.getTransform().getMatrix()))
+        imgSet.close()
+
+        # Check the binary values are smaller than the JSON ones
+        t = Transform(matrices[0])
+        jsonSize = len(t._matrix.getObjValue())
+        t.setStoreFormat(Matrix.STORE_FLOAT32)
+        self.assertTrue(len(t._matrix.getObjValue()) < jsonSize / 3)
+
     def test_readStack(self):
         """ Read an stack of 29 particles from .hdf file.
         Particles should be of 500x500 pixels.
@@ -407,9 +499,24 @@ class TestTransform(BaseTest):
         
         p2 = p.clone()
         m3 = p2.getTransform().getMatrix()
-        self.assertTrue(np.allclose(m, m3, rtol=1e-2)) 
-        
-    
+        self.assertTrue(np.allclose(m, m3, rtol=1e-2))
+
+    def test_batchEuler(self):
+        """ Check that the batch Euler conversions give
+        the same results than converting each matrix.
+        """
+        import pyworkflow.em.transformations as tfs
+        angles = np.random.uniform(-np.pi, np.pi, (100, 3))
+        angles[:10, 1] = 0. # singular cases
+        for axes in ['szyz', 'sxyz', 'rzxz']:
+            matrices = tfs.euler_matrices(angles, axes)
+            for a, m in izip(angles, matrices):
+                self.assertTrue(np.allclose(m, tfs.euler_matrix(axes=axes, *a)))
+            eulers = tfs.euler_from_matrices(matrices, axes)
+            for e, m in izip(eulers, matrices):
+                self.assertTrue(np.allclose(e, tfs.euler_from_matrix(m, axes)))
+
+
 class TestCopyItems(BaseTest):
     
     @classmethod
@@ -456,11 +563,234 @@ class TestCopyItems(BaseTest):
             self.assertTrue(i2.equalAttributes(i1, ignore=['_list']))
         
         
+    def test_copyRows(self):
+        """
+        Test copyItems without callback, where the rows are
+        copied directly between the databases.
+        """
+        inFn = self.getOutputPath('particles_in.sqlite')
+        outFn = self.getOutputPath('particles_out.sqlite')
+
+        inputSet = SetOfParticles(filename=inFn)
+        inputSet.setSamplingRate(1.0)
+        img = Particle()
+        for i in range(1, 11):
+            img.setLocation(i, 'particles.stk')
+            img.setMicId(i % 3)
+            img.setEnabled(i % 4 != 0)
+            inputSet.append(img)
+            img.cleanObjId()
+        inputSet.write()
+
+        outputSet = SetOfParticles(filename=outFn)
+        outputSet.copyInfo(inputSet)
+        outputSet.copyItems(inputSet)
+        outputSet.write()
+        outputSet.close()
+
+        checkSet = SetOfParticles(filename=outFn)
+        # Disabled items should not be copied
+        self.assertEqual(8, checkSet.getSize())
+        enabledItems = [i.clone() for i in inputSet if i.isEnabled()]
+        for i1, i2 in izip(enabledItems, checkSet):
+            self.assertEqual(i1.getObjId(), i2.getObjId())
+            self.assertTrue(i2.equalAttributes(i1))
+
+    def test_copyRowsAcquisition(self):
+        """
+        Images without acquisition should get the one of the output
+        set, as append does, even when the rows could be copied.
+        """
+        inFn = self.getOutputPath('particles_noacq.sqlite')
+        outFn = self.getOutputPath('particles_acq.sqlite')
+        cleanPath(inFn, outFn, self.getOutputPath('particles_copy.sqlite'),
+                  self.getOutputPath('particles_copy2.sqlite'))
+
+        inputSet = SetOfParticles(filename=inFn)
+        img = Particle()
+        for i in range(1, 6):
+            img.setLocation(i, 'particles.stk')
+            inputSet.append(img)
+            img.cleanObjId()
+        inputSet.write()
+
+        outputSet = SetOfParticles(filename=outFn)
+        outputSet.getAcquisition().setVoltage(300)
+        outputSet.getAcquisition().setMagnification(50000)
+        self.assertFalse(outputSet._canCopyRows(inputSet))
+        outputSet.copyItems(inputSet)
+        self.assertEqual(5, outputSet.getSize())
+        for item in outputSet:
+            self.assertEqual(300, item.getAcquisition().getVoltage())
+
+        # Without acquisition in the output set the rows are copied
+        copySet = SetOfParticles(filename=self.getOutputPath('particles_copy.sqlite'))
+        self.assertTrue(copySet._canCopyRows(inputSet))
+        # and also when the images have their own acquisition
+        copySet2 = SetOfParticles(filename=self.getOutputPath('particles_copy2.sqlite'))
+        copySet2.copyInfo(outputSet)
+        self.assertTrue(copySet2._canCopyRows(outputSet))
+
+        for s in [inputSet, outputSet, copySet, copySet2]:
+            s.close()
+
+    def test_copyRowsClasses(self):
+        """
+        Test copyItems from the classes, whose items are stored in
+        the tables of the classes db with a prefix (e.g. Class001).
+        """
+        inFn = self.getOutputPath('particles_classify.sqlite')
+        classesFn = self.getOutputPath('classes_in.sqlite')
+        outFn = self.getOutputPath('classes_out.sqlite')
+        partFn = self.getOutputPath('particles_class1.sqlite')
+        cleanPath(inFn, classesFn, outFn, partFn)
+
+        inputSet = SetOfParticles(filename=inFn)
+        inputSet.setSamplingRate(1.0)
+        img = Particle()
+        for i in range(1, 11):
+            img.setLocation(i, 'particles.stk')
+            inputSet.append(img)
+            img.cleanObjId()
+        inputSet.write()
+
+        classes = SetOfClasses2D(filename=classesFn)
+        classes.setImages(inputSet)
+        classes.classifyItems(updateItemCallback=lambda item, row:
+                              item.setClassId(item.getObjId() % 2 + 1))
+        classes.write()
+
+        class1 = classes.getFirstItem()
+        self.assertEqual('Class001', class1.getPrefix())
+        particles = SetOfParticles(filename=partFn)
+        particles.copyInfo(class1)
+        self.assertTrue(particles._canCopyRows(class1))
+        particles.copyItems(class1)
+        self.assertEqual(range(2, 11, 2), [p.getObjId() for p in particles])
+
+        outputClasses = SetOfClasses2D(filename=outFn)
+        outputClasses.copyInfo(classes)
+        outputClasses.copyItems(classes)
+        outputClasses.write()
+        self.assertEqual([5, 5], [c.getSize() for c in outputClasses])
+        for cls1, cls2 in izip(classes, outputClasses):
+            self.assertEqual([p.getObjId() for p in cls1],
+                             [p.getObjId() for p in cls2])
+
+        for s in [inputSet, classes, particles, outputClasses]:
+            s.close()
+
     def _updateItem(self, item, row):
         item._list = CsvList()
         item._list.set([1.0, 2.0])
 
 
+class TestStar(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_writeRead(self):
+        """ Write a STAR file with StarWriter in several chunks
+        and read it back with StarReader.
+        """
+        from pyworkflow.em.star import StarReader, StarWriter
+        fn = self.getOutputPath('particles.star')
+        n = 25
+        arrays = OrderedDict()
+        arrays['rlnImageName'] = ['%06d@particles.mrcs' % (i + 1)
+                                  for i in range(n)]
+        arrays['rlnClassNumber'] = np.arange(n) % 3 + 1
+        arrays['rlnAnglePsi'] = np.linspace(-180, 180, n)
+
+        with StarWriter(fn) as writer:
+            writer.beginBlock('general', ['rlnImageSize'])
+            writer.writeRows([(64,)])
+            writer.beginBlock('particles', arrays.keys())
+            writer.writeArrays(dict((k, v[:10]) for k, v in arrays.items()))
+            writer.writeRows(izip(*[v[10:] for v in arrays.values()]))
+
+        reader = StarReader(fn)
+        self.assertEqual(['general', 'particles'], reader.getBlocks())
+        self.assertEqual(arrays.keys(), reader.getColumns('particles'))
+        self.assertEqual([(64,)], list(reader.iterRows()))
+
+        chunks = list(reader.iterChunks('particles', chunkSize=10))
+        self.assertEqual([10, 10, 5], [len(c['rlnAnglePsi']) for c in chunks])
+        readArrays = reader.readArrays('particles')
+        self.assertEqual(arrays['rlnImageName'],
+                         list(readArrays['rlnImageName']))
+        self.assertEqual(np.int64, readArrays['rlnClassNumber'].dtype)
+        self.assertTrue(np.all(arrays['rlnClassNumber'] ==
+                                  readArrays['rlnClassNumber']))
+        self.assertTrue(np.allclose(arrays['rlnAnglePsi'],
+                                       readArrays['rlnAnglePsi']))
+
+        # Columns can be selected and their types given
+        rows = list(reader.iterRows('particles',
+                                    columns=['rlnAnglePsi', 'rlnClassNumber'],
+                                    types={'rlnClassNumber': float}))
+        self.assertEqual(n, len(rows))
+        self.assertEqual((-180.0, 1.0), rows[0])
+        self.assertTrue(isinstance(rows[0][1], float))
+
+        # A non-loop block
+        with open(fn, 'a') as f:
+            f.write('\ndata_optimiser\n\n_rlnIterationNumber 5\n'
+                    '_rlnOutputRootName run_it005\n')
+        self.assertEqual([(5, 'run_it005')], list(reader.iterRows('optimiser')))
+
+    def test_readValues(self):
+        """ Read columns whose type changes after the first
+        row and values quoted because they contain spaces.
+        """
+        from pyworkflow.em.star import StarReader
+        fn = self.getOutputPath('micrographs.star')
+        with open(fn, 'w') as f:
+            f.write("\ndata_micrographs\n\nloop_\n_rlnMicrographName #1\n"
+                    "_rlnDefocusU #2\n_rlnComment #3\n"
+                    "001 10000 none\n"
+                    "mic_a.mrc 10500.5 'two words'\n"
+                    "\ndata_wrong\n\nloop_\n_rlnMicrographName #1\n"
+                    "_rlnDefocusU #2\nmic_a.mrc\n")
+
+        reader = StarReader(fn)
+        rows = list(reader.iterRows('micrographs'))
+        self.assertEqual((1, 10000, 'none'), rows[0])
+        self.assertEqual(('mic_a.mrc', 10500.5, 'two words'), rows[1])
+
+        arrays = reader.readArrays('micrographs')
+        self.assertEqual(['001', 'mic_a.mrc'], list(arrays['rlnMicrographName']))
+        self.assertEqual(np.float64, arrays['rlnDefocusU'].dtype)
+        self.assertEqual(['none', 'two words'], list(arrays['rlnComment']))
+
+        # Rows with a wrong number of values
+        self.assertRaises(Exception, list, reader.iterRows('wrong'))
+        self.assertRaises(Exception, reader.readArrays, 'wrong')
+
+    def test_writeQuoted(self):
+        """ String values that are empty or contain spaces
+        should be read back as they were written.
+        """
+        from pyworkflow.em.star import StarReader, StarWriter
+        fn = self.getOutputPath('quoted.star')
+        names = ['a b.mrc', '', "it's.mrc", 'c.mrc']
+        with StarWriter(fn) as writer:
+            writer.beginBlock('rows', ['rlnImageName', 'rlnClassNumber'])
+            writer.writeRows([(name, 1) for name in names])
+            writer.beginBlock('arrays', ['rlnImageName', 'rlnClassNumber'])
+            writer.writeArrays({'rlnImageName': names,
+                                'rlnClassNumber': [1] * len(names)})
+
+        reader = StarReader(fn)
+        for block in ['rows', 'arrays']:
+            self.assertEqual([(name, 1) for name in names],
+                             list(reader.iterRows(block)))
+            self.assertEqual(names,
+                             list(reader.readArrays(block)['rlnImageName']))
+
+
 if __name__ == '__main__':
 #    suite = unittest.TestLoader().loadTestsFromName('test_data_xmipp.TestXmippCTFModel.testConvertXmippCtf')
 #    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,145 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia, CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+
+import os
+import sys
+
+import pyworkflow.em as em
+import pyworkflow.utils as pwutils
+from pyworkflow.em.registry import ClassesRegistry, LazyClassesDict
+from pyworkflow.tests import BaseTest, setupTestOutput
+
+
+FAKE_PACKAGE = """
+from pyworkflow.em.data import EMObject
+
+class FakeRegistryObject(EMObject):
+    pass
+"""
+
+
+class TestClassesRegistry(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def test_registry(self):
+        """ The classes resolved from the registry should be the
+        same as the ones found loading all the packages.
+        """
+        classes = dict(em.getProtocols())
+        classes.update(em.getObjects())
+        fn = self.getOutputPath('em_registry.json')
+        registry = ClassesRegistry(fn, em.PACKAGES_PATH)
+        registry.build(classes, em.getViewers(), em.getWizards(),
+                       [sys.modules['pyworkflow.em']], em.getPackages())
+
+        registry = ClassesRegistry(fn, em.PACKAGES_PATH)
+        self.assertTrue(registry.load())
+        for name, cls in classes.iteritems():
+            self.assertTrue(registry.getClass(name) is cls)
+        self.assertTrue(registry.getClass('NotExistingClass') is None)
+
+        classesDict = LazyClassesDict(registry, {'Integer': em.Integer})
+        self.assertTrue('SetOfMicrographs' in classesDict)
+        self.assertTrue('Integer' in classesDict)
+        self.assertFalse('NotExistingClass' in classesDict)
+
+        # Viewers of a class as found checking all viewers targets
+        for className in ['SetOfMicrographs', 'SetOfParticles', 'Volume']:
+            baseClasses = classes[className].mro()
+            expected = [v for v in em.getViewers().values()
+                        if 'tkinter' in v._environments and
+                        any(t in baseClasses for t in v._targets)]
+            names = registry.findViewers([c.__name__ for c in baseClasses], 'tkinter')
+            self.assertEqual(sorted(expected), sorted(registry.getViewer(n) for n in names))
+
+    def test_invalidation(self):
+        """ The registry should be out of date when the packages change. """
+        packagesPath = self.getOutputPath('packages')
+        pwutils.cleanPath(packagesPath)
+        pwutils.makePath(os.path.join(packagesPath, 'fakeregistrypkg'))
+        initFn = os.path.join(packagesPath, 'fakeregistrypkg', '__init__.py')
+        with open(initFn, 'w') as f:
+            f.write(FAKE_PACKAGE)
+
+        fn = self.getOutputPath('fake_registry.json')
+        pwutils.cleanPath(fn)
+        registry = ClassesRegistry(fn, packagesPath)
+        self.assertFalse(registry.load())
+        package = registry._importPackage('fakeregistrypkg')
+        registry.build({'FakeRegistryObject': package.FakeRegistryObject},
+                       {}, {}, [], {'fakeregistrypkg': package})
+
+        registry = ClassesRegistry(fn, packagesPath)
+        self.assertTrue(registry.load())
+        cls = registry.getClass('FakeRegistryObject')
+        self.assertTrue(cls is package.FakeRegistryObject)
+        self.assertTrue(cls._package is package)
+
+        with open(initFn, 'a') as f:
+            f.write("\n# modified\n")
+        self.assertFalse(ClassesRegistry(fn, packagesPath).load())
+
+    def test_sourcePaths(self):
+        """ Changes in the source paths (e.g. pyworkflow/em) should
+        also make the registry out of date.
+        """
+        sourcePath = self.getOutputPath('source')
+        packagesPath = os.path.join(sourcePath, 'packages')
+        pwutils.cleanPath(sourcePath)
+        pwutils.makePath(packagesPath)
+        sourceFn = os.path.join(sourcePath, 'data.py')
+        with open(sourceFn, 'w') as f:
+            f.write(FAKE_PACKAGE)
+
+        fn = self.getOutputPath('source_registry.json')
+        registry = ClassesRegistry(fn, packagesPath, [sourcePath])
+        registry.build({}, {}, {}, [], {})
+        self.assertTrue(ClassesRegistry(fn, packagesPath, [sourcePath]).load())
+
+        with open(sourceFn, 'a') as f:
+            f.write("\n# modified\n")
+        self.assertFalse(ClassesRegistry(fn, packagesPath, [sourcePath]).load())
+
+    def test_findClassMissing(self):
+        """ Classes missing in the registry should still be found,
+        building it again.
+        """
+        fn = self.getOutputPath('empty_registry.json')
+        pwutils.cleanPath(fn)
+        registry = ClassesRegistry(fn, em.PACKAGES_PATH)
+        registry.build({}, {}, {}, [], {})
+        oldValues = em._emRegistry, em._emClassesDict, em._emRegistryRebuilt
+        em._emRegistry, em._emClassesDict = registry, None
+        em._emRegistryRebuilt = False
+        try:
+            self.assertTrue(em.findClass('SetOfParticles') is em.SetOfParticles)
+            self.assertTrue(registry.hasClass('SetOfParticles'))
+            self.assertRaises(Exception, em.findClass, 'NotExistingClass')
+        finally:
+            em._emRegistry, em._emClassesDict, em._emRegistryRebuilt = oldValues
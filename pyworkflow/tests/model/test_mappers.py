@@ -28,6 +28,7 @@
 import os
 import os.path
 import unittest
+import numpy as np
 from pyworkflow.mapper import *
 from pyworkflow.object import *
 from pyworkflow.config import *
@@ -129,7 +130,7 @@ class TestSqliteMapper(BaseTest):
         
         # Save changes to file
         mapper.commit()
-        self.assertEqual(1, mapper.db.getVersion())
+        self.assertEqual(2, mapper.db.getVersion())
 
         # Intentionally keep gold.sqlite as version 0 to check
         # backward compatibility
@@ -145,12 +146,17 @@ class TestSqliteMapper(BaseTest):
         
         # Reading test
         mapper2 = SqliteMapper(fnGoldCopy, globals())
-        print "Checking that Relations table is updated and version to 1"
-        self.assertEqual(1, mapper2.db.getVersion())
+        print "Checking that Relations table is updated and version to 2"
+        self.assertEqual(2, mapper2.db.getVersion())
         # Check that the new column is properly added after updated to version 1
         colNamesGold += [u'object_parent_extended', u'object_child_extended']
         colNames = [col[1] for col in mapper2.db.getTableColumns('Relations')]
         self.assertEqual(colNamesGold, colNames)
+        # Check that the Objects indexes are created after updated to version 2
+        mapper2.db.executeCommand("SELECT name FROM sqlite_master WHERE type='index'")
+        indexes = [r[0] for r in mapper2.db.cursor.fetchall()]
+        self.assertTrue('idx_objects_name' in indexes)
+        self.assertTrue('idx_objects_parent_id' in indexes)
         
         l = mapper2.selectByClass('Integer')[0]
         self.assertEqual(l.get(), 1)
@@ -220,6 +226,107 @@ class TestSqliteMapper(BaseTest):
         # set to None and the _extended property cleanned
         self.assertIsNone(p2.get())
         
+    def test_concurrentAccess(self):
+        """ Stress test with one process writing to a db in WAL mode,
+        while several processes are reading from it.
+        """
+        from multiprocessing import Process, Queue
+        fn = self.getOutputPath("concurrent.sqlite")
+        pwutils.cleanPath(fn)
+        print ">>> Using db: ", fn
+        
+        os.environ['SCIPION_SQLITE_WAL'] = '1'
+        try:
+            mapper = SqliteMapper(fn, globals())
+            self.assertTrue(mapper.db.isWal())
+            mapper.close()
+            
+            nReaders, nBatches, batchSize = 4, 50, 100
+            queue = Queue()
+            readers = [Process(target=_readObjects,
+                               args=(fn, nBatches * batchSize, queue))
+                       for _ in range(nReaders)]
+            writer = Process(target=_writeObjects, args=(fn, nBatches, batchSize))
+            for p in readers + [writer]:
+                p.start()
+            writer.join()
+            self.assertEqual(0, writer.exitcode)
+            
+            for _ in readers:
+                counts, error = queue.get()
+                self.assertIsNone(error)
+                # Readers should only see complete batches, in order
+                self.assertEqual(sorted(counts), counts)
+                self.assertTrue(all(c % batchSize == 0 for c in counts))
+                self.assertEqual(nBatches * batchSize, counts[-1])
+            for p in readers:
+                p.join()
+        finally:
+            del os.environ['SCIPION_SQLITE_WAL']
+            
+        # A read only connection should not be able to modify the db
+        mapper = SqliteMapper(fn, globals(), readOnly=True)
+        self.assertEqual(nBatches * batchSize, len(mapper.selectAll()))
+        self.assertRaises(Exception, mapper.insert, Integer(1))
+        mapper.close()
+
+    def test_sharedConnections(self):
+        """ Dbs with table prefixes share the connection, closing
+        them (even twice) should not fail and read-only dbs should not
+        affect the writers.
+        """
+        from pyworkflow.mapper.sqlite import SqliteFlatDb
+        fn = self.getOutputPath("shared.sqlite")
+        pwutils.cleanPath(fn)
+
+        os.environ['SCIPION_SQLITE_WAL'] = '1'
+        try:
+            db1 = SqliteFlatDb(fn, 'Class001')
+            db2 = SqliteFlatDb(fn, 'Class002')
+        finally:
+            del os.environ['SCIPION_SQLITE_WAL']
+        self.assertTrue(db1.connection is db2.connection)
+
+        reader = SqliteFlatDb(fn, 'Class001', readOnly=True)
+        self.assertFalse(reader.connection is db1.connection)
+        db1.executeCommand("CREATE TABLE Test (id INTEGER)")
+        db1.commit()
+        reader.close()
+        db2.executeCommand("INSERT INTO Test VALUES (1)")
+        db2.commit()
+
+        db1.close()
+        db2.close()
+        db2.close()
+
+
+def _writeObjects(dbName, nBatches, batchSize):
+    """ Insert objects in batches, committing after each one. """
+    mapper = SqliteMapper(dbName, globals())
+    for _ in range(nBatches):
+        for i in range(batchSize):
+            mapper.insert(Integer(i))
+        mapper.commit()
+    mapper.close()
+
+
+def _readObjects(dbName, total, queue, maxTime=60):
+    """ Count the objects in the db until the writer finishes.
+    The readers use a small timeout, they should never wait for the writer.
+    """
+    import time
+    counts, error = [], None
+    t0 = time.time()
+    try:
+        db = SqliteDb()
+        db._createConnection(dbName, timeout=0.1, readOnly=True)
+        while (not counts or counts[-1] < total) and time.time() - t0 < maxTime:
+            db.executeCommand("SELECT COUNT(*) FROM Objects")
+            counts.append(db.cursor.fetchone()[0])
+        db.close()
+    except Exception, ex:
+        error = str(ex)
+    queue.put((counts, error))
         
         
 class TestSqliteFlatMapper(BaseTest):
@@ -274,6 +381,277 @@ class TestSqliteFlatMapper(BaseTest):
         self.assertEqual(mapper2.getProperty('samplingRate'), '3.0')
         self.assertEqual(mapper2.getProperty('defocusU'), '2000')
         
+    def test_bulkInsert(self):
+        dbName = self.getOutputPath('images_bulk.sqlite')
+        print ">>> test_bulkInsert: dbName = '%s'" % dbName
+        pwutils.cleanPath(dbName)
+        n = 1000
+
+        imgSet = Set(filename=dbName)
+        img = Image()
+
+        def _iterImages():
+            for i in range(n):
+                img.cleanObjId()
+                img.setLocation(i+1, 'images.stk')
+                yield img
+
+        imgSet.appendMany(_iterImages(), bufferSize=128)
+        imgSet.write()
+        # Check that ids and size were updated as with append
+        self.assertEqual(n, imgSet.getSize())
+        self.assertEqual(n, imgSet._idCount)
+        imgSet.close()
+
+        imgSet2 = Set(filename=dbName, classesDict=globals())
+        self.assertEqual(n, imgSet2.getSize())
+        for i, img2 in enumerate(imgSet2):
+            self.assertEqual(i+1, img2.getObjId())
+            self.assertEqual((i+1, 'images.stk'), img2.getLocation())
+
+        # Pending rows should be visible from queries before ending
+        mapper = imgSet2._getMapper()
+        mapper.enableAppend()
+        mapper.beginBulkInsert(bufferSize=10)
+        img.setObjId(n+1)
+        mapper.insert(img)
+        self.assertEqual(n+1, mapper.count())
+        # The journal is not changed during the bulk insert
+        self.assertEqual('delete', mapper.db.getPragma('journal_mode'))
+        mapper.endBulkInsert()
+        imgSet2.close()
+
+        # Errors while iterating the items are raised after
+        # writing the items already appended
+        def _iterFailing():
+            for i in range(5):
+                img.cleanObjId()
+                yield img
+            raise ValueError('Error reading items')
+
+        pwutils.cleanPath(dbName)
+        imgSet3 = Set(filename=dbName)
+        self.assertRaises(ValueError, imgSet3.appendMany, _iterFailing())
+        self.assertEqual(5, imgSet3._getMapper().count())
+        imgSet3.close()
+
+    def test_getColumns(self):
+        dbName = self.getOutputPath('images_columns.sqlite')
+        print ">>> test_getColumns: dbName = '%s'" % dbName
+        pwutils.cleanPath(dbName)
+        n = 100
+
+        imgSet = Set(filename=dbName)
+        for i in range(n):
+            img = Image()
+            img.setLocation(i+1, 'images%d.stk' % (i % 2))
+            img.setSamplingRate(i * 0.5 if i % 3 else None)
+            imgSet.append(img)
+        imgSet.write()
+
+        values = imgSet.getColumns(['id', '_index', '_samplingRate', '_filename'])
+        self.assertEqual(n, len(values))
+        self.assertEqual(range(1, n+1), values['id'].tolist())
+        self.assertEqual(values['id'].tolist(), values['_index'].tolist())
+        self.assertEqual('images1.stk', values['_filename'][1])
+        # Missing float values should be returned as nan
+        self.assertTrue(np.isnan(values['_samplingRate'][0]))
+        self.assertAlmostEqual(0.5, values['_samplingRate'][1])
+
+        values = imgSet.getColumns(['_index'], where="_filename='images0.stk'",
+                                   orderBy='_index', direction='DESC')
+        self.assertEqual(range(n-1, 0, -2), values['_index'].tolist())
+        self.assertEqual(set(range(1, n+1)), imgSet.getIdSet())
+
+        # Rows read in several chunks, with NULL integers only in the last one
+        db = imgSet._getMapper().db
+        db.loadColumnsMapping()
+        db.executeCommand('UPDATE Objects SET %s=NULL WHERE id=%d'
+                          % (db._getRealCol('_index'), n))
+        values = db.selectColumns(['id', '_index', '_filename'], chunkSize=30)
+        self.assertEqual(np.int64, values['id'].dtype)
+        self.assertEqual(np.float64, values['_index'].dtype)
+        self.assertEqual(range(1, n), values['_index'][:-1].tolist())
+        self.assertTrue(np.isnan(values['_index'][-1]))
+        self.assertEqual('images1.stk', values['_filename'][n-1])
+        imgSet.close()
+
+    def test_query(self):
+        dbName = self.getOutputPath('images_query.sqlite')
+        print ">>> test_query: dbName = '%s'" % dbName
+        pwutils.cleanPath(dbName)
+
+        imgSet = Set(filename=dbName)
+        for i in range(100):
+            img = Image()
+            img.setLocation(i+1, 'images%d.stk' % (i % 3))
+            img.setSamplingRate(i * 0.5)
+            imgSet.append(img)
+        imgSet.write()
+        imgSet.close()
+
+        imgSet = Set(filename=dbName, classesDict=globals())
+
+        def _indexes(**kwargs):
+            return [img.getIndex() for img in imgSet.iterItems(**kwargs)]
+
+        self.assertEqual([3, 6, 9], _indexes(where="_index IN (3, 6, 9)"))
+        self.assertEqual([21, 24],
+                         _indexes(where="_samplingRate BETWEEN 10 AND 12 "
+                                        "AND _filename='images2.stk'"))
+        self.assertEqual([2, 100, 1],
+                         _indexes(where="_index < 3 OR _index >= 100",
+                                  orderBy=['_filename DESC', '_index'],
+                                  direction='DESC'))
+        self.assertEqual([13, 14, 15],
+                         _indexes(where="NOT _index <= 10", limit=3, offset=2))
+        self.assertEqual(5, len(_indexes(orderBy='RANDOM()', limit=5)))
+        # Literal values are bound, so a value can not inject sql
+        self.assertEqual([], _indexes(where="_filename='x'' OR 1=1 --'"))
+
+        for where in ["_index=1; DELETE FROM Objects", "_missing=1", "(_index=1"]:
+            self.assertRaises(Exception, _indexes, where=where)
+        imgSet.close()
+
+    def test_indexes(self):
+        dbName = self.getOutputPath('images_indexes.sqlite')
+        print ">>> test_indexes: dbName = '%s'" % dbName
+        pwutils.cleanPath(dbName)
+
+        imgSet = Set(filename=dbName)
+        for i in range(10):
+            img = Image()
+            img.setLocation(i+1, 'images.stk')
+            imgSet.append(img)
+        # The _filename column should be indexed when the set is written
+        imgSet.write()
+        self.assertEqual(['_filename'], imgSet.getIndexes())
+        imgSet.close()
+
+        imgSet = Set(filename=dbName, classesDict=globals())
+        self.assertEqual(['_filename'], imgSet.getIndexes())
+        imgSet.ensureIndex('_index', '_filename')
+        self.assertEqual(['_filename', '_index'], imgSet.getIndexes())
+        db = imgSet._getMapper().db
+        db.executeCommand("EXPLAIN QUERY PLAN SELECT * FROM Objects WHERE %s=3"
+                          % db._getRealCol('_index'))
+        self.assertTrue('USING INDEX' in str(tuple(db.cursor.fetchone())))
+
+        # The statistics are updated when the rows grow substantially
+        def _analyzedRows():
+            return int(db.getProperty('@analyzed'))
+
+        self.assertEqual(10, _analyzedRows())
+        imgSet.enableAppend()
+        img = Image()
+        img.setLocation(11, 'images.stk')
+        imgSet.append(img)
+        imgSet.write()
+        self.assertEqual(10, _analyzedRows())
+
+        def _newImages():
+            for i in range(12, 101):
+                img = Image()
+                img.setLocation(i, 'images.stk')
+                yield img
+        imgSet.appendMany(_newImages())
+        self.assertEqual(100, _analyzedRows())
+        imgSet.close()
+
+    def test_setOperations(self):
+        def createSet(name, ids):
+            dbName = self.getOutputPath('%s.sqlite' % name)
+            pwutils.cleanPath(dbName)
+            imgSet = Set(filename=dbName)
+            for i in ids:
+                img = Image()
+                img.setObjId(i)
+                img.setLocation(i, '%s.stk' % name)
+                img.setEnabled(i % 5 != 0)
+                imgSet.append(img)
+            imgSet.write()
+            imgSet.close()
+            return Set(filename=dbName, classesDict=globals())
+
+        set1 = createSet('set1', range(1, 21))
+        set2 = createSet('set2', range(11, 31))
+
+        def getIds(imgSet):
+            return list(imgSet.getColumns(['id'])['id'])
+
+        union = createSet('union', [])
+        self.assertEqual(20, union.appendFromSet(set1))
+        self.assertEqual(10, union.appendFromSet(set2, uniqueBy='id'))
+        self.assertEqual(range(1, 31), getIds(union))
+        # Items are copied with all their attributes
+        self.assertEqual('set2.stk', union[25].getFileName())
+
+        renumbered = createSet('renumbered', [])
+        renumbered.appendFromSet(set1)
+        self.assertEqual(20, renumbered.appendFromSet(set2, renumber=True))
+        self.assertEqual(range(1, 41), getIds(renumbered))
+        # New items should continue with the renumbered ids
+        img = Image()
+        img.setLocation(1, 'new.stk')
+        renumbered.append(img)
+        self.assertEqual(41, img.getObjId())
+
+        enabled = createSet('enabled', [])
+        self.assertEqual(16, enabled.appendFromSet(set1, where='enabled=1'))
+
+        inter = createSet('inter', [])
+        self.assertEqual(10, inter.appendIntersection(set1, set2))
+        self.assertEqual(range(11, 21), getIds(inter))
+
+        diff = createSet('diff', [])
+        self.assertEqual(10, diff.appendDifference(set1, set2))
+        self.assertEqual(range(1, 11), getIds(diff))
+
+        for s in [set1, set2, union, renumbered, enabled, inter, diff]:
+            s.close()
+
+    def test_setOperationsPrefix(self):
+        """ Operations with sets stored with a prefix (as the classes)
+        and with input items that are not written yet.
+        """
+        dbName = self.getOutputPath('classes.sqlite')
+        pwutils.cleanPath(dbName)
+
+        def createSet(prefix, ids):
+            imgSet = Set(filename=dbName, prefix=prefix, classesDict=globals())
+            for i in ids:
+                img = Image()
+                img.setObjId(i)
+                img.setLocation(i, '%s.stk' % prefix)
+                imgSet.append(img)
+            return imgSet
+
+        # Items are not written (nor committed) on purpose
+        class1 = createSet('Class001', range(1, 11))
+        class2 = createSet('Class002', range(6, 16))
+
+        def getIds(imgSet):
+            return list(imgSet.getColumns(['id'])['id'])
+
+        outFn = self.getOutputPath('prefix_out.sqlite')
+        pwutils.cleanPath(outFn)
+        union = Set(filename=outFn, classesDict=globals())
+        self.assertEqual(10, union.appendFromSet(class1))
+        self.assertEqual(5, union.appendFromSet(class2, uniqueBy='id'))
+        self.assertEqual(range(1, 16), getIds(union))
+        self.assertEqual('Class002.stk', union[15].getFileName())
+
+        inter = Set(filename=outFn, prefix='Inter', classesDict=globals())
+        self.assertEqual(5, inter.appendIntersection(class1, class2))
+        self.assertEqual(range(6, 11), getIds(inter))
+
+        diff = Set(filename=outFn, prefix='Diff', classesDict=globals())
+        self.assertEqual(5, diff.appendDifference(class2, class1))
+        self.assertEqual(range(11, 16), getIds(diff))
+
+        for s in [class1, class2, union, inter, diff]:
+            s.close()
+
     def test_downloads(self):
         dbName = self.getOutputPath('downloads.sqlite')
         #dbName = '/tmp/downloads.sqlite'
@@ -307,7 +685,44 @@ class TestSqliteFlatMapper(BaseTest):
         self.assertEqual(objSet.getSize(), 0)
         items = [obj.clone() for obj in objSet]
         self.assertEqual(len(items), 0)
-        
+
+    def test_streamState(self):
+        dbName = self.getOutputPath('stream.sqlite')
+        print ">>> test_streamState: dbName = '%s'" % dbName
+        pwutils.cleanPath(dbName)
+
+        # The state of an empty open set should be readable
+        producerSet = SetOfImages(filename=dbName)
+        producerSet.setStreamState(Set.STREAM_OPEN)
+        producerSet.write()
+        consumerSet = SetOfImages(filename=dbName)
+        self.assertTrue(consumerSet.isStreamClosed())
+        consumerSet.loadStreamState()
+        self.assertTrue(consumerSet.isStreamOpen())
+        self.assertEqual(0, consumerSet.getSize())
+        self.assertEqual([], list(consumerSet))
+        producerSet.close()
+
+        # Items appended in several times, from other set objects
+        for i in range(3):
+            producerSet = SetOfImages(filename=dbName)
+            producerSet.enableAppend()
+            for j in range(10):
+                img = Image()
+                img.setLocation(j+1, 'images%d.stk' % i)
+                producerSet.append(img)
+            if i == 2:
+                producerSet.setStreamState(Set.STREAM_CLOSED)
+            producerSet.write()
+            producerSet.close()
+
+            consumerSet.loadStreamState()
+            self.assertEqual(10 * (i+1), consumerSet.getSize())
+            self.assertEqual(range(1, 10 * (i+1) + 1),
+                             [img.getObjId() for img in consumerSet])
+        self.assertTrue(consumerSet.isStreamClosed())
+        consumerSet.close()
+
 class TestXmlMapper(BaseTest):
     
     @classmethod
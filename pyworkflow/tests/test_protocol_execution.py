@@ -29,8 +29,14 @@ from pyworkflow.em import *
 from tests import *
 from pyworkflow.mapper import SqliteMapper
 from pyworkflow.utils import dateStr
-from pyworkflow.protocol.constants import MODE_RESUME, STATUS_FINISHED
-from pyworkflow.protocol.executor import StepExecutor
+import pyworkflow.utils as pwutils
+from pyworkflow.protocol.constants import (MODE_RESUME, MODE_RESTART,
+                                           STATUS_FINISHED, STATUS_NEW,
+                                           STATUS_FAILED, STATUS_RUNNING)
+from pyworkflow.protocol.executor import (StepExecutor, ThreadStepExecutor,
+                                          ArrayStepExecutor)
+from pyworkflow.protocol.cache import StepsCache
+from pyworkflow.protocol.protocol import FunctionStep
 
     
 #Protocol for tests, runs in resume mode, and sleeps for??
@@ -66,6 +72,209 @@ class MyParallelProtocol(MyProtocol):
             self._insertFunctionStep('sleepStep')
     
             
+
+class MyFailingProtocol(MyProtocol):
+    """ Run quick steps, failing at the one with index failAt. """
+    def __init__(self, **args):
+        MyProtocol.__init__(self, **args)
+        self.failAt = Integer(args.get('failAt', None))
+        
+    def quickStep(self, i):
+        if i == self.failAt:
+            raise Exception('Failing for testing purposes')
+        
+    def _insertAllSteps(self):
+        for i in range(self.numberOfSleeps.get()):
+            self._insertFunctionStep('quickStep', i+1)
+            
+            
+class MyFlushedProtocol(MyProtocol):
+    """ Run a quick step and a longer one that records the status
+    of the first step in the steps db while it is running.
+    """
+    statuses = []
+    
+    def quickStep(self):
+        pass
+    
+    def waitStep(self, t):
+        import time
+        time.sleep(t)
+        self.statuses.append([s.getStatus() for s in self.loadSteps()])
+        
+    def _insertAllSteps(self):
+        self._insertFunctionStep('quickStep')
+        self._insertFunctionStep('waitStep', 1)
+            
+            
+class MyCachedProtocol(MyProtocol):
+    """ Write a file in each step, using the steps cache. """
+    cache = None
+    calls = []
+    
+    def writeStep(self, i):
+        self.calls.append(i)
+        fn = self._getExtraPath('out_%02d.txt' % i)
+        f = open(fn, 'w')
+        f.write('Output %d\n' % i)
+        f.close()
+        return [fn]
+        
+    def _insertAllSteps(self):
+        for i in range(self.numberOfSleeps.get()):
+            self._insertFunctionStep('writeStep', i+1, cacheable=True)
+            
+    def getStepsCache(self):
+        return self.cache
+            
+            
+class MyCTFProtocol(ProtCTFMicrographs):
+    """ Estimate the CTF writing a file for each micrograph. """
+    cache = None
+    calls = []
+    
+    def _estimateCTF(self, micFn, micDir, micName):
+        self.calls.append(micName)
+        pwutils.makePath(micDir)
+        f = open(os.path.join(micDir, 'ctf.txt'), 'w')
+        f.write('%s %s\n' % (micFn, self.lowRes.get()))
+        f.close()
+        
+    def _createOutputStep(self):
+        pass
+            
+    def getStepsCache(self):
+        return self.cache
+            
+            
+class MyItemsProtocol(MyProtocol):
+    """ Process items grouped in steps, failing at item failAt. """
+    calls = []
+    
+    def __init__(self, **args):
+        MyProtocol.__init__(self, **args)
+        self.failAt = Integer(args.get('failAt', None))
+        
+    def processItem(self, i, name):
+        if i == self.failAt:
+            raise Exception('Failing for testing purposes')
+        self.calls.append(i)
+        
+    def _insertAllSteps(self):
+        self._insertItemsSteps('processItem',
+                               [(i, 'item%d' % i) for i in range(self.numberOfSleeps.get())])
+            
+            
+class MyProfiledProtocol(MyProtocol):
+    """ Run steps that use some cpu in this process and in a child. """
+    def busyStep(self, i):
+        sum(range(100000))
+        pwutils.runJob(None, 'python', ['-c', 'sum(range(10**6))'])
+        
+    def _insertAllSteps(self):
+        for i in range(self.numberOfSleeps.get()):
+            self._insertFunctionStep('busyStep', i+1)
+            
+            
+class MyArrayProtocol(MyProtocol):
+    """ Steps that can be run by array tasks and a final one that not. """
+    calls = []
+    
+    def arrayStep(self, i):
+        self.calls.append(i)
+        
+    def outputStep(self):
+        self.calls.append('output')
+        
+    def _insertAllSteps(self):
+        deps = [self._insertFunctionStep('arrayStep', i+1)
+                for i in range(self.numberOfSleeps.get())]
+        self._insertFunctionStep('outputStep', prerequisites=deps,
+                                 mainProcess=True)
+            
+            
+class MyStreamProducer(MyProtocol):
+    """ Produce an output set in several steps, keeping it
+    open until the last one.
+    """
+    def produceStep(self, i):
+        import time
+        outputSet = SetOfImages(filename=self._getPath('images.sqlite'))
+        outputSet.enableAppend()
+        for j in range(5):
+            img = Image()
+            img.setLocation(j+1, 'images%02d.stk' % i)
+            outputSet.append(img)
+        if i == self.numberOfSleeps:
+            state = Set.STREAM_CLOSED
+        else:
+            state = Set.STREAM_OPEN
+        self._updateOutputSet('outputImages', outputSet, state)
+        outputSet.close()
+        time.sleep(0.2)
+        
+    def _insertAllSteps(self):
+        for i in range(self.numberOfSleeps.get()):
+            self._insertFunctionStep('produceStep', i+1)
+            
+            
+class MyStreamingProtocol(MyProtocol):
+    """ Process the images of the input set while it is produced. """
+    calls = []
+    
+    def __init__(self, **args):
+        MyProtocol.__init__(self, **args)
+        self.inputImages = Pointer()
+        
+    def processStep(self, imgId):
+        self.calls.append(imgId)
+        
+    def outputStep(self):
+        self.calls.append('output')
+        
+    def _insertAllSteps(self):
+        self._imagesSteps = []
+        self._insertNewSteps()
+        
+    def _insertNewSteps(self):
+        inputImages = self.inputImages.get()
+        self._imagesSteps += self._insertNewItemsSteps(inputImages, 'processStep',
+                                                       lambda img: (img.getObjId(),),
+                                                       prerequisites=[])
+        if inputImages.isStreamOpen():
+            return True
+        self._insertFunctionStep('outputStep', prerequisites=self._imagesSteps)
+        return False
+    
+    def _stepsCheck(self):
+        self.inputImages.get().loadStreamState()
+        return self._insertNewSteps()
+            
+            
+class MySlowImportMicrographs(ProtImportMicrographs):
+    """ Import the micrographs slowly, to be processed in streaming. """
+    def getCopyOrLink(self):
+        import time
+        def _slowLink(src, dst):
+            time.sleep(0.2)
+            pwutils.createLink(src, dst)
+        return _slowLink
+    
+    
+class MyStreamingCTFProtocol(MyCTFProtocol):
+    """ Estimate the CTF producing the output in streaming. """
+    _streamingOutput = True
+    # Stream state of the input when each CTF model is added to the output
+    inputOpen = []
+    
+    def _createCtfModel(self, mic):
+        self.inputOpen.append(self.inputMics.isStreamOpen())
+        ctfModel = CTFModel()
+        ctfModel.setStandardDefocus(10000, 12000, 45)
+        ctfModel.setMicrograph(mic)
+        return ctfModel
+            
+            
 # TODO: this test seems not to be finished.
 class TestProtocolExecution(BaseTest):
     
@@ -87,3 +296,670 @@ class TestProtocolExecution(BaseTest):
         prot2 = mapper2.selectById(prot.getObjId())
         
         self.assertEqual(prot.endTime.get(), prot2.endTime.get())
+
+    def test_stepsFlush(self):
+        """ Steps status changes are written in batches, but all of
+        them should be in the steps db when the protocol stops.
+        """
+        fn = self.getOutputPath("protocol_flush.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyFailingProtocol(mapper=mapper, n=50, failAt=30,
+                                 workingDir=self.getOutputPath('flush'))
+        prot.stepsFlushInterval = 3600
+        prot.stepsFlushCount = 1000
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        prot.run()
+        
+        self.assertTrue(prot.isFailed())
+        steps = prot.loadSteps()
+        self.assertEqual(50, len(steps))
+        self.assertTrue(all(s.isFinished() for s in steps[:29]))
+        self.assertTrue(steps[29].isFailed())
+        self.assertEqual(STATUS_NEW, steps[30].getStatus())
+        prot2 = SqliteMapper(fn, globals()).selectById(prot.getObjId())
+        self.assertEqual(30, prot2._stepsDone.get())
+        
+        # Resuming should start at the failed step
+        prot.failAt.set(None)
+        prot._steps = []
+        prot.run()
+        self.assertTrue(prot.isFinished())
+        steps2 = prot.loadSteps()
+        self.assertTrue(all(s.isFinished() for s in steps2))
+        self.assertEqual(steps[28].initTime, steps2[28].initTime)
+        self.assertNotEqual(steps[29].initTime, steps2[29].initTime)
+
+    def test_stepsPeriodicFlush(self):
+        """ Pending steps changes are written every stepsFlushInterval
+        seconds, even while a long step is running.
+        """
+        fn = self.getOutputPath("protocol_periodic.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyFlushedProtocol(mapper=mapper,
+                                 workingDir=self.getOutputPath('periodic'))
+        prot.stepsFlushInterval = 0.2
+        prot.stepsFlushCount = 1000
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        del MyFlushedProtocol.statuses[:]
+        prot.run()
+        
+        self.assertTrue(prot.isFinished())
+        self.assertEqual([[STATUS_FINISHED, STATUS_RUNNING]],
+                         MyFlushedProtocol.statuses)
+        self.assertTrue(all(s.isFinished() for s in prot.loadSteps()))
+        
+        # Without the periodic flush the first step is not written yet
+        prot.stepsFlushInterval = 3600
+        prot._steps = []
+        del MyFlushedProtocol.statuses[:]
+        prot.runMode.set(MODE_RESTART)
+        prot.run()
+        self.assertNotEqual(STATUS_FINISHED,
+                            MyFlushedProtocol.statuses[0][0])
+        
+    def test_itemsSteps(self):
+        """ Items are grouped in steps and the items done
+        are not processed again when resuming.
+        """
+        fn = self.getOutputPath("protocol_items.sqlite")
+        mapper = SqliteMapper(fn, globals())
+        prot = MyItemsProtocol(mapper=mapper, n=1000, failAt=517,
+                               workingDir=self.getOutputPath('items'))
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        prot.makePathsAndClean()
+        del MyItemsProtocol.calls[:]
+        prot.run()
+        
+        self.assertTrue(prot.isFailed())
+        self.assertEqual(1000 / 50, len(prot._steps))
+        self.assertEqual(range(517), MyItemsProtocol.calls)
+        
+        prot.failAt.set(None)
+        prot._steps = []
+        del MyItemsProtocol.calls[:]
+        prot.run()
+        self.assertTrue(prot.isFinished())
+        self.assertEqual(range(517, 1000), MyItemsProtocol.calls)
+        
+        # Few items are splitted between the parallel workers
+        self.assertEqual(3, prot._getItemsChunkSize(10))
+        prot.numberOfThreads.set(4)
+        self.assertEqual(1, prot._getItemsChunkSize(10))
+
+    def _createSteps(self, n, m, func):
+        """ Create n iterations of an init step, m parallel
+        steps depending on it and an end step (as ProtTestParallel).
+        """
+        steps = []
+
+        def _addStep(prerequisites):
+            step = FunctionStep(func, 'func', len(steps) + 1)
+            for i in prerequisites:
+                step._prerequisites.append(i)
+            steps.append(step)
+            step._index = len(steps)
+            return step._index
+
+        deps = []
+        for _ in range(n):
+            initId = _addStep(deps)
+            deps = [_addStep([initId]) for _ in range(m)]
+            deps = [_addStep(deps)]
+        return steps
+
+    def test_ThreadStepExecutor(self):
+        events = []  # ('start'|'end', stepIndex) in order
+
+        def _func(index):
+            events.append(('end', index))
+
+        def _started(step):
+            events.append(('start', step.getIndex()))
+
+        steps = self._createSteps(50, 8, _func)
+        executor = ThreadStepExecutor(None, 4)
+        executor.runSteps(steps, _started, lambda step: True)
+
+        self.assertTrue(all(s.isFinished() for s in steps))
+        # Each step should start after all its prerequisites ended
+        order = dict((e, i) for i, e in enumerate(events))
+        for step in steps:
+            for p in step._prerequisites:
+                self.assertTrue(order[('end', p)] < order[('start', step.getIndex())])
+
+        # If an step fails, the steps depending on it should not run
+        def _failFunc(index):
+            if index == 3:
+                raise Exception('Failing for testing purposes')
+
+        steps = self._createSteps(3, 2, _failFunc)
+        executor.runSteps(steps, lambda step: None,
+                          lambda step: not step.isFailed())
+        self.assertTrue(steps[2].isFailed())
+        self.assertEqual(STATUS_NEW, steps[-1].getStatus())
+
+    def test_stepsResources(self):
+        """ Steps requesting several cores should be packed
+        without exceeding the cores and memory of the executor.
+        """
+        import threading, time
+        lock = threading.Lock()
+        used = {'cores': 0, 'memory': 0}
+        maxUsed = {'cores': 0, 'memory': 0}
+
+        def _func(index):
+            step = steps[index - 1]
+            with lock:
+                for k, v in [('cores', step.getCores()),
+                             ('memory', step.getMemory())]:
+                    used[k] += v
+                    maxUsed[k] = max(maxUsed[k], used[k])
+            time.sleep(0.01)
+            with lock:
+                used['cores'] -= step.getCores()
+                used['memory'] -= step.getMemory()
+
+        # Iterations of 8 one-core steps depending on an 8-core step
+        steps = self._createSteps(5, 8, _func)
+        for i, step in enumerate(steps):
+            if i % 10 == 0:
+                step.setResources(cores=8, memory=1000)
+            else:
+                step.setResources(cores=1, memory=100)
+        executor = ThreadStepExecutor(None, 8, maxCores=8, maxMemory=1000)
+        executor.runSteps(steps, lambda step: None, lambda step: True)
+        self.assertTrue(all(s.isFinished() for s in steps))
+        self.assertTrue(maxUsed['cores'] <= 8)
+        self.assertTrue(maxUsed['memory'] <= 1000)
+
+        # Steps requesting more than available should run anyway
+        steps = self._createSteps(2, 2, _func)
+        for step in steps:
+            step.setResources(cores=16)
+        executor = ThreadStepExecutor(None, 4, maxCores=4)
+        executor.runSteps(steps, lambda step: None, lambda step: True)
+        self.assertTrue(all(s.isFinished() for s in steps))
+        self.assertEqual(16, maxUsed['cores'])
+
+
+    def test_ArrayStepExecutor(self):
+        """ Several array tasks should run each step once,
+        waiting for the prerequisites run by other tasks.
+        """
+        import threading
+        claimsFn = self.getOutputPath('steps_claims.sqlite')
+        pwutils.cleanPath(claimsFn)
+        runs = []  # (taskId, stepIndex)
+        
+        def _runTask(taskId):
+            def _func(index):
+                runs.append((taskId, index))
+            steps = self._createSteps(3, 8, _func)
+            steps[-1].setMainProcess(True)
+            executor = ArrayStepExecutor(None, claimsFn, taskId, 4)
+            executor.runSteps(steps, lambda step: None, lambda step: True)
+            
+        threads = [threading.Thread(target=_runTask, args=(i+1,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # All steps but the last one (that should be run in the main
+        # process, so none of the following) run exactly once
+        self.assertEqual(range(1, 30), sorted(index for _, index in runs))
+        
+        # The final run of the protocol runs the remaining steps
+        fn = self.getOutputPath("protocol_array.sqlite")
+        prot = MyArrayProtocol(mapper=SqliteMapper(fn, globals()), n=10,
+                               workingDir=self.getOutputPath('array'))
+        prot.makePathsAndClean()
+        del MyArrayProtocol.calls[:]
+        for taskId in [1, 2]:
+            prot._insertAllSteps()
+            executor = ArrayStepExecutor(None, prot.getStepsClaimsFile(), taskId, 2)
+            executor.runSteps(prot._steps, lambda step: None, lambda step: True)
+            prot._steps = []
+        self.assertEqual(range(1, 11), sorted(MyArrayProtocol.calls))
+        del MyArrayProtocol.calls[:]
+        prot._stepsExecutor = StepExecutor(None)
+        prot.run()
+        self.assertTrue(prot.isFinished())
+        self.assertEqual(['output'], MyArrayProtocol.calls)
+        steps = prot.loadSteps()
+        self.assertTrue(all(s.isFinished() for s in steps))
+        self.assertTrue(all(s.wallTime.hasValue() for s in steps))
+        
+    def test_stepsProfile(self):
+        """ The resources used by each step (including its child
+        processes) should be stored in the steps db.
+        """
+        from pyworkflow.protocol.profiling import (formatStepsProfile,
+                                                   getFunctionsProfile)
+        for i, executor in enumerate([StepExecutor(None),
+                                      ThreadStepExecutor(None, 2)]):
+            fn = self.getOutputPath("protocol_profile%d.sqlite" % i)
+            prot = MyProfiledProtocol(mapper=SqliteMapper(fn, globals()), n=3,
+                                      workingDir=self.getOutputPath('profile%d' % i))
+            prot._stepsExecutor = executor
+            prot.run()
+            
+            self.assertTrue(prot.isFinished())
+            steps = prot.loadSteps()
+            for step in steps:
+                self.assertTrue(step.wallTime.get() > 0)
+                # Most cpu is used by the child process
+                self.assertTrue(step.cpuUser.get() + step.cpuSystem.get() > 0.01)
+                self.assertTrue(step.maxRss.get() > 0)
+                self.assertTrue(step.readBytes.get() >= 0)
+                self.assertTrue(step.writeBytes.get() >= 0)
+                
+            functions = getFunctionsProfile(steps)
+            self.assertEqual(['busyStep'], functions.keys())
+            self.assertEqual(3, functions['busyStep']['count'])
+            self.assertAlmostEqual(sum(s.wallTime.get() for s in steps),
+                                   functions['busyStep']['wallTime'])
+            lines = formatStepsProfile(steps, 2)
+            self.assertEqual(2, len([l for l in lines if l.startswith('busyStep')]) - 1)
+
+
+    def test_streaming(self):
+        """ A protocol should process the items of its input
+        set while it is produced, and finish when it is closed.
+        """
+        import threading, time
+        for i, executor in enumerate([StepExecutor(None),
+                                      ThreadStepExecutor(None, 2)]):
+            fn = self.getOutputPath("protocol_producer%d.sqlite" % i)
+            producer = MyStreamProducer(mapper=SqliteMapper(fn, globals()), n=5,
+                                        workingDir=self.getOutputPath('producer%d' % i))
+            producer.makePathsAndClean()
+            producer._stepsExecutor = StepExecutor(None)
+            producerThread = threading.Thread(target=producer.run)
+            producerThread.start()
+            while not hasattr(producer, 'outputImages'):
+                time.sleep(0.01)
+            
+            # The input set is opened as it is stored in the project
+            outputImages = producer.outputImages
+            inputImages = SetOfImages(filename=outputImages.getFileName())
+            inputImages.setStreamState(outputImages.getStreamState())
+            fn = self.getOutputPath("protocol_streaming%d.sqlite" % i)
+            prot = MyStreamingProtocol(mapper=SqliteMapper(fn, globals()),
+                                       workingDir=self.getOutputPath('streaming%d' % i))
+            prot.inputImages.set(inputImages)
+            prot.stepsCheckSecs = 0.05
+            prot._stepsExecutor = executor
+            prot.makePathsAndClean()
+            self.assertTrue(prot.hasStreamingInput())
+            del MyStreamingProtocol.calls[:]
+            prot.run()
+            producerThread.join()
+            
+            self.assertTrue(producer.isFinished())
+            self.assertTrue(producer.outputImages.isStreamClosed())
+            self.assertTrue(prot.isFinished())
+            self.assertEqual(range(1, 26), sorted(MyStreamingProtocol.calls[:-1]))
+            self.assertEqual('output', MyStreamingProtocol.calls[-1])
+            # The steps were inserted while the images were produced
+            steps = prot.loadSteps()
+            self.assertTrue(len(steps) > 2)
+            self.assertEqual(len(prot._steps), len(steps))
+            self.assertTrue(all(s.isFinished() for s in steps))
+
+            
+    def test_streamingOutputs(self):
+        """ The CTF of the micrographs should be estimated while
+        they are imported, producing also the output in streaming.
+        """
+        import threading, time
+        import numpy as np
+        import pyworkflow.em.mrc as mrc
+        micsDir = self.getOutputPath('streaming_mics')
+        pwutils.makePath(micsDir)
+        for i in range(1, 5):
+            mrc.writeData(np.ones((8, 8), dtype=np.float32) * i,
+                          os.path.join(micsDir, 'mic%02d.mrc' % i))
+        
+        fn = self.getOutputPath("protocol_import_mics.sqlite")
+        producer = MySlowImportMicrographs(mapper=SqliteMapper(fn, globals()),
+                                           workingDir=self.getOutputPath('import_mics'))
+        producer.filesPath.set(micsDir)
+        producer.filesPattern.set('mic*.mrc')
+        producer.makePathsAndClean()
+        producer._stepsExecutor = StepExecutor(None)
+        producerThread = threading.Thread(target=producer.run)
+        producerThread.start()
+        while not hasattr(producer, 'outputMicrographs'):
+            time.sleep(0.01)
+        
+        # The input set is opened as it is stored in the project
+        outputMics = producer.outputMicrographs
+        inputMics = SetOfMicrographs(filename=outputMics.getFileName())
+        inputMics.setStreamState(outputMics.getStreamState())
+        fn = self.getOutputPath("protocol_streaming_ctf.sqlite")
+        prot = MyStreamingCTFProtocol(mapper=SqliteMapper(fn, globals()),
+                                      workingDir=self.getOutputPath('streaming_ctf'))
+        # The relations need the input stored, as in the project
+        prot.mapper.insert(inputMics)
+        prot.inputMicrographs.set(inputMics)
+        prot.numberOfThreads.set(2)
+        prot.stepsCheckSecs = 0.05
+        prot._stepsExecutor = ThreadStepExecutor(None, 2)
+        prot.makePathsAndClean()
+        self.assertTrue(prot.hasStreamingInput())
+        del MyCTFProtocol.calls[:]
+        del MyStreamingCTFProtocol.inputOpen[:]
+        prot.run()
+        producerThread.join()
+        
+        self.assertTrue(producer.isFinished())
+        self.assertTrue(producer.outputMicrographs.isStreamClosed())
+        self.assertEqual(4, producer.outputMicrographs.getSize())
+        self.assertTrue(prot.isFinished())
+        self.assertEqual(['mic%02d.mrc' % i for i in range(1, 5)],
+                         sorted(MyCTFProtocol.calls))
+        # Some CTF models were added to the output while importing
+        self.assertEqual(4, len(MyStreamingCTFProtocol.inputOpen))
+        self.assertTrue(MyStreamingCTFProtocol.inputOpen[0])
+        # The output was closed with the CTF of all the micrographs
+        outputCTF = SetOfCTF(filename=prot.outputCTF.getFileName())
+        outputCTF.loadStreamState()
+        self.assertTrue(outputCTF.isStreamClosed())
+        self.assertEqual([1, 2, 3, 4], sorted(ctf.getObjId() for ctf in outputCTF))
+        # The steps were inserted while the micrographs were imported
+        steps = prot.loadSteps()
+        self.assertTrue(len(steps) > 2)
+        self.assertTrue(all(s.isFinished() for s in steps))
+
+
+class TestProcessStepExecutor(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+
+    def _newRunProtocol(self, nProcs, **kwargs):
+        """ Return the protocol loaded from its run db (as done when
+        launching it) to be run with a ProcessStepExecutor.
+        """
+        from pyworkflow.em.protocol.parallel import ProtTestParallel
+        from pyworkflow.protocol.constants import MODE_RESTART
+        from pyworkflow.protocol.executor import ProcessStepExecutor
+        from pyworkflow.protocol.protocol import getProtocolFromDb
+
+        prot = self.proj.newProtocol(ProtTestParallel, **kwargs)
+        # Prepare the protocol run db as done when launching it
+        self.proj._setupProtocol(prot)
+        prot.makePathsAndClean()
+        self.proj.mapper.commit()
+        pwutils.copyFile(self.proj.dbPath, prot.getDbPath())
+
+        prot2 = getProtocolFromDb(self.proj.path, prot.getDbPath(),
+                                  prot.getObjId())
+        prot2.runMode.set(MODE_RESTART)
+        prot2.setStepsExecutor(ProcessStepExecutor(None, nProcs, self.proj.path,
+                                                   prot.getDbPath(),
+                                                   prot.getObjId()))
+        return prot2
+
+    def test_runSteps(self):
+        prot2 = self._newRunProtocol(3, numberOfIterations=2,
+                                     numberOfParallelSleeps=4, sleepSecs=0)
+        prot2.run()
+
+        self.assertEqual(STATUS_FINISHED, prot2.getStatus())
+        self.assertTrue(all(s.isFinished() for s in prot2._steps))
+        # The profile is sent back from the worker processes
+        self.assertTrue(all(s.wallTime.hasValue() for s in prot2._steps))
+
+    def test_differentSteps(self):
+        """ Steps defined by the workers that are not the same
+        as in the main process should fail, not be run.
+        """
+        import Queue
+        import pyworkflow.protocol.executor as executor
+        from pyworkflow.protocol.claims import getStepKey
+
+        prot2 = self._newRunProtocol(2, numberOfIterations=1,
+                                     numberOfParallelSleeps=2, sleepSecs=0)
+        prot2._insertAllSteps()
+        step = prot2._steps[1]
+        executor._workerProtocol = prot2
+        executor._workerQueue = Queue.Queue()
+        try:
+            _, error, _, _ = executor._runStepInWorker(1, 'otherKey')
+            self.assertTrue('different' in error)
+            self.assertFalse(step.isFinished())
+            # Steps missing in the worker
+            _, error, _, _ = executor._runStepInWorker(len(prot2._steps),
+                                                       getStepKey(step))
+            self.assertTrue(error is not None)
+            self.assertEqual((1, os.getpid()), executor._workerQueue.get())
+        finally:
+            executor._workerProtocol = None
+            executor._workerQueue = None
+
+    def test_workerCores(self):
+        """ runJob should use the cores of the step run by the worker. """
+        import Queue
+        import pyworkflow.protocol.executor as executor
+        from pyworkflow.protocol.claims import getStepKey
+
+        prot2 = self._newRunProtocol(2, numberOfIterations=1,
+                                     numberOfParallelSleeps=2, sleepSecs=0)
+        prot2._insertAllSteps()
+        step = prot2._steps[1]
+        step.setResources(cores=3)
+        jobs = []
+        prot2._stepsExecutor.runJob = lambda log, prog, args, **kwargs: jobs.append(kwargs)
+        executor._workerProtocol = prot2
+        executor._workerQueue = Queue.Queue()
+        try:
+            _, error, _, _ = executor._runStepInWorker(1, getStepKey(step))
+            self.assertTrue(error is None)
+            self.assertEqual(1, len(jobs))
+            self.assertEqual(3, jobs[0]['numberOfThreads'])
+            self.assertEqual(1, jobs[0]['numberOfMpi'])
+        finally:
+            executor._workerProtocol = None
+            executor._workerQueue = None
+
+    def test_deadWorker(self):
+        """ The step run by a worker that dies should fail,
+        instead of waiting forever for its result.
+        """
+        import os, threading, time, signal
+        prot2 = self._newRunProtocol(2, numberOfIterations=1,
+                                     numberOfParallelSleeps=2, sleepSecs=3)
+        executor = prot2._stepsExecutor
+        runThread = threading.Thread(target=prot2.run)
+        runThread.start()
+
+        # Kill a worker while it is running a sleep step
+        pid = None
+        start = time.time()
+        while pid is None and time.time() - start < 30:
+            time.sleep(0.05)
+            pending = getattr(executor, '_pending', {})
+            workerSteps = dict(getattr(executor, '_workerSteps', {}))
+            for p, index in workerSteps.iteritems():
+                if index in pending and prot2._steps[index].funcName.get() == 'sleepStep':
+                    pid = p
+        self.assertTrue(pid is not None)
+        os.kill(pid, signal.SIGKILL)
+        runThread.join(60)
+
+        self.assertFalse(runThread.isAlive())
+        self.assertEqual(STATUS_FAILED, prot2.getStatus())
+        self.assertTrue(any('died' in s.getErrorMessage()
+                            for s in prot2._steps if s.isFailed()))
+
+
+# Fake queue system that runs the jobs (and the tasks of array
+# jobs) as local subprocesses, waiting for them to finish
+FAKE_QUEUE = """
+import os, sys, subprocess
+# Usage: fakequeue.py [--array N | --after JOBID] SCRIPT
+args = sys.argv[1:]
+nTasks = int(args[1]) if args[0] == '--array' else 0
+script = args[-1]
+procs = []
+for taskId in range(1, nTasks + 1) or [0]:
+    env = dict(os.environ, FAKE_QUEUE_TASK_ID=str(taskId))
+    out = open('%s.%d.out' % (script, taskId), 'w')
+    procs.append(subprocess.Popen(['bash', script], env=env, stdout=out,
+                                  stderr=subprocess.STDOUT))
+for p in procs:
+    p.wait()
+print 'Submitted job %d' % os.getpid()
+"""
+
+
+class TestArrayJob(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestProject(cls)
+        fakeQueue = cls.getOutputPath('fakequeue.py')
+        with open(fakeQueue, 'w') as f:
+            f.write(FAKE_QUEUE)
+        
+        def submit(options):
+            return '%s %s %s %%(JOB_SCRIPT)s' % (sys.executable, fakeQueue, options)
+        
+        queueSystem = cls.proj.getHostConfig('localhost').getQueueSystem()
+        queueSystem.setName('FakeQueue')
+        queueSystem.setSubmitTemplate('#!/bin/bash\n%(JOB_COMMAND)s\n')
+        queueSystem.setSubmitCommand(submit(''))
+        queueSystem.submitArrayCommand.set(submit('--array %(JOB_ARRAY_SIZE)d'))
+        queueSystem.submitDependentCommand.set(submit('--after %(JOB_DEPENDENCY)s'))
+        queueSystem.arrayTaskId.set('$FAKE_QUEUE_TASK_ID')
+        queueSystem.setQueues({'default': []})
+        queueSystem.queuesDefault = {}
+
+    def test_submitArray(self):
+        from pyworkflow.em.protocol.parallel import ProtTestParallel
+        from pyworkflow.protocol.claims import StepsClaimsDb
+
+        prot = self.newProtocol(ProtTestParallel, numberOfIterations=2,
+                                numberOfParallelSleeps=8, sleepSecs=0)
+        prot.stepsInProcesses = True
+        prot._useQueue.set(True)
+        prot.setQueueParams(('default', {'JOB_ARRAY_TASKS': 3}))
+        self.launchProtocol(prot)
+
+        # Both the array and the final job were submitted
+        self.assertEqual(2, len(prot.getJobId().split()))
+        claims = StepsClaimsDb(prot.getStepsClaimsFile())
+        finished = claims.getFinished()
+        claims.close()
+        self.assertEqual(20, len(finished))
+        self.assertTrue(set(task for _, task, _ in finished.values()) <= set([1, 2, 3]))
+        steps = prot.loadSteps()
+        self.assertTrue(all(s.isFinished() for s in steps))
+        
+
+class TestStepsCache(BaseTest):
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _runProtocol(self, name, n):
+        mapper = SqliteMapper(self.getOutputPath('%s.sqlite' % name), globals())
+        prot = MyCachedProtocol(mapper=mapper, n=n,
+                                workingDir=self.getOutputPath(name))
+        prot.makePathsAndClean()
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        del MyCachedProtocol.calls[:]
+        prot.run()
+        self.assertTrue(prot.isFinished())
+        return prot
+
+    def test_cache(self):
+        cache = StepsCache(self.getOutputPath('cache'))
+        MyCachedProtocol.cache = cache
+        # All steps run the first time and results are stored
+        prot1 = self._runProtocol('run1', 3)
+        self.assertEqual([1, 2, 3], MyCachedProtocol.calls)
+        entries = list(cache.iterEntries())
+        self.assertEqual(3, len(entries))
+        self.assertTrue(all(e['funcName'] == 'writeStep' for e in entries))
+
+        # Other run with the same steps take the results from the cache
+        prot2 = self._runProtocol('run2', 4)
+        self.assertEqual([4], MyCachedProtocol.calls)
+        fn1 = prot1._getExtraPath('out_02.txt')
+        fn2 = prot2._getExtraPath('out_02.txt')
+        self.assertEqual(open(fn1).read(), open(fn2).read())
+        self.assertEqual(os.stat(fn1).st_ino, os.stat(fn2).st_ino)
+
+        # Modified cached files should not be restored
+        f = open(fn1, 'a')
+        f.write('modified')
+        f.close()
+        self._runProtocol('run3', 2)
+        self.assertEqual([2], MyCachedProtocol.calls)
+
+        # Prune the cache
+        cache.prune(maxAge=1)
+        self.assertEqual(4, len(list(cache.iterEntries())))
+        size = cache.getSize()
+        removed = cache.prune(maxSize=size - 1)
+        self.assertEqual(1, len(removed))
+        cache.prune(maxSize=0)
+        self.assertEqual(0, len(list(cache.iterEntries())))
+        MyCachedProtocol.cache = None
+
+    def _runCTFProtocol(self, name, inputMics, **params):
+        mapper = SqliteMapper(self.getOutputPath('%s.sqlite' % name), globals())
+        prot = MyCTFProtocol(mapper=mapper, workingDir=self.getOutputPath(name))
+        prot.inputMicrographs.set(inputMics)
+        prot.numberOfThreads.set(1)
+        for key, value in params.iteritems():
+            getattr(prot, key).set(value)
+        prot.makePathsAndClean()
+        prot._stepsExecutor = StepExecutor(hostConfig=None)
+        del MyCTFProtocol.calls[:]
+        prot.run()
+        self.assertTrue(prot.isFinished())
+        return prot
+
+    def test_cacheCTF(self):
+        """ The CTF estimation of a copied protocol should be taken
+        from the cache, unless its params are changed.
+        """
+        import numpy as np
+        import pyworkflow.em.mrc as mrc
+        mics = SetOfMicrographs(filename=self.getOutputPath('mics.sqlite'))
+        mics.setSamplingRate(1.0)
+        mics.getAcquisition().setMagnification(50000)
+        for i in range(1, 5):
+            micFn = self.getOutputPath('mic%02d.mrc' % i)
+            mrc.writeData(np.ones((8, 8), dtype=np.float32) * i, micFn)
+            mic = Micrograph()
+            mic.setFileName(micFn)
+            mic.setMicName('mic%02d' % i)
+            mics.append(mic)
+        mics.write()
+        
+        MyCTFProtocol.cache = StepsCache(self.getOutputPath('cache_ctf'))
+        try:
+            prot1 = self._runCTFProtocol('ctf1', mics)
+            self.assertEqual(['mic01', 'mic02', 'mic03', 'mic04'],
+                             MyCTFProtocol.calls)
+            
+            # A copy of the protocol takes the results from the cache
+            prot2 = self._runCTFProtocol('ctf2', mics)
+            self.assertEqual([], MyCTFProtocol.calls)
+            for i in range(1, 5):
+                fn1 = prot1._getExtraPath('mic%02d' % i, 'ctf.txt')
+                fn2 = prot2._getExtraPath('mic%02d' % i, 'ctf.txt')
+                self.assertEqual(os.stat(fn1).st_ino, os.stat(fn2).st_ino)
+            
+            # But not if the estimation params are changed
+            prot3 = self._runCTFProtocol('ctf3', mics, lowRes=0.1)
+            self.assertEqual(4, len(MyCTFProtocol.calls))
+            self.assertTrue(open(prot3._getExtraPath('mic01', 'ctf.txt')).read().endswith('0.1\n'))
+        finally:
+            MyCTFProtocol.cache = None
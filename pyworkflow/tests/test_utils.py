@@ -7,6 +7,9 @@ Created on Mar 25, 2014
 '''
 import os, time
 import unittest
+import threading
+import pickle
+import Queue
 from os.path import join, dirname, exists
 from StringIO import StringIO
 from bibtexparser.bparser import BibTexParser   
@@ -15,6 +18,7 @@ import pyworkflow as pw
 
 from subprocess import Popen
 from pyworkflow.utils.process import killWithChilds
+from pyworkflow.utils.mpi import TAG_RUN_JOB
 from pyworkflow.tests import *
 
 
@@ -84,6 +88,175 @@ class TestProccess(BaseTest):
         killWithChilds(p.pid)
 
 
+class TestLazyModule(BaseTest):
+    """ Check that heavy modules are only imported when used. """
+
+    def test_LazyModule(self):
+        from pyworkflow.utils.reflection import LazyModule
+        import json
+        lazyJson = LazyModule('json')
+        self.assertEqual(lazyJson.dumps([1]), json.dumps([1]))
+        # The import only fails when accessing the module
+        missing = LazyModule('not_existing_module_name')
+        self.assertRaises(ImportError, getattr, missing, 'anything')
+
+    def test_EmImports(self):
+        import sys
+        import subprocess
+        code = ("import sys\n"
+                "import pyworkflow.em\n"
+                "print [m for m in ['matplotlib', 'Tkinter', 'PIL', 'xmipp', "
+                "'pyworkflow.gui'] if m in sys.modules]\n")
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), '[]')
+
+
+class FakeRequest():
+    """ Request returned by FakeComm non-blocking functions. """
+    def __init__(self, mailbox=None, value=None, isDone=None):
+        self.mailbox = mailbox
+        self.value = value
+        self.isDone = isDone
+
+    def test(self):
+        if self.isDone is not None:
+            return self.isDone(), self.value
+        if self.mailbox is None:
+            return True, self.value
+        try:
+            self.value = self.mailbox.get_nowait()
+            self.mailbox = None
+            return True, self.value
+        except Queue.Empty:
+            return False, None
+
+
+class FakeComm():
+    """ In-process replacement of an MPI communicator, where
+    each rank is used from a different thread.
+    As for big messages in MPI, isend requests are not done
+    until a matching irecv has been posted.
+    """
+    def __init__(self, rank, mailboxes):
+        self.rank = rank
+        self.mailboxes = mailboxes  # {(source, dest, tag): Queue}
+        # Number of isend and irecv calls for each (source, dest, tag)
+        self.sends = mailboxes.setdefault('sends', {})
+        self.recvs = mailboxes.setdefault('recvs', {})
+        self.lock = mailboxes.setdefault('lock', threading.Lock())
+        
+    def _getMailbox(self, source, dest, tag):
+        with self.lock:
+            return self.mailboxes.setdefault((source, dest, tag), Queue.Queue())
+    
+    def Get_rank(self):
+        return self.rank
+    
+    def send(self, obj, dest, tag):
+        # Pickle the message, as mpi4py does
+        self._getMailbox(self.rank, dest, tag).put(pickle.loads(pickle.dumps(obj)))
+        
+    def isend(self, obj, dest, tag):
+        key = (self.rank, dest, tag)
+        with self.lock:
+            n = self.sends.get(key, 0)
+            self.sends[key] = n + 1
+        self.send(obj, dest, tag)
+        return FakeRequest(isDone=lambda: self.recvs.get(key, 0) > n)
+    
+    def irecv(self, source, tag):
+        key = (source, self.rank, tag)
+        with self.lock:
+            self.recvs[key] = self.recvs.get(key, 0) + 1
+        return FakeRequest(self._getMailbox(source, self.rank, tag))
+    
+    
+class TestMPI(BaseTest):
+    """ Test the dispatch of jobs to MPI slaves, using FakeComm. """
+
+    @classmethod
+    def setUpClass(cls):
+        setupTestOutput(cls)
+
+    def _startSlaves(self, n):
+        from pyworkflow.utils.mpi import runJobMPISlave
+        mailboxes = {}
+        self.slaves = []
+        for rank in range(1, n+1):
+            t = threading.Thread(target=runJobMPISlave,
+                                 args=(FakeComm(rank, mailboxes),))
+            t.daemon = True
+            t.start()
+            self.slaves.append(t)
+        return FakeComm(0, mailboxes)
+
+    def test_runJobMPI(self):
+        from pyworkflow.utils.mpi import runJobMPI
+        comm = self._startSlaves(1)
+        outFn = self.getOutputPath('mpi_out.txt')
+        env = dict(os.environ, MPI_TEST_VALUE='scipion')
+        runJobMPI('echo $MPI_TEST_VALUE `pwd` >', [outFn], comm, 1,
+                  env=env, cwd=self.getOutputPath())
+        self.assertEqual('scipion %s\n' % os.path.realpath(self.getOutputPath()),
+                         open(outFn).read())
+        self.assertRaises(Exception, runJobMPI, 'false', [], comm, 1)
+        # The slave should continue after a failed job
+        runJobMPI('true', [], comm, 1)
+        comm.send('None', dest=1, tag=TAG_RUN_JOB+1)
+        self.slaves[0].join(10)
+        self.assertFalse(self.slaves[0].is_alive())
+
+    def test_pipelinedJobs(self):
+        """ A job sent to a slave that is running a previous one
+        should wait for it, even if it takes longer than TIMEOUT.
+        """
+        import pyworkflow.utils.mpi as mpi
+        from pyworkflow.protocol.executor import MPIStepExecutor
+        from pyworkflow.protocol.protocol import FunctionStep
+        comm = self._startSlaves(1)
+        executor = MPIStepExecutor(None, 1, comm, pipeline=2)
+
+        def _runJob(secs):
+            executor.runJob(None, 'sleep', [secs])
+
+        steps = [FunctionStep(_runJob, '_runJob', secs) for secs in [2, 0]]
+        for i, step in enumerate(steps):
+            step._index = i + 1
+        timeout = mpi.TIMEOUT
+        mpi.TIMEOUT = 0.5
+        try:
+            executor.runSteps(steps, lambda step: None, lambda step: True)
+        finally:
+            mpi.TIMEOUT = timeout
+        self.assertTrue(all(s.isFinished() for s in steps))
+        self.slaves[0].join(10)
+        self.assertFalse(self.slaves[0].is_alive())
+
+    def test_MPIStepExecutor(self):
+        from pyworkflow.protocol.executor import MPIStepExecutor
+        from pyworkflow.protocol.protocol import FunctionStep
+        nSlaves = 3
+        comm = self._startSlaves(nSlaves)
+        executor = MPIStepExecutor(None, nSlaves, comm)
+
+        def _runJob(i):
+            executor.runJob(None, 'true', [])
+
+        steps = []
+        for i in range(60):
+            steps.append(FunctionStep(_runJob, '_runJob', i))
+            steps[-1]._index = i + 1
+        t0 = time.time()
+        executor.runSteps(steps, lambda step: None, lambda step: True)
+        elapsed = time.time() - t0
+        self.assertTrue(all(s.isFinished() for s in steps))
+        # Jobs are not delayed by polling with long sleeps
+        self.assertTrue(elapsed < 10, "60 jobs took %0.2f seconds" % elapsed)
+        for t in self.slaves:
+            t.join(10)
+            self.assertFalse(t.is_alive())
+
+
 
 if __name__ == '__main__':
     unittest.main()        
@@ -26,11 +26,18 @@
 """
 MPI utilities. runJobMPI and runJobMPISlave send and receive the commands
 to execute, in the given directory and with the given environment.
+
+Each job is sent in a single message (command, cwd, env, replyTag) and
+the slave answers to the replyTag with 0 or the error message.
+Slaves run the jobs in the order they are received, so several jobs
+can be sent to the same slave (using different reply tags) and the
+next one will start as soon as the current one finishes. While a job
+is running, the slave is already waiting for the next one, so one
+more job can be sent to it without blocking.
 """
 
 import os
 from time import time, sleep
-from cPickle import dumps, loads
 from process import buildRunCommand, runCommand
 
 from pyworkflow.utils.utils import envVarOn, getLocalHostName
@@ -38,37 +45,45 @@ from pyworkflow.utils.utils import envVarOn, getLocalHostName
 
 TIMEOUT = 60  # seconds trying to send/receive data through a socket
 
-TAG_RUN_JOB = 1000
+TAG_RUN_JOB = 1000  # tag of the jobs sent to each slave: TAG_RUN_JOB + rank
+TAG_JOB_DONE = 20000  # default tag for the results: TAG_JOB_DONE + rank
 
+# Sleep times while waiting for a request: the wait starts with
+# MIN_SLEEP and it is doubled up to MAX_SLEEP, so short jobs are
+# attended quickly without keeping the cpu busy for long ones.
+MIN_SLEEP = 0.0005
+MAX_SLEEP = 0.1
 
-def send(command, comm, dest, tag):
-    """ Send command in a non-blocking way and raise exception on error. """
 
-    # This function blocks, but it uses the isend() function (which is
-    # nonblocking) and sleeps without using the cpu while we try to send.
-    # Also, if we cannot send after TIMEOUT seconds, raise exception.
+def wait(request, timeout=None):
+    """ Wait until a non-blocking request is done.
+    Return (done, value), done will be False if timeout
+    (in seconds) is reached before the request is done.
+    """
+    t0 = time()
+    delay = MIN_SLEEP
+    while True:
+        done, value = request.test()
+        if done:
+            return True, value
+        if timeout is not None and time() - t0 > timeout:
+            return False, None
+        sleep(delay)
+        delay = min(2 * delay, MAX_SLEEP)
 
-    if command.startswith('env='):
-        print "Sending environment to %d" % dest
-    else:
-        print "Sending command to %d: %s" % (dest, command)
 
-    # Send command with isend()
-    req_send = comm.isend(command, dest=dest, tag=tag)
-    t0 = time()
-    while not req_send.test()[0]:
-        sleep(1)
-        if time() - t0 > TIMEOUT:
-            raise Exception("Timeout in process %d, cannot send command "
-                            "to slave." % os.getpid())
+def send(message, comm, dest, tag, replyTag):
+    """ Send a message and wait for the result, raise exception on error. """
+
+    # This function blocks, but it uses the isend() function (which is
+    # nonblocking) and waits without using the cpu while we try to send.
+    # Also, if we cannot send after TIMEOUT seconds, raise exception.
+    if not wait(comm.isend(message, dest=dest, tag=tag), TIMEOUT)[0]:
+        raise Exception("Timeout in process %d, cannot send command "
+                        "to slave." % os.getpid())
 
     # Receive the result in a non-blocking way too (with irecv())
-    req_recv = comm.irecv(dest=dest, tag=tag)
-    while True:
-        done, result = req_recv.test()
-        if done:
-            break
-        sleep(1)
+    _, result = wait(comm.irecv(source=dest, tag=replyTag))
 
     if result != 0:  # result will then be a string with the error
         raise Exception(str(result))
@@ -76,16 +91,19 @@ def send(command, comm, dest, tag):
 
 def runJobMPI(programname, params, mpiComm, mpiDest,
               numberOfMpi=1, hostConfig=None,
-              env=None, cwd=None):
-    """ Send the command to the MPI node in which it will be executed. """
-
+              env=None, cwd=None, replyTag=None):
+    """ Send the command to the MPI node in which it will be executed.
+    Params:
+        replyTag: tag where the result will be received, different
+            threads sending jobs to the same node should use different
+            tags. By default TAG_JOB_DONE + mpiDest.
+    """
     command = buildRunCommand(programname, params, numberOfMpi, hostConfig, env)
-    if cwd is not None:
-        send("cwd=%s" % cwd, mpiComm, mpiDest, TAG_RUN_JOB+mpiDest)
-    if env is not None:
-        send("env=%s" % dumps(env), mpiComm, mpiDest, TAG_RUN_JOB+mpiDest)
-
-    send(command, mpiComm, mpiDest, TAG_RUN_JOB+mpiDest)
+    if replyTag is None:
+        replyTag = TAG_JOB_DONE + mpiDest
+    print "Sending command to %d: %s" % (mpiDest, command)
+    send((command, cwd, env, replyTag), mpiComm, mpiDest,
+         TAG_RUN_JOB + mpiDest, replyTag)
 
 
 def runJobMPISlave(mpiComm):
@@ -97,55 +115,35 @@ def runJobMPISlave(mpiComm):
     print "Running runJobMPISlave: ", rank
 
     # Listen for commands until we get 'None'
-    cwd = None  # We run without changing directory by default
-    env = None  # And we don't change the environment either!
-    
+    request = mpiComm.irecv(source=0, tag=TAG_RUN_JOB+rank)
     while True:
         # Receive command in a non-blocking way
-        req_recv = mpiComm.irecv(dest=0, tag=TAG_RUN_JOB+rank)
-        while True:
-            done, command = req_recv.test()
-            if done:
-                break
-            sleep(1)
+        _, message = wait(request)
 
         print "Slave %s(rank %d) received command." % (hostname, rank)
-        if command == 'None':
+        if message == 'None':
             print "  Stopping..."
             return
 
+        # Post the receive of the next job before running this one,
+        # so the master can send it while this job is running
+        # (otherwise big messages can not be sent until this job ends)
+        request = mpiComm.irecv(source=0, tag=TAG_RUN_JOB+rank)
+        command, cwd, env, replyTag = message
         # Run the command and get the result (exit code or exception)
         try:
-            if command.startswith("cwd="):
-                cwd = command.split("=", 1)[-1]
+            if cwd is not None:
                 print "  Changing to dir %s ..." % cwd
-            elif command.startswith("env="):
-                env = loads(command.split("=", 1)[-1])
-                print "  Setting the environment..."
-                if envVarOn('SCIPION_DEBUG'):
-                    print env
-            else:
-                print "  %s" % command
-                runCommand(command, cwd=cwd, env=env)
-                cwd = None  # unset directory
-                env = None  # unset environment
+            if env is not None and envVarOn('SCIPION_DEBUG'):
+                print env
+            print "  %s" % command
+            runCommand(command, cwd=cwd, env=env)
+            result = 0  # it worked!
         except Exception as e:
-            req_send = mpiComm.isend(str(e), dest=0, tag=TAG_RUN_JOB+rank)
-            t0 = time()
-            while not req_send.test()[0]:
-                sleep(1)
-                if time() - t0 > TIMEOUT:
-                    print ("Timeout in process %d, cannot send error "
-                           "message to master." % os.getpid())
-                    return
-            return
+            result = str(e)
 
-        # Send 0 (it worked!) in a non-blocking way.
-        req_send = mpiComm.isend(0, dest=0, tag=TAG_RUN_JOB+rank)
-        t0 = time()
-        while not req_send.test()[0]:
-            sleep(1)
-            if time() - t0 > TIMEOUT:
-                print ("Timeout in process %d, cannot send result "
-                       "to master." % os.getpid())
-                return
+        # Send the result in a non-blocking way.
+        if not wait(mpiComm.isend(result, dest=0, tag=replyTag), TIMEOUT)[0]:
+            print ("Timeout in process %d, cannot send result "
+                   "to master." % os.getpid())
+            return
@@ -30,10 +30,12 @@ This module handles process execution
 
 import sys
 import os.path
+import errno
 import resource
-from subprocess import check_call
+from subprocess import check_call, Popen, CalledProcessError
 
 from utils import greenStr, envVarOn
+from profiler import getActiveProfiler
 
 
 # The job should be launched from the working directory!
@@ -62,9 +64,35 @@ def runCommand(command, env=None, cwd=None):
 
     # TODO: maybe have to set PBS_NODEFILE in case it is used by "command"
     # (useful for example with gnu parallel)
-    check_call(command, shell=True, stdout=sys.stdout, stderr=sys.stderr, env=env, cwd=cwd)
+    profiler = getActiveProfiler()
+    if profiler is None:
+        check_call(command, shell=True, stdout=sys.stdout, stderr=sys.stderr, env=env, cwd=cwd)
+    else:
+        _callProfiled(profiler, command, env, cwd)
     # It would be nice to avoid shell=True and calling buildRunCommand()...
 
+
+def _callProfiled(profiler, command, env=None, cwd=None):
+    """ Same as check_call, but waiting for the process with os.wait4
+    to add the resources used by it (and its children) to the profiler.
+    """
+    p = Popen(command, shell=True, stdout=sys.stdout, stderr=sys.stderr, env=env, cwd=cwd)
+    while True:
+        try:
+            _, status, usage = os.wait4(p.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    # Set the returncode, since the process was waited outside Popen
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    profiler.addChild(usage)
+    if p.returncode:
+        raise CalledProcessError(p.returncode, command)
+
     
 def buildRunCommand(programname, params, numberOfMpi, hostConfig=None, env=None):
     """ Return a string with the command line to run """
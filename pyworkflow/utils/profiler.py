@@ -0,0 +1,198 @@
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *              Laura del Cano         (ldelcano@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+"""
+This module measures the resources used while running some code
+(e.g. a protocol step): wall time, user/system cpu, peak memory and
+bytes read/written, including the child processes launched through
+runCommand (and so through runJob).
+"""
+
+import os
+import time
+import threading
+import resource
+
+
+# Seconds between samples of the process memory
+SAMPLE_INTERVAL = float(os.environ.get('SCIPION_PROFILE_INTERVAL', 0.5))
+
+# Profiler active in each thread (see getActiveProfiler)
+_local = threading.local()
+
+
+def _readThreadStats():
+    """ Return (user, system, readBytes, writeBytes) of the calling thread,
+    or None if not available (only in Linux, from /proc/thread-self).
+    """
+    try:
+        with open('/proc/thread-self/stat') as f:
+            # Skip the command name, it could contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/thread-self/io') as f:
+            io = dict(line.split(':') for line in f if ':' in line)
+    except (IOError, OSError):
+        return None
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    # utime and stime are the fields 14 and 15 of the stat file
+    return (int(fields[11]) / ticks, int(fields[12]) / ticks,
+            int(io['read_bytes']), int(io['write_bytes']))
+
+
+def _readProcessStats():
+    """ Same as _readThreadStats, but for the whole process.
+    Used when the thread stats are not available.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # The blocks are of 512 bytes
+    return (usage.ru_utime, usage.ru_stime,
+            usage.ru_inblock * 512, usage.ru_oublock * 512)
+
+
+class MemorySampler(threading.Thread):
+    """ Sample the memory (rss) of this process while there are
+    profilers running, as done by scripts/monitor.py with psutil.
+    A single sampler is shared by all profilers of the process.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.profilers = set()
+        self._event = threading.Event()
+        try:
+            import psutil
+            self._process = psutil.Process(os.getpid())
+        except Exception:
+            self._process = None
+
+    @classmethod
+    def register(cls, profiler):
+        with cls._lock:
+            sampler = cls._instance
+            if sampler is None or not sampler.isAlive():
+                sampler = cls._instance = MemorySampler(SAMPLE_INTERVAL)
+                sampler.start()
+            sampler.profilers.add(profiler)
+            sampler._event.set()
+        return sampler
+
+    @classmethod
+    def unregister(cls, profiler):
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.profilers.discard(profiler)
+
+    def getRss(self):
+        """ Return the current rss (in bytes) of the process. """
+        if self._process is None:
+            return 0
+        try:
+            return self._process.memory_info().rss
+        except Exception:
+            return 0
+
+    def run(self):
+        while True:
+            with self._lock:
+                profilers = list(self.profilers)
+                if not profilers:
+                    self._event.clear()
+            if not profilers:
+                # Sleep until some profiler is registered
+                self._event.wait()
+                continue
+            rss = self.getRss()
+            for p in profilers:
+                p.updateRss(rss)
+            time.sleep(self.interval)
+
+
+class Profiler():
+    """ Measure the resources used from start() to stop() by the
+    calling thread and the child processes that it runs with runCommand.
+    The cpu and io of the thread are read from /proc (Linux) or,
+    if not available, from the whole process. The memory of the thread
+    can not be separated from the process one, so the process rss
+    is used (sampled every SAMPLE_INTERVAL seconds).
+    """
+    def __init__(self):
+        self._maxRss = 0
+        self._children = [0, 0, 0, 0, 0] # user, system, maxRss, read, write
+        self._sampler = None
+
+    def start(self):
+        self._t0 = time.time()
+        self._readStats = _readThreadStats
+        self._stats0 = _readThreadStats()
+        if self._stats0 is None:
+            self._readStats = _readProcessStats
+            self._stats0 = _readProcessStats()
+        self._sampler = MemorySampler.register(self)
+        self.updateRss(self._sampler.getRss())
+        self._previous = getActiveProfiler()
+        _local.profiler = self
+
+    def updateRss(self, rss):
+        self._maxRss = max(self._maxRss, rss)
+
+    def addChild(self, usage):
+        """ Add the resources used by a child process that has finished.
+        Params:
+            usage: the resource usage returned by os.wait4
+        """
+        c = self._children
+        c[0] += usage.ru_utime
+        c[1] += usage.ru_stime
+        c[2] = max(c[2], usage.ru_maxrss * 1024) # ru_maxrss is in kB
+        c[3] += usage.ru_inblock * 512
+        c[4] += usage.ru_oublock * 512
+
+    def stop(self):
+        """ Stop measuring and return a dict with the values of:
+        wallTime, cpuUser, cpuSystem (in seconds), maxRss,
+        readBytes and writeBytes (in bytes).
+        """
+        _local.profiler = self._previous
+        MemorySampler.unregister(self)
+        self.updateRss(self._sampler.getRss())
+        stats = self._readStats()
+        user, system, read, write = [v1 - v0 for v0, v1
+                                     in zip(self._stats0, stats)]
+        c = self._children
+        return {'wallTime': time.time() - self._t0,
+                'cpuUser': user + c[0],
+                'cpuSystem': system + c[1],
+                'maxRss': max(self._maxRss, c[2]),
+                'readBytes': read + c[3],
+                'writeBytes': write + c[4]}
+
+
+def getActiveProfiler():
+    """ Return the Profiler running in the calling thread, or None. """
+    return getattr(_local, 'profiler', None)
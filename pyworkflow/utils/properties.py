@@ -100,6 +100,7 @@ class Message():
     LABEL_LOGS_OUTPUT = 'Output Log'
     LABEL_LOGS_ERROR = 'Error Log'
     LABEL_LOGS_SCIPION = 'Scipion Log'
+    LABEL_PROFILE = 'Profile'
     
     LABEL_RUNNAME = 'Run name'
     LABEL_EXECUTION = 'Run mode'
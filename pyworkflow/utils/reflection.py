@@ -34,6 +34,34 @@ from inspect import isclass
 
 
 
+class LazyModule(object):
+    """ Placeholder of a module that is only imported the first
+    time one of its attributes is accessed. It can be used for
+    heavy modules (e.g. the xmipp binding) that are not needed
+    by all the code importing them.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            __import__(self._name)
+            self.__dict__['_module'] = sys.modules[self._name]
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self._name
+
+
 def getModules(path):
     """ Try to find possible sub-modules under path.
     A dictionary will be returned with modules names
@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+# **************************************************************************
+# *
+# * Authors:     J.M. De la Rosa Trevin (jmdelarosa@cnb.csic.es)
+# *
+# * Unidad de  Bioinformatica of Centro Nacional de Biotecnologia , CSIC
+# *
+# * This program is free software; you can redistribute it and/or modify
+# * it under the terms of the GNU General Public License as published by
+# * the Free Software Foundation; either version 2 of the License, or
+# * (at your option) any later version.
+# *
+# * This program is distributed in the hope that it will be useful,
+# * but WITHOUT ANY WARRANTY; without even the implied warranty of
+# * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# * GNU General Public License for more details.
+# *
+# * You should have received a copy of the GNU General Public License
+# * along with this program; if not, write to the Free Software
+# * Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+# * 02111-1307  USA
+# *
+# *  All comments concerning this program package may be sent to the
+# *  e-mail address 'jmdelarosa@cnb.csic.es'
+# *
+# **************************************************************************
+"""
+Micro-benchmarks of some performance critical parts of Scipion.
+Usage: scipion benchmark BENCHMARK [options]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+import pyworkflow.utils as pwutils
+
+
+class Timer():
+    """ Simple helper to measure and print elapsed times. """
+    def __init__(self):
+        self.results = []
+
+    def measure(self, label, func, *args, **kwargs):
+        t0 = time.time()
+        result = func(*args, **kwargs)
+        elapsed = time.time() - t0
+        self.results.append((label, elapsed))
+        print "  %-40s %10.3f s" % (label, elapsed)
+        return result
+
+    def speedup(self, labelOld, labelNew):
+        times = dict(self.results)
+        if times[labelNew] > 0:
+            print "  %-40s %10.2f x" % ('speedup (%s)' % labelNew,
+                                        times[labelOld] / times[labelNew])
+
+
+#------------------- Sets benchmark ----------------------------
+
+def _createParticle():
+    from pyworkflow.em.data import Particle, CTFModel, Acquisition, Transform
+    import numpy as np
+
+    img = Particle()
+    img.setCTF(CTFModel())
+    img.setAcquisition(Acquisition(magnification=60000, voltage=300,
+                                   sphericalAberration=2.,
+                                   amplitudeContrast=0.1))
+    img.setTransform(Transform(np.eye(4)))
+    img.setSamplingRate(1.5)
+    return img
+
+
+def _iterParticles(img, n):
+    for i in range(n):
+        img.cleanObjId()
+        img.setLocation(i+1, 'particles.stk')
+        img.setMicId(i % 100 + 1)
+        img.getCTF().setStandardDefocus(10000 + i % 1000, 10500, 45.)
+        yield img
+
+
+def benchmarkSets(args):
+    """ Compare the old (getObjDict/setAttributeValue) and the compiled
+    (row codec) paths for writing and reading rows of a SetOfParticles.
+    """
+    from pyworkflow.em.data import SetOfParticles
+
+    n = args.size
+    workDir = tempfile.mkdtemp(prefix='benchmark_sets_')
+    dbName = os.path.join(workDir, 'particles.sqlite')
+    timer = Timer()
+    print "Sets benchmark with %d particles (db: %s)" % (n, dbName)
+
+    img = _createParticle()
+    partSet = SetOfParticles(filename=dbName)
+    partSet.setSamplingRate(1.5)
+    timer.measure('append (bulk insert)', partSet.appendMany,
+                  _iterParticles(img, n))
+    partSet.write()
+
+    mapper = partSet._getMapper()
+    getValues = mapper._SqliteFlatMapper__getColumnValues
+
+    def _encodeOld():
+        for item in _iterParticles(img, n):
+            tuple(item.getObjDict().values())
+
+    def _encodeNew():
+        for item in _iterParticles(img, n):
+            getValues(item)
+
+    timer.measure('encode rows: getObjDict', _encodeOld)
+    timer.measure('encode rows: compiled', _encodeNew)
+    timer.speedup('encode rows: getObjDict', 'encode rows: compiled')
+    partSet.close()
+
+    partSet = SetOfParticles(filename=dbName)
+    mapper = partSet._getMapper()
+
+    def _decodeOld():
+        obj = mapper.selectFirst()
+        db = mapper.db
+        for row in db.selectAll():
+            obj.setObjId(row['id'])
+            for c, attrName in mapper._objColumns:
+                obj.setAttributeValue(attrName, row[c])
+
+    def _decodeNew():
+        for _ in mapper.selectAll():
+            pass
+
+    timer.measure('iterate rows: setAttributeValue', _decodeOld)
+    timer.measure('iterate rows: compiled', _decodeNew)
+    timer.speedup('iterate rows: setAttributeValue', 'iterate rows: compiled')
+    partSet.close()
+
+    pwutils.cleanPath(workDir)
+
+
+#------------------- Project benchmark ----------------------------
+
+def _createRunClasses():
+    """ Create some classes that mimic the structure of a protocol run:
+    many parameters, some nested objects, pointers and a list of steps.
+    """
+    import pyworkflow.object as pwobj
+
+    class FakeStep(pwobj.OrderedObject):
+        def __init__(self, **kwargs):
+            pwobj.OrderedObject.__init__(self, **kwargs)
+            self.funcName = pwobj.String('runStep')
+            self.status = pwobj.String('finished')
+            self.initTime = pwobj.String('2015-01-01 10:00:00')
+            self.endTime = pwobj.String('2015-01-01 10:05:00')
+
+    class FakeRun(pwobj.OrderedObject):
+        def __init__(self, **kwargs):
+            pwobj.OrderedObject.__init__(self, **kwargs)
+            for i in range(30):
+                setattr(self, 'param%02d' % i, pwobj.Float(i))
+            self.inputPointer = pwobj.Pointer()
+            self.runName = pwobj.String('fake run')
+            self.steps = pwobj.List()
+
+    return {'FakeStep': FakeStep, 'FakeRun': FakeRun,
+            'Float': pwobj.Float, 'String': pwobj.String,
+            'Pointer': pwobj.Pointer, 'List': pwobj.List}
+
+
+def benchmarkProject(args):
+    """ Compare loading all runs of a synthetic project with a LIKE
+    query (the old way) and an indexed range query for the childs of each run.
+    """
+    from pyworkflow.mapper import SqliteMapper
+
+    n = args.size
+    workDir = tempfile.mkdtemp(prefix='benchmark_project_')
+    dbName = os.path.join(workDir, 'project.sqlite')
+    timer = Timer()
+    print "Project benchmark with %d runs (db: %s)" % (n, dbName)
+
+    classes = _createRunClasses()
+    mapper = SqliteMapper(dbName, classes)
+    prevRun = None
+    for i in range(n):
+        run = classes['FakeRun']()
+        run.inputPointer.set(prevRun)
+        for _ in range(5):
+            run.steps.append(classes['FakeStep']())
+        mapper.insert(run)
+        prevRun = run
+    mapper.commit()
+    mapper.close()
+
+    mapper = SqliteMapper(dbName, classes)
+    db = mapper.db
+
+    def _selectByAncestorLike(namePrefix):
+        db.executeCommand(db.selectCmd("name LIKE '%s.%%'" % namePrefix))
+        return db._results()
+
+    def _loadOld():
+        # Load each run with a LIKE query for its childs, as done before
+        db.selectObjectsByAncestor = _selectByAncestorLike
+        try:
+            return list(mapper.selectAll(iterate=True))
+        finally:
+            del db.selectObjectsByAncestor
+
+    def _loadNew():
+        return list(mapper.selectAll(iterate=True))
+
+    timer.measure('load runs: LIKE per run', _loadOld)
+    runs = timer.measure('load runs: indexed name range', _loadNew)
+    timer.speedup('load runs: LIKE per run', 'load runs: indexed name range')
+    assert len(runs) == n
+    mapper.close()
+
+    pwutils.cleanPath(workDir)
+
+
+#------------------- Steps benchmark ----------------------------
+
+def _createParallelSteps(n):
+    """ Create the steps of a ProtTestParallel with about n steps
+    (iterations of an init step, 8 parallel steps and an end step),
+    where all the steps do nothing.
+    """
+    from pyworkflow.em.protocol.parallel import ProtTestParallel
+
+    def _doNothing(*args):
+        pass
+
+    prot = ProtTestParallel()
+    prot.numberOfParallelSleeps.set(8)
+    prot.numberOfIterations.set(max(1, n / 10))
+    prot._insertAllSteps()
+    for step in prot._steps:
+        step._func = _doNothing
+    return prot._steps
+
+
+def _runStepsPolling(steps, nThreads, stepStartedCallback, stepFinishedCallback):
+    """ Run the steps as the ThreadStepExecutor did before: polling
+    the running steps every 0.1 seconds and scanning all the steps
+    to find the next one ready to run.
+    """
+    import threading
+    import pyworkflow.protocol.constants as cts
+    from pyworkflow.protocol.executor import StepThread
+
+    sharedLock = threading.Lock()
+    runningSteps = {}
+    freeNodes = range(nThreads)
+
+    def getRunnable():
+        for s in steps:
+            if (s.getStatus() == cts.STATUS_NEW and
+                    all(steps[i-1].isFinished() for i in s._prerequisites)):
+                return s
+        return None
+
+    while True:
+        with sharedLock:
+            nodesFinished = [node for node, step in runningSteps.iteritems()
+                             if not step.isRunning()]
+        for node in nodesFinished:
+            step = runningSteps.pop(node)
+            freeNodes.append(node)
+            stepFinishedCallback(step)
+        with sharedLock:
+            if freeNodes:
+                step = getRunnable()
+                if step is not None:
+                    step.setRunning()
+                    stepStartedCallback(step)
+                    node = freeNodes.pop()
+                    runningSteps[node] = step
+                    t = StepThread(node, step, sharedLock)
+                    t.daemon = True
+                    t.start()
+                elif not any(s.isRunning() for s in steps):
+                    break
+        time.sleep(0.1)
+
+
+def benchmarkSteps(args):
+    """ Compare the time spent scheduling steps that do nothing with the
+    old ThreadStepExecutor (polling) and the current one (event driven).
+    Since the old one only dispatches a step every 0.1 seconds,
+    it is run with at most 500 steps.
+    """
+    from pyworkflow.protocol.executor import ThreadStepExecutor
+
+    nThreads = 4
+    timer = Timer()
+    nOld = min(args.size, 500)
+    print "Steps benchmark with %d threads" % nThreads
+
+    def _started(step):
+        pass
+
+    def _finished(step):
+        return True
+
+    steps = _createParallelSteps(nOld)
+    timer.measure('run %d steps: polling' % len(steps), _runStepsPolling,
+                  steps, nThreads, _started, _finished)
+    assert all(s.isFinished() for s in steps)
+
+    steps = _createParallelSteps(nOld)
+    executor = ThreadStepExecutor(None, nThreads)
+    timer.measure('run %d steps: event driven' % len(steps),
+                  executor.runSteps, steps, _started, _finished)
+    assert all(s.isFinished() for s in steps)
+    timer.speedup('run %d steps: polling' % len(steps),
+                  'run %d steps: event driven' % len(steps))
+
+    steps = _createParallelSteps(args.size)
+    timer.measure('run %d steps: event driven' % len(steps),
+                  executor.runSteps, steps, _started, _finished)
+    assert all(s.isFinished() for s in steps)
+    elapsed = timer.results[-1][1]
+    print "  %-40s %10.3f ms" % ('time per step', elapsed * 1000 / len(steps))
+
+
+#------------------- Startup benchmark ----------------------------
+
+# Code run in a new python process to measure the cold start, the
+# first one does what is done by runprotocol before running the steps
+STARTUP_CODE = {
+    'runprotocol': ("from pyworkflow.em import *\n"
+                    "from pyworkflow.protocol import getProtocolFromDb\n"
+                    "getProtocolFromDb(%(path)r, 'project.sqlite', %(protId)d, chdir=True)\n"),
+    'Project.load': ("from pyworkflow.project import Project\n"
+                     "Project(%(path)r).load()\n")
+    }
+
+
+def _createSampleProject(path, n):
+    """ Create a project with n runs of a simple protocol. """
+    from pyworkflow.project import Project
+    from pyworkflow.em.protocol.parallel import ProtTestParallel
+
+    cwd = os.getcwd()
+    proj = Project(path)
+    proj.create()
+    for _ in range(n):
+        prot = proj.newProtocol(ProtTestParallel)
+        proj.saveProtocol(prot)
+    os.chdir(cwd)
+    return prot.getObjId()
+
+
+def benchmarkStartup(args):
+    """ Measure the time spent by runprotocol (until the protocol is
+    loaded and the steps can start) and by Project.load, starting a new
+    python process (cold) and once all modules are imported (warm).
+    If --budget is given, fail when a cold start takes longer.
+    """
+    from pyworkflow.protocol import getProtocolFromDb
+    from pyworkflow.project import Project
+
+    n = min(args.size, 100)
+    workDir = tempfile.mkdtemp(prefix='benchmark_startup_')
+    projPath = os.path.join(workDir, 'project')
+    timer = Timer()
+    print "Startup benchmark with a project of %d runs (%s)" % (n, projPath)
+
+    protId = _createSampleProject(projPath, n)
+    codeArgs = {'path': projPath, 'protId': protId}
+    cwd = os.getcwd()
+
+    def _loadProtocol():
+        getProtocolFromDb(projPath, 'project.sqlite', protId, chdir=True)
+        os.chdir(cwd)
+
+    def _loadProject():
+        Project(projPath).load()
+        os.chdir(cwd)
+
+    for label, func in [('runprotocol', _loadProtocol),
+                        ('Project.load', _loadProject)]:
+        cmd = [sys.executable, '-c', STARTUP_CODE[label] % codeArgs]
+        timer.measure('%s: cold' % label, subprocess.check_call, cmd)
+        func() # Make sure all the modules are imported
+        timer.measure('%s: warm' % label, func)
+
+    pwutils.cleanPath(workDir)
+
+    if args.budget is not None:
+        exceeded = [(label, elapsed) for label, elapsed in timer.results
+                    if label.endswith('cold') and elapsed > args.budget]
+        for label, elapsed in exceeded:
+            print "  %s took %0.3f s, budget is %0.3f s" % (label, elapsed,
+                                                            args.budget)
+        if exceeded:
+            sys.exit(1)
+
+
+#------------------- STAR benchmark ----------------------------
+
+# Code to read a STAR file in a new process, printing the
+# peak memory (in Kb) used by the process
+STAR_CODE = {
+    'xmipp.MetaData': ("import xmipp\n"
+                       "mdIn = xmipp.MetaData(%(fn)r)\n"
+                       "labels = mdIn.getActiveLabels()\n"
+                       "for objId in mdIn:\n"
+                       "    [mdIn.getValue(l, objId) for l in labels]\n"),
+    'StarReader.iterRows': ("from pyworkflow.em.star import StarReader\n"
+                            "for row in StarReader(%(fn)r).iterRows():\n"
+                            "    pass\n"),
+    'StarReader.iterChunks': ("from pyworkflow.em.star import StarReader\n"
+                              "for chunk in StarReader(%(fn)r).iterChunks():\n"
+                              "    pass\n"),
+    'StarReader.readArrays': ("from pyworkflow.em.star import StarReader\n"
+                              "StarReader(%(fn)r).readArrays()\n"),
+    }
+
+MAXRSS_CODE = ("import resource\n"
+               "print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n")
+
+
+def _writeParticlesStar(fn, n):
+    """ Write a particles STAR file with n rows and some
+    typical Relion columns.
+    """
+    from collections import OrderedDict
+    import numpy as np
+    from pyworkflow.em.star import StarWriter, CHUNK_SIZE
+
+    with StarWriter(fn) as writer:
+        writer.beginBlock('Particles', ['rlnImageName', 'rlnMicrographName',
+                                        'rlnCoordinateX', 'rlnCoordinateY',
+                                        'rlnDefocusU', 'rlnDefocusV',
+                                        'rlnDefocusAngle', 'rlnVoltage',
+                                        'rlnAngleRot', 'rlnAngleTilt',
+                                        'rlnAnglePsi', 'rlnOriginX',
+                                        'rlnOriginY', 'rlnClassNumber'])
+        for first in range(0, n, CHUNK_SIZE):
+            ids = np.arange(first, min(first + CHUNK_SIZE, n))
+            m = len(ids)
+            arrays = OrderedDict()
+            arrays['rlnImageName'] = ['%06d@particles_%03d.mrcs'
+                                      % (i % 1000 + 1, i / 1000) for i in ids]
+            arrays['rlnMicrographName'] = ['mic_%03d.mrc' % (i / 1000)
+                                           for i in ids]
+            arrays['rlnCoordinateX'] = ids % 4096
+            arrays['rlnCoordinateY'] = ids % 3072
+            arrays['rlnDefocusU'] = np.random.uniform(10000, 30000, m)
+            arrays['rlnDefocusV'] = arrays['rlnDefocusU'] + 500
+            arrays['rlnDefocusAngle'] = np.random.uniform(0, 180, m)
+            arrays['rlnVoltage'] = np.ones(m) * 300
+            arrays['rlnAngleRot'] = np.random.uniform(-180, 180, m)
+            arrays['rlnAngleTilt'] = np.random.uniform(0, 180, m)
+            arrays['rlnAnglePsi'] = np.random.uniform(-180, 180, m)
+            arrays['rlnOriginX'] = np.random.uniform(-10, 10, m)
+            arrays['rlnOriginY'] = np.random.uniform(-10, 10, m)
+            arrays['rlnClassNumber'] = ids % 10 + 1
+            writer.writeArrays(arrays)
+
+
+def benchmarkStar(args):
+    """ Compare reading a STAR file with xmipp.MetaData and with the
+    StarReader (row by row, by chunks and the whole block at once).
+    Each reading is done in a new process to report its peak memory.
+    """
+    n = args.size
+    workDir = tempfile.mkdtemp(prefix='benchmark_star_')
+    fn = os.path.join(workDir, 'particles.star')
+    timer = Timer()
+    print "STAR benchmark with %d particles (%s)" % (n, fn)
+
+    timer.measure('write: StarWriter', _writeParticlesStar, fn, n)
+    print "  %-40s %10.1f Mb" % ('file size', os.path.getsize(fn) / 1e6)
+
+    try:
+        subprocess.check_call([sys.executable, '-c', 'import xmipp'])
+        labels = sorted(STAR_CODE.keys())
+    except subprocess.CalledProcessError:
+        print "  xmipp could not be imported, skipping xmipp.MetaData"
+        labels = sorted(k for k in STAR_CODE if not k.startswith('xmipp'))
+
+    for label in labels:
+        cmd = [sys.executable, '-c',
+               STAR_CODE[label] % {'fn': fn} + MAXRSS_CODE]
+        output = timer.measure('read: %s' % label, subprocess.check_output,
+                               cmd)
+        print "  %-40s %10.1f Mb" % ('peak memory', int(output) / 1024.)
+
+    if 'xmipp.MetaData' in labels:
+        for label in labels:
+            if label.startswith('StarReader'):
+                timer.speedup('read: xmipp.MetaData', 'read: %s' % label)
+
+    pwutils.cleanPath(workDir)
+
+
+BENCHMARKS = {'sets': benchmarkSets,
+              'project': benchmarkProject,
+              'steps': benchmarkSteps,
+              'startup': benchmarkStartup,
+              'star': benchmarkStar}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()),
+                        help="Benchmark to run.")
+    parser.add_argument('--size', type=int, default=100000,
+                        help="Number of items used in the benchmark.")
+    parser.add_argument('--budget', type=float,
+                        default=os.environ.get('SCIPION_STARTUP_BUDGET'),
+                        help="Maximum time (in seconds) of a cold start "
+                             "(used by the startup benchmark).")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()